@@ -0,0 +1,180 @@
+"""Storage benchmark comparing the stock and tuned SQLite profiles.
+
+Each profile gets a fresh database filled with synthetic galleries spread
+over a year and tasks, then times single-row upserts, point reads, the
+link sweeper's time-range scan, a created_at window count and
+`get_all_tasks`. The stock profile runs without the tuning pragmas and
+without the secondary indexes, as databases created before them did.
+
+    python -m benchmarks.db --galleries 100000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def timed_calls(count: int, call) -> list:
+    samples = []
+    for i in range(count):
+        start = time.perf_counter()
+        await call(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def fill(args, rnd: random.Random) -> None:
+    from tortoise import Tortoise
+
+    from exhenbot.storage import Gallery, Task
+
+    now = datetime.now(timezone.utc)
+    for first in range(1, args.galleries + 1, 5000):
+        await Gallery.bulk_create(
+            [
+                Gallery(
+                    gid=gid,
+                    url=f"https://exhentai.org/g/{gid}/{gid:010x}/",
+                    tags={"language": ["chinese"], "parody": [f"series {gid % 500}"]},
+                    title=f"Gallery {gid}",
+                    telegraph_url=f"https://telegra.ph/bench-{gid}",
+                    chat_ids=[gid % 1000],
+                )
+                for gid in range(first, min(first + 5000, args.galleries + 1))
+            ]
+        )
+    await Task.bulk_create(
+        [Task(chat_id=-1000000000000 - i) for i in range(args.tasks)]
+    )
+    ## auto_now fields cannot be set through the ORM, spread them over a year
+    conn = Tortoise.get_connection("default")
+    values = []
+    for gid in range(1, args.galleries + 1):
+        created = now - timedelta(seconds=rnd.randrange(365 * 86400))
+        updated = created + timedelta(seconds=rnd.randrange(86400))
+        values.append([str(created), str(updated), gid])
+    await conn.execute_many(
+        f"UPDATE {Gallery._meta.db_table} SET created_at = ?, updated_at = ? "
+        "WHERE gid = ?",
+        values,
+    )
+    await conn.execute_many(
+        f"UPDATE {Task._meta.db_table} SET created_at = ? WHERE chat_id = ?",
+        [
+            [str(now - timedelta(seconds=i)), -1000000000000 - i]
+            for i in range(args.tasks)
+        ],
+    )
+
+
+async def run_profile(args, tuned: bool) -> dict:
+    from tortoise import Tortoise
+
+    from exhenbot.storage import (
+        Gallery,
+        db_close,
+        db_init,
+        get_all_tasks,
+        get_galleries_to_sweep,
+        get_gallery,
+        upsert_gallery,
+    )
+
+    directory = tempfile.mkdtemp(prefix="exhenbot-db-")
+    await db_init(f"sqlite://{os.path.join(directory, 'bench.db')}", tuned=tuned)
+    conn = Tortoise.get_connection("default")
+    if not tuned:
+        _, rows = await conn.execute_query(
+            "SELECT name FROM sqlite_master WHERE type = 'index' "
+            "AND name LIKE '%\\_at\\_idx' ESCAPE '\\'"
+        )
+        for row in rows:
+            await conn.execute_script(f"DROP INDEX {row['name']}")
+    rnd = random.Random(args.seed)
+    await fill(args, rnd)
+    await conn.execute_script("ANALYZE")
+    now = datetime.now(timezone.utc)
+
+    async def upsert(i: int) -> None:
+        gid = args.galleries + 1 + i
+        await upsert_gallery(
+            gid=gid,
+            url=f"https://exhentai.org/g/{gid}/x/",
+            tags={"language": ["chinese"]},
+            title=f"Gallery {gid}",
+            telegraph_url="https://telegra.ph/bench",
+            chat_id=i % 1000,
+        )
+
+    async def read(i: int) -> None:
+        await get_gallery(rnd.randint(1, args.galleries))
+
+    async def sweep(i: int) -> None:
+        cursor = now - timedelta(seconds=rnd.randrange(365 * 86400))
+        await get_galleries_to_sweep((cursor, 0), now - timedelta(days=1), 20)
+
+    async def window(i: int) -> None:
+        start = now - timedelta(days=rnd.randrange(1, 365))
+        await Gallery.filter(
+            created_at__gte=start, created_at__lt=start + timedelta(days=1)
+        ).count()
+
+    async def tasks(i: int) -> None:
+        await get_all_tasks()
+
+    results = {
+        "upsert": await timed_calls(args.writes, upsert),
+        "get_gallery": await timed_calls(args.reads, read),
+        "sweep_scan": await timed_calls(args.scans, sweep),
+        "created_window": await timed_calls(args.scans, window),
+        "get_all_tasks": await timed_calls(args.scans, tasks),
+    }
+    await db_close()
+    return results
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--galleries", type=int, default=100000)
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--writes", type=int, default=1000)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--scans", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    os.environ.setdefault("EXH_COOKIE", "ipb_member_id=0; ipb_pass_hash=bench")
+
+    profiles = {
+        name: asyncio.run(run_profile(args, tuned))
+        for name, tuned in (("stock", False), ("tuned", True))
+    }
+    print(
+        f"{'case':<16}"
+        + "".join(f"{name + ' p50':>13}{name + ' p99':>13}" for name in profiles)
+        + f"{'speedup':>10}"
+    )
+    for case in profiles["stock"]:
+        row = f"{case:<16}"
+        for results in profiles.values():
+            samples = results[case]
+            row += f"{statistics.median(samples) * 1000:>11.3f}ms"
+            row += f"{percentile(samples, 0.99) * 1000:>11.3f}ms"
+        speedup = statistics.median(profiles["stock"][case]) / statistics.median(
+            profiles["tuned"][case]
+        )
+        print(f"{row}{speedup:>9.1f}x")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
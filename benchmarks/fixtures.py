@@ -0,0 +1,109 @@
+import json
+import random
+from pathlib import Path
+from typing import Dict, List, Optional
+
+NAMESPACES = ["language", "parody", "character", "group", "artist", "female", "male"]
+
+
+def gallery_tags(gid: int, count: int = 12) -> List[str]:
+    rnd = random.Random(gid)
+    return [f"{rnd.choice(NAMESPACES)}:tag {rnd.randrange(2000)}" for _ in range(count)]
+
+
+def search_html(gids: List[int], base_url: str = "https://exhentai.org") -> str:
+    """Search result page in the extended (`gl2e`/`glname`) layout."""
+    rows = []
+    for gid in gids:
+        tags = "".join(
+            f'<div class="gt" title="{t}">{t.split(":")[1]}</div>'
+            for t in gallery_tags(gid)
+        )
+        rows.append(
+            "<tr><td class='glname'>"
+            f'<a href="{base_url}/g/{gid}/{gid:010x}/">'
+            f'<div class="glink">Gallery {gid}</div><div>{tags}</div></a>'
+            "</td></tr>"
+        )
+    return (
+        "<html><head><title>ExHentai.org</title></head><body>"
+        f"<table class='itg glte'>{''.join(rows)}</table></body></html>"
+    )
+
+
+def gallery_html(gid: int) -> str:
+    tags = "".join(
+        f'<a id="ta_{t.replace(" ", "_")}" href="/tag/{t.replace(" ", "+")}">'
+        f"{t.split(':')[1]}</a>"
+        for t in gallery_tags(gid)
+    )
+    return (
+        f"<html><head><title>Gallery {gid} - ExHentai.org</title></head><body>"
+        f'<h1 id="gn">Gallery {gid}</h1><h1 id="gj">Gallery {gid} (JP)</h1>'
+        f'<div id="taglist"><table><tr><td>{tags}</td></tr></table></div>'
+        "</body></html>"
+    )
+
+
+def mpv_html(gid: int, pages: int) -> str:
+    imagelist = [
+        {"n": f"{i:04d}.jpg", "k": f"{gid * 1000 + i:010x}", "t": ""}
+        for i in range(pages)
+    ]
+    return (
+        "<html><head><script>"
+        f"var gid = {gid};\nvar pagecount = {pages};\n"
+        f'var mpvkey = "mpvkey{gid}";\n'
+        f"var imagelist = {json.dumps(imagelist)};\n"
+        "</script></head><body></body></html>"
+    )
+
+
+def imagedispatch_json(gid: int, page: int, host: str = "img.bench") -> Dict:
+    return {
+        "d": "1280 x 1839 :: 214.2 KiB",
+        "o": "Download original 1734 x 2491 1.41 MiB source",
+        "lf": f"fullimg/{gid}/{page}/hash/img{page}.jpg",
+        "ls": "",
+        "ll": f"hash-{gid}-{page}/img{page}.webp",
+        "lo": f"s/hash/{gid}-{page}",
+        "xres": "1280",
+        "yres": "1839",
+        "i": f"https://{host}/h/{gid}/{page}.webp",
+        "s": "1",
+    }
+
+
+def tag_database(tags_per_namespace: int = 2000) -> Dict:
+    """EhTagTranslation `db.full.json` shaped database.
+
+    The real database has ~9 namespaces and tens of thousands of tags.
+    """
+    return {
+        "head": {"sha": "bench"},
+        "version": 6,
+        "data": [
+            {
+                "namespace": namespace,
+                "frontMatters": {"name": f"{namespace}-zh"},
+                "count": tags_per_namespace,
+                "data": {
+                    f"tag {i}": {
+                        "name": {"text": f"标签{i}"},
+                        "intro": {"text": "x" * 40},
+                        "links": {"text": ""},
+                    }
+                    for i in range(tags_per_namespace)
+                },
+            }
+            for namespace in NAMESPACES
+        ],
+    }
+
+
+def load_recorded(directory: Optional[str], name: str) -> Optional[str]:
+    """Return a recorded fixture file if it exists."""
+    if not directory:
+        return None
+    path = Path(directory) / name
+    return path.read_text(encoding="utf-8") if path.exists() else None
@@ -0,0 +1,230 @@
+"""Micro-benchmarks for the CPU bound code that runs on the event loop.
+
+Each case is timed with timeit in rounds that alternate with a fixed
+calibration workload, and scored by its time relative to that workload.
+Scores, not absolute timings, are compared against the stored baseline, so
+the gate holds across machines of different speed; the run fails when a case
+scores worse than the baseline by more than the tolerance.
+
+    python -m benchmarks.micro                 # run and print
+    python -m benchmarks.micro --save          # update benchmarks/baseline.json
+    python -m benchmarks.micro --check         # exit 1 on regressions
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+from .fixtures import (
+    gallery_html,
+    gallery_tags,
+    load_recorded,
+    mpv_html,
+    search_html,
+    tag_database,
+)
+
+BASELINE = Path(__file__).with_name("baseline.json")
+BASE_URL = "https://exhentai.org"
+GID = 3000000
+MPV_PAGES = 2000
+# The real db.full.json holds roughly 45k tags
+TAGS_PER_NAMESPACE = 6500
+# Parsing plus interpreted loops, roughly the mix the cases spend time on
+CALIBRATION_HTML = (
+    "<html><body>"
+    + "".join(
+        f'<div class="c{i % 7}"><a href="/g/{i}/{i:010x}/">Item {i}</a></div>'
+        for i in range(200)
+    )
+    + "</body></html>"
+)
+
+
+def load_main():
+    """Import the bot module with placeholder settings."""
+    os.environ.setdefault("EXH_COOKIE", "ipb_member_id=0; ipb_pass_hash=bench")
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:bench")
+    os.environ.pop("METRICS_PORT", None)
+    from exhenbot import __main__ as main
+
+    return main
+
+
+def calibration() -> Dict[str, int]:
+    from lxml import html as lxml_html
+
+    doc = lxml_html.fromstring(CALIBRATION_HTML)
+    counts: Dict[str, int] = {}
+    for a in doc.iter("a"):
+        key = a.get("href").split("/")[2]
+        counts[key] = counts.get(key, 0) + len(a.text_content().split())
+    return counts
+
+
+def build_cases(args) -> Dict[str, Callable[[], object]]:
+    from exhenbot.exhentai_client import (
+        EhTagConverter,
+        parse_gallery_page,
+        parse_mpv_page,
+        parse_search_page,
+    )
+    from exhenbot.storage import Gallery
+
+    main = load_main()
+    gallery_url = f"{BASE_URL}/g/{GID}/{GID:010x}/"
+    mpv_url = gallery_url.replace("/g/", "/mpv/")
+    search = load_recorded(args.fixtures, "search.html") or search_html(
+        list(range(GID, GID - 25, -1))
+    )
+    gallery = load_recorded(args.fixtures, "gallery.html") or gallery_html(GID)
+    mpv = load_recorded(args.fixtures, "mpv.html") or mpv_html(GID, MPV_PAGES)
+
+    ehtag = EhTagConverter(local_dir=".")
+    if args.tag_db:
+        ehtag.data = json.loads(Path(args.tag_db).read_text(encoding="utf-8"))
+    else:
+        ehtag.data = tag_database(TAGS_PER_NAMESPACE)
+    tags = gallery_tags(GID, 40)
+    translated = ehtag.batch_translate_tags(tags)
+    message_gallery = Gallery(
+        gid=GID,
+        url=gallery_url,
+        title=f"[Circle (Artist)] Gallery {GID} [Chinese] [DL版]",
+        telegraph_url="https://telegra.ph/Gallery-01-01",
+        tags=translated,
+    )
+
+    return {
+        "search_page": lambda: parse_search_page(search, BASE_URL),
+        "gallery_page": lambda: parse_gallery_page(gallery, gallery_url),
+        "mpv_page_2000": lambda: parse_mpv_page(mpv, mpv_url),
+        "translate_tag": lambda: ehtag.translate_tag(tags[-1]),
+        "batch_translate_tags_40": lambda: ehtag.batch_translate_tags(tags),
+        "generate_telegraph_message": lambda: main.generate_telegraph_message(
+            message_gallery
+        ),
+    }
+
+
+def _timer(fn: Callable[[], object], min_time: float) -> Tuple[timeit.Timer, int]:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return timer, max(1, int(number * min_time / 0.2))
+
+
+def measure(fn: Callable[[], object], rounds: int, min_time: float) -> Dict:
+    """Time `fn`, each round right after a round of the calibration workload.
+
+    The score is the median over rounds of the case time divided by the
+    calibration time just before it, so a host that runs slower for a while
+    slows both sides of the ratio.
+    """
+    timer, number = _timer(fn, min_time)
+    unit_timer, unit_number = _timer(calibration, min_time / 2)
+    samples, scores = [], []
+    for _ in range(rounds):
+        unit = unit_timer.timeit(unit_number) / unit_number
+        sample = timer.timeit(number) / number
+        samples.append(sample)
+        scores.append(sample / unit)
+    return {
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "score": statistics.median(scores),
+        "number": number,
+    }
+
+
+def compare(
+    results: Dict[str, Dict], baseline: Dict, tolerance: float
+) -> List[Tuple[str, float]]:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("cases", {}).get(name)
+        if base is None or "score" not in base:
+            continue
+        ratio = result["score"] / base["score"]
+        result["ratio"] = ratio
+        if ratio > 1 + tolerance:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def print_results(results: Dict[str, Dict]) -> None:
+    print(f"{'case':<30}{'median':>12}{'min':>12}{'stdev':>12}{'vs base':>10}")
+    for name, r in results.items():
+        ratio = f"{r['ratio']:.2f}x" if "ratio" in r else "-"
+        print(
+            f"{name:<30}{r['median'] * 1e6:>10.1f}us{r['min'] * 1e6:>10.1f}us"
+            f"{r['stdev'] * 1e6:>10.1f}us{ratio:>10}"
+        )
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-k", dest="select", help="only run cases containing this")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.2, help="s per round")
+    parser.add_argument("--save", action="store_true", help="write the baseline")
+    parser.add_argument("--check", action="store_true", help="fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--baseline", default=str(BASELINE))
+    parser.add_argument("--fixtures", help="directory with recorded html pages")
+    parser.add_argument("--tag-db", help="path to a real db.full.json")
+    args = parser.parse_args(argv)
+
+    from loguru import logger
+
+    logger.remove()
+    cases = build_cases(args)
+    results = {
+        name: measure(fn, args.rounds, args.min_time)
+        for name, fn in cases.items()
+        if not args.select or args.select in name
+    }
+
+    baseline_path = Path(args.baseline)
+    regressions = []
+    if baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.tolerance)
+    print_results(results)
+
+    if args.save:
+        baseline_path.write_text(
+            json.dumps(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    # Absolute timings are for reference, --check uses scores
+                    "cases": {
+                        name: {
+                            "score": r["score"],
+                            "median": r["median"],
+                            "min": r["min"],
+                        }
+                        for name, r in results.items()
+                    },
+                },
+                indent=2,
+            )
+            + "\n",
+            encoding="utf-8",
+        )
+        print(f"Saved baseline to {baseline_path}")
+    elif args.check and regressions:
+        for name, ratio in regressions:
+            print(f"REGRESSION {name}: {ratio:.2f}x baseline", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""End-to-end benchmark of parse_url/job_process without network access.
+
+Every upstream (ExHentai, catbox, imgbb, Telegraph, EhTagTranslation, image
+servers) is replaced by an httpx MockTransport that serves synthetic or
+recorded pages with injectable latency and error rates. S3 is replaced by an
+in-process stub since aiobotocore does not go through httpx.
+
+    python -m benchmarks.offline --mode job --galleries 25 --pages 40
+"""
+
+import argparse
+import asyncio
+import hashlib
+import importlib
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+from loguru import logger
+
+from .fixtures import (
+    gallery_html,
+    imagedispatch_json,
+    load_recorded,
+    mpv_html,
+    search_html,
+    tag_database,
+)
+
+UPSTREAM_HOSTS = {"exhentai.org", "s.exhentai.org", "img.bench"}
+UPLOAD_HOSTS = {"catbox.moe", "api.imgbb.com"}
+
+
+class MockUpstreams:
+    def __init__(self, args):
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.pages_created = 0
+        self.requests = defaultdict(int)
+        self.tag_db = json.dumps(tag_database(args.tags_per_namespace))
+        self.recorded = {
+            name: load_recorded(args.fixtures, name)
+            for name in ("search.html", "gallery.html", "mpv.html")
+        }
+
+    def _gids(self, next_gid):
+        top = (next_gid or self.args.first_gid + self.args.galleries) - 1
+        return [top - i for i in range(self.args.galleries) if top - i > 0]
+
+    async def _delay(self, host: str) -> None:
+        if host in UPSTREAM_HOSTS:
+            mean = self.args.latency
+        elif host in UPLOAD_HOSTS:
+            mean = self.args.upload_latency
+        else:
+            mean = self.args.latency / 2
+        if mean > 0:
+            await asyncio.sleep(self.rnd.expovariate(1000 / mean))
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        host, path = request.url.host, request.url.path
+        self.requests[host] += 1
+        await self._delay(host)
+        if host in UPSTREAM_HOSTS | UPLOAD_HOSTS and request.method != "HEAD":
+            if self.rnd.random() < self.args.error_rate:
+                return httpx.Response(503, text="Service Unavailable")
+        if host == "exhentai.org":
+            return self._exhentai(request, path)
+        if host == "s.exhentai.org" and path == "/api.php":
+            payload = json.loads(request.content)
+            return httpx.Response(
+                200, json=imagedispatch_json(payload["gid"], payload["page"])
+            )
+        if host == "img.bench":
+            size = str(self.args.image_size)
+            if request.method == "HEAD":
+                return httpx.Response(200, headers={"Content-Length": size})
+            return httpx.Response(
+                200,
+                content=os.urandom(self.args.image_size),
+                headers={"Content-Type": "image/webp"},
+            )
+        if host == "e-hentai.org":
+            return httpx.Response(200, text="ok")
+        if host == "catbox.moe":
+            digest = hashlib.md5(request.content).hexdigest()[:12]
+            return httpx.Response(200, text=f"https://files.catbox.moe/{digest}.webp")
+        if host == "files.catbox.moe" or host == "i.ibb.co":
+            return httpx.Response(200, headers={"Content-Length": "1024"})
+        if host == "api.imgbb.com":
+            digest = hashlib.md5(request.content).hexdigest()[:12]
+            return httpx.Response(
+                200,
+                json={"success": True, "data": {"url": f"https://i.ibb.co/{digest}"}},
+            )
+        if host == "github.com":
+            if path.endswith("/sha"):
+                return httpx.Response(200, text="bench")
+            return httpx.Response(200, text=self.tag_db)
+        if host == "api.telegra.ph":
+            return self._telegraph(path)
+        return httpx.Response(404)
+
+    def _exhentai(self, request: httpx.Request, path: str) -> httpx.Response:
+        segments = path.strip("/").split("/")
+        if path == "/":
+            recorded = self.recorded["search.html"]
+            next_gid = request.url.params.get("next")
+            gids = self._gids(int(next_gid) if next_gid else None)
+            return httpx.Response(200, text=recorded or search_html(gids))
+        if segments[0] == "g":
+            gid = int(segments[1])
+            return httpx.Response(
+                200, text=self.recorded["gallery.html"] or gallery_html(gid)
+            )
+        if segments[0] == "mpv":
+            gid = int(segments[1])
+            return httpx.Response(
+                200, text=self.recorded["mpv.html"] or mpv_html(gid, self.args.pages)
+            )
+        return httpx.Response(404)
+
+    def _telegraph(self, path: str) -> httpx.Response:
+        method = path.strip("/").split("/")[0]
+        if method == "createAccount":
+            result = {"access_token": "bench", "short_name": "bench"}
+        elif method in ("createPage", "editPage"):
+            self.pages_created += 1
+            page = f"Bench-{self.pages_created}"
+            result = {"path": page, "url": f"https://telegra.ph/{page}"}
+        else:
+            return httpx.Response(200, json={"ok": False, "error": "METHOD_NOT_FOUND"})
+        return httpx.Response(200, json={"ok": True, "result": result})
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, **kwargs):
+        self.sent += 1
+
+    async def leave_chat(self, chat_id):
+        pass
+
+
+def percentile(values, q: float) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1]
+
+
+def report(args, main, bot, upstreams, trace_path, wall: float, galleries: int):
+    durations = defaultdict(list)
+    for line in trace_path.read_text(encoding="utf-8").splitlines():
+        s = json.loads(line)
+        name = s["name"]
+        if name == "upload_backend":
+            name = f"upload_backend.{s['attributes'].get('backend')}"
+        durations[name].append(s["duration_ms"])
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"mode:            {args.mode}")
+    print(f"galleries:       {galleries} x {args.pages} pages")
+    print(f"wall time:       {wall:.2f}s")
+    print(f"galleries/min:   {galleries / wall * 60:.1f}")
+    print(f"peak RSS:        {peak_rss:.1f} MiB")
+    print(f"messages sent:   {bot.sent}")
+    print(f"requests:        {dict(upstreams.requests)}")
+    print(f"pipeline:        {main.pipeline.stats()}")
+    print()
+    print(f"{'span':<28}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, values in sorted(durations.items()):
+        print(
+            f"{name:<28}{len(values):>8}"
+            f"{percentile(values, 50):>10.1f}"
+            f"{percentile(values, 95):>10.1f}"
+            f"{percentile(values, 99):>10.1f}"
+        )
+
+
+async def run(args, workdir: Path) -> None:
+    main = importlib.import_module("exhenbot.__main__")
+    main.build_clients()
+    from exhenbot.storage import db_close, db_init, upsert_task
+    from exhenbot.tracing import tracer
+
+    upstreams = MockUpstreams(args)
+    transport = httpx.MockTransport(upstreams)
+
+    def mock_client(client: httpx.AsyncClient) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            transport=transport,
+            headers=client.headers,
+            follow_redirects=True,
+        )
+
+    for session in main.client.sessions:
+        session.client = mock_client(session.client)
+    main.uploader.client = mock_client(main.uploader.client)
+    main.ehtag.client = mock_client(main.ehtag.client)
+    for account in main.telegraph.accounts:
+        account._telegraph.session = mock_client(account._telegraph.session)
+
+    async def s3_stub(content, content_type, filename):
+        await asyncio.sleep(args.upload_latency / 1000)
+        return f"https://s3.bench/{filename}"
+
+    main.uploader._s3_file_upload = s3_stub
+
+    trace_path = workdir / "traces.jsonl"
+    tracer.configure("jsonl", str(trace_path))
+    await db_init(os.environ["DATABASE_URL"])
+    await main.coordinator.start()
+    bot = FakeBot()
+    await main.sender.start(bot)
+    main.pipeline.start()
+
+    start = time.perf_counter()
+    latencies = []
+    if args.mode == "parse":
+        urls = [
+            f"https://exhentai.org/g/{gid}/{gid:010x}/" for gid in upstreams._gids(None)
+        ]
+        results = await asyncio.gather(
+            *(main.parse_url(url) for url in urls), return_exceptions=True
+        )
+        galleries = sum(1 for r in results if not isinstance(r, BaseException))
+    else:
+        interactive = asyncio.create_task(run_interactive(args, main))
+        for chat_id in range(1, args.tasks + 1):
+            await upsert_task(
+                chat_id=chat_id,
+                search="bench",
+                catogories=1017,
+                star=4,
+                author_name="bench",
+                author_url="",
+                query_depth=args.depth,
+            )
+        await main.registry.load()
+        await main.job_process(None)
+        galleries = args.galleries * args.depth
+        latencies = await interactive
+    wall = time.perf_counter() - start
+    while main.sender.workers:
+        await asyncio.sleep(0.05)
+
+    await main.coordinator.stop()
+    await main.pipeline.stop()
+    await main.sender.stop()
+    await db_close()
+    tracer.close()
+    report(args, main, bot, upstreams, trace_path, wall, galleries)
+    if latencies:
+        print()
+        print(
+            f"interactive:     {len(latencies)} parses during the job, "
+            f"p50 {percentile(latencies, 50):.2f}s, max {max(latencies):.2f}s"
+        )
+
+
+async def run_interactive(args, main) -> list:
+    """Parse galleries as a user would while the scheduled job is running."""
+    from exhenbot.priority import INTERACTIVE, use_lane
+
+    async def one(gid: int) -> float:
+        start = time.perf_counter()
+        with use_lane(INTERACTIVE):
+            try:
+                await main.parse_url(f"https://exhentai.org/g/{gid}/{gid:010x}/")
+            except Exception:
+                pass
+        return time.perf_counter() - start
+
+    await asyncio.sleep(args.interactive_delay)
+    gids = range(args.first_gid - args.interactive, args.first_gid)
+    return list(await asyncio.gather(*(one(gid) for gid in gids)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=("parse", "job"), default="job")
+    parser.add_argument("--galleries", type=int, default=25, help="per search page")
+    parser.add_argument("--pages", type=int, default=40, help="images per gallery")
+    parser.add_argument("--tasks", type=int, default=1, help="tasks in job mode")
+    parser.add_argument("--depth", type=int, default=1, help="search pages per task")
+    parser.add_argument("--first-gid", type=int, default=3000000)
+    parser.add_argument("--latency", type=float, default=80, help="ExHentai ms")
+    parser.add_argument("--upload-latency", type=float, default=250, help="ms")
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--image-size", type=int, default=200 * 1024)
+    parser.add_argument("--tags-per-namespace", type=int, default=2000)
+    parser.add_argument("--fixtures", help="directory with recorded html pages")
+    parser.add_argument(
+        "--interactive", type=int, default=0, help="user parses during the job"
+    )
+    parser.add_argument("--interactive-delay", type=float, default=1, help="s")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="ERROR")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+    with tempfile.TemporaryDirectory(prefix="exhenbot-bench-") as tmp:
+        workdir = Path(tmp)
+        os.environ.update(
+            {
+                "EXH_COOKIE": "ipb_member_id=0; ipb_pass_hash=bench",
+                "TELEGRAM_BOT_TOKEN": "0:bench",
+                "TELEGRAPH_ACCESS_TOKEN": "bench",
+                "LOCAL_DIR": str(workdir / "local"),
+                "DATABASE_URL": f"sqlite://{workdir / 'bench.db'}",
+            }
+        )
+        os.environ.pop("METRICS_PORT", None)
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 2000))
+        asyncio.run(run(args, workdir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Latency of the gallery full-text search on a large SQLite database.
+
+Fills a temporary database with synthetic galleries whose titles and
+translated tags mix CJK and latin text, then times `find_galleries` for a
+mix of tag, title, short-word and empty queries.
+
+    python -m benchmarks.search --galleries 100000 --queries 2000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+NAMESPACES = ["语言", "原作", "角色", "社团", "艺术家", "女性", "男性"]
+SYLLABLES = "蔚蓝档案原神碧蓝航线明日方舟少女前线偶像大师东方赛马娘魔法学园恋爱日常"
+
+
+def word(rnd: random.Random, length: int) -> str:
+    return "".join(rnd.choice(SYLLABLES) for _ in range(length))
+
+
+def vocabulary(seed: int, size: int = 3000) -> list:
+    rnd = random.Random(seed)
+    return [word(rnd, rnd.randint(2, 5)) for _ in range(size)]
+
+
+def gallery_row(gid: int, tags: list) -> dict:
+    rnd = random.Random(gid)
+    title = (
+        f"[{rnd.choice(tags)} (artist {rnd.randrange(5000)})] "
+        f"{word(rnd, rnd.randint(4, 12))} Vol.{rnd.randrange(20)} [中国翻訳]"
+    )
+    tag_dict = defaultdict(list)
+    for _ in range(rnd.randint(6, 20)):
+        tag_dict[rnd.choice(NAMESPACES)].append(rnd.choice(tags))
+    return {
+        "gid": gid,
+        "url": f"https://exhentai.org/g/{gid}/{gid:010x}/",
+        "title": title,
+        "tags": dict(tag_dict),
+        "telegraph_url": f"https://telegra.ph/bench-{gid}",
+    }
+
+
+def queries(rnd: random.Random, tags: list, count: int) -> list:
+    kinds = [
+        lambda: f"{rnd.choice(NAMESPACES)}:{rnd.choice(tags)}",
+        lambda: rnd.choice(tags),
+        lambda: f"{rnd.choice(tags)} {rnd.choice(tags)}",
+        lambda: f"artist {rnd.randrange(5000)}",
+        lambda: rnd.choice(SYLLABLES) * 2,
+        lambda: "",
+    ]
+    return [rnd.choice(kinds)() for _ in range(count)]
+
+
+async def run(args) -> None:
+    from exhenbot.storage import Gallery, db_close, db_init, find_galleries
+
+    directory = tempfile.mkdtemp(prefix="exhenbot-search-")
+    await db_init(f"sqlite://{os.path.join(directory, 'bench.db')}")
+    tags = vocabulary(args.seed)
+    start = time.perf_counter()
+    for first in range(1, args.galleries + 1, 5000):
+        last = min(first + 5000, args.galleries + 1)
+        await Gallery.bulk_create(
+            [Gallery(**gallery_row(gid, tags)) for gid in range(first, last)]
+        )
+    print(f"indexed {args.galleries} galleries in {time.perf_counter() - start:.1f}s")
+
+    rnd = random.Random(args.seed)
+    samples = defaultdict(list)
+    hits = 0
+    for query in queries(rnd, tags, args.queries):
+        kind = "empty" if not query else "short" if len(query) < 3 else "indexed"
+        offset = rnd.choice([0, 0, 0, args.page_size])
+        start = time.perf_counter()
+        results = await find_galleries(query, args.page_size, offset)
+        samples[kind].append(time.perf_counter() - start)
+        hits += bool(results)
+    await db_close()
+
+    everything = [s for values in samples.values() for s in values]
+    print(f"{'queries':<10}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for kind, values in sorted(samples.items()) + [("all", everything)]:
+        values = sorted(values)
+        p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+        print(
+            f"{kind:<10}{len(values):>8}"
+            f"{statistics.median(values) * 1000:>10.2f}{p99 * 1000:>10.2f}"
+        )
+    print(f"{hits / len(everything):.0%} of queries returned results")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--galleries", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    os.environ.setdefault("EXH_COOKIE", "ipb_member_id=0; ipb_pass_hash=bench")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,16 @@
 import asyncio
+import os
 import re
-from typing import Any, List
+import signal
+import time
+from typing import Any, List, Set
+from weakref import WeakValueDictionary
 
 from loguru import logger
 from telegram import (
+    Chat,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
     Message,
     MessageEntity,
     MessageOriginChannel,
@@ -13,85 +20,207 @@ from telegram import (
     Update,
 )
 from telegram.constants import ChatAction, ParseMode
-from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
     ContextTypes,
     Defaults,
+    InlineQueryHandler,
     MessageHandler,
     filters,
 )
 from telegram.helpers import escape_markdown
 
 from .config import load_settings
-from .exhentai_client import EhTagConverter, ExHentaiClient, MpvInfo
+from .coordination import Coordinator
+from .exhentai_client import (
+    ALL_CATEGORIES,
+    EhTagConverter,
+    ExHentaiClient,
+    GalleryEntry,
+    parse_gid,
+)
+from .http_client import configure as configure_http
+from .job_queue import JobWorker
+from .metrics import MetricsServer, track_limiter, track_pipeline
+from .pipeline import GalleryJob, Pipeline
+from .priority import BACKGROUND, INTERACTIVE
+from .priority import configure as configure_priority
+from .priority import use_lane
+from .profiling import LoopLagMonitor, Profiler
+from .proxy_pool import ProxyPool
+from .query import allowed_categories, matches
+from .send_queue import SendQueue
 from .storage import (
     Gallery,
+    Job,
     TaskData,
+    TaskRecord,
+    add_job,
+    add_pending_message,
     db_close,
     db_init,
-    delete_task,
-    get_all_tasks,
-    get_gallery,
-    upsert_gallery,
-    upsert_task,
+    find_galleries,
+    get_galleries,
+    get_state,
+    set_state,
 )
+from .sweeper import LinkSweeper
+from .tasks import TaskRegistry
 from .telegraph_client import TelegraphClient
+from .tracing import tracer
 from .uploader_client import FileUploader
+from .utils import RetryBudget, RetryPolicy, StartupTimer, TTLCache
+from .verifier import parse_sample_rates
 
 EHENTAI_URL_REGEX = r"https://e.hentai\.org/g/\d+/\w+"
+EHENTAI_URL_PATTERN = re.compile(EHENTAI_URL_REGEX)
+FEED_STATE_KEY = "feed"
+## Longest `/profile job` waits for a scheduled run to start and finish
+PROFILE_JOB_TIMEOUT = 3600
 
 settings = load_settings()
-client = ExHentaiClient(
-    cookie_header=settings.exh_cookie, semaphore_size=settings.exh_semaphore_size
+## HTTP clients and the pipeline are built in post_init, see build_clients
+client: ExHentaiClient | None = None
+uploader: FileUploader | None = None
+telegraph: TelegraphClient | None = None
+ehtag: EhTagConverter | None = None
+pipeline: Pipeline | None = None
+sweeper: LinkSweeper | None = None
+proxy_pool: ProxyPool | None = None
+sender = SendQueue(
+    global_rate=settings.telegram_global_rate,
+    chat_rate=settings.telegram_chat_rate,
+    holder=settings.replica_id,
+    lease=settings.send_lease,
 )
-uploader = FileUploader(
-    semaphore_size=settings.fileuploader_semaphore_size,
-    timeout=settings.fileuploader_timeout,
-    s3_config={
-        "endpoint": settings.s3_endpoint,
-        "access_key": settings.s3_access_key,
-        "secret_key": settings.s3_secret_key,
-        "bucket": settings.s3_bucket,
-        "region": settings.s3_region,
-        "public_url": settings.s3_public_url,
-        "prefix": settings.s3_prefix,
-    },
-    imgbb_api_key=settings.imgbb_api_key,
-    proxy=settings.fileuploader_proxy,
+metrics_server = (
+    MetricsServer(host=settings.metrics_host, port=int(settings.metrics_port))
+    if settings.metrics_port
+    else None
 )
-telegraph = TelegraphClient(access_token=settings.telegraph_token)
-ehtag = EhTagConverter(local_dir=settings.local_dir)
-
-
-async def resolve_image_urls(mpv_info: MpvInfo) -> List[str]:
-    if not mpv_info.mpvkey:
-        raise ValueError("mpvkey not found. Cannot call imagedispatch.")
-
-    async def _upload_with_semaphore(entry):
-        img_url = None
-        img_dispatch_s = None
-        for _ in range(3):
-            try:
-                dispatch = await client.imagedispatch(
-                    mpv_info.gid,
-                    entry.index,
-                    entry.imgkey,
-                    mpv_info.mpvkey,
-                    img_dispatch_s,
-                )
-                img_url = dispatch.i
-                img_dispatch_s = dispatch.s
-                return await uploader.upload_url(img_url)
-            except Exception as e:
-                logger.warning(f"Image dispatch failed, retrying: {e}")
-        return img_url
 
-    mpv_info.images = mpv_info.images[:100]
-    tasks = [_upload_with_semaphore(entry) for entry in mpv_info.images]
-    uploads: List[str] = await asyncio.gather(*tasks)
-    return uploads
+coordinator = Coordinator(
+    replica_id=settings.replica_id,
+    ttl=settings.scheduler_lease,
+    sharding=settings.task_sharding,
+)
+registry = TaskRegistry(
+    default_interval=settings.telegram_job_interval,
+    reconcile_interval=settings.task_reconcile_interval,
+)
+## Monotonic time of the next feed crawl, shared by all tasks
+next_feed_run = 0.0
+lag_monitor = LoopLagMonitor()
+profiler = Profiler(
+    local_dir=settings.local_dir,
+    lag_monitor=lag_monitor,
+    slow_callback_duration=settings.profile_slow_callback,
+)
+## Profiling runs started by SIGUSR1, referenced until they finish
+profile_tasks: Set[asyncio.Task] = set()
+
+## Per-user parse concurrency; entries vanish once no parse holds them
+user_semaphores: WeakValueDictionary[int, asyncio.Semaphore] = WeakValueDictionary()
+## Whether the bot administers a channel, negative results included
+channel_admin_cache = TTLCache(ttl=settings.telegram_member_cache_ttl)
+
+
+def build_clients() -> None:
+    global client, uploader, telegraph, ehtag, pipeline, sweeper, proxy_pool
+    configure_http(
+        connect_timeout=settings.http_connect_timeout,
+        keepalive_expiry=settings.http_keepalive_expiry,
+        dns_ttl=settings.dns_cache_ttl,
+    )
+    configure_priority(settings.priority_reserved_share)
+    retry_policy = RetryPolicy(
+        max_retries=settings.retry_max,
+        base_delay=settings.retry_base_delay,
+        max_delay=settings.retry_max_delay,
+        budget=RetryBudget(ratio=settings.retry_budget_ratio),
+    )
+    if settings.proxy_pool:
+        proxy_pool = ProxyPool(
+            settings.proxy_pool,
+            check_url=settings.proxy_check_url,
+            check_interval=settings.proxy_check_interval,
+            bench_time=settings.proxy_bench_time,
+        )
+
+    def proxies_for(name: str) -> ProxyPool | None:
+        return proxy_pool if name in settings.proxy_clients else None
+
+    client = ExHentaiClient(
+        cookie_header=settings.exh_cookie,
+        semaphore_size=settings.exh_semaphore_size,
+        timeout=settings.exh_timeout,
+        max_connections=settings.exh_max_connections,
+        retry_policy=retry_policy,
+        extra_cookie_headers=settings.exh_cookies,
+        bench_time=settings.exh_session_bench_time,
+        proxy_pool=proxies_for("exhentai"),
+    )
+    uploader = FileUploader(
+        semaphore_size=settings.fileuploader_semaphore_size,
+        timeout=settings.fileuploader_timeout,
+        s3_config={
+            "endpoint": settings.s3_endpoint,
+            "access_key": settings.s3_access_key,
+            "secret_key": settings.s3_secret_key,
+            "bucket": settings.s3_bucket,
+            "region": settings.s3_region,
+            "public_url": settings.s3_public_url,
+            "prefix": settings.s3_prefix,
+        },
+        imgbb_api_key=settings.imgbb_api_key,
+        proxy=settings.fileuploader_proxy,
+        proxy_pool=proxies_for("uploader"),
+        max_connections=settings.fileuploader_max_connections,
+        retry_policy=retry_policy,
+    )
+    telegraph = TelegraphClient(access_token=settings.telegraph_token)
+    ehtag = EhTagConverter(
+        local_dir=settings.local_dir,
+        retry_policy=retry_policy,
+        proxy_pool=proxies_for("ehtag"),
+    )
+    pipeline = Pipeline(
+        client=client,
+        uploader=uploader,
+        telegraph=telegraph,
+        ehtag=ehtag,
+        workers={
+            "metadata": settings.pipeline_metadata_workers,
+            "dispatch": settings.pipeline_dispatch_workers,
+            "upload": settings.pipeline_upload_workers,
+            "publish": settings.pipeline_publish_workers,
+        },
+        queue_sizes={
+            "metadata": settings.pipeline_metadata_queue,
+            "dispatch": settings.pipeline_dispatch_queue,
+            "upload": settings.pipeline_upload_queue,
+            "publish": settings.pipeline_publish_queue,
+        },
+        deadline=settings.gallery_deadline,
+        verify_sample=(
+            parse_sample_rates(settings.upload_verify_sample)
+            if settings.upload_verify
+            else None
+        ),
+    )
+    if settings.sweep_enabled:
+        sweeper = LinkSweeper(
+            pipeline,
+            author_name=settings.telegraph_author_name,
+            author_url=settings.telegraph_author_url,
+            rate=settings.sweep_rate,
+            batch=settings.sweep_batch,
+            interval=settings.sweep_interval,
+            min_age=settings.sweep_min_age,
+            ## One replica is enough, follow the scheduler lease
+            should_run=lambda: coordinator.leader,
+        )
 
 
 async def parse_url(
@@ -101,102 +230,233 @@ async def parse_url(
     send_if_exists: bool = True,
     force_update: bool = False,
     chat_id: int | None = None,
+    reset_gp: bool = False,
 ) -> Gallery | None:
     if author_name is None:
         author_name = settings.telegraph_author_name
     if author_url is None:
         author_url = settings.telegraph_author_url
-    gallery_info = await client.get_gallery_info(url)
-    logger.info(f"Parsing gallery: {gallery_info.gid} {gallery_info.title}")
-    exist = await get_gallery(gallery_info.gid) if not force_update else None
-    if exist is not None:
-        logger.info(f"Gallery already exists: {gallery_info.gid} {gallery_info.title}")
-        exist.chat_ids = exist.chat_ids or []
-        already_sent = chat_id and chat_id in exist.chat_ids
-        if not send_if_exists and already_sent:
-            return
-        if chat_id and not already_sent:
-            exist.chat_ids.append(chat_id)
-            await exist.save()
-        return exist
-    mpv_info = await client.fetch_mpv_info(url)
-    logger.info(f"Fetching MPV info: {gallery_info.gid} {gallery_info.title}")
-    uploader_urls = await resolve_image_urls(mpv_info)
-    logger.info(f"Translating tags: {gallery_info.gid} {gallery_info.title}")
-    await ehtag.load_database()
-    tags_dict = ehtag.batch_translate_tags(gallery_info.tags)
-    for namespace, tags in tags_dict.items():
-        logger.info(f"{namespace}: {tags}")
-    logger.info(f"Creating telegraph page: {gallery_info.gid} {gallery_info.title}")
-    telegraph_url = await telegraph.create_telegraph_page(
-        title=gallery_info.title,
-        image_urls=uploader_urls,
-        author_name=author_name,
-        author_url=author_url,
-    )
-    logger.info(f"Upserting gallery: {gallery_info.gid} {gallery_info.title}")
-    return await upsert_gallery(
-        gid=gallery_info.gid,
-        url=gallery_info.url,
-        tags=tags_dict,
-        title=gallery_info.title,
-        telegraph_url=telegraph_url,
-        chat_id=chat_id,
+    return await pipeline.submit(
+        GalleryJob(
+            url=url,
+            author_name=author_name,
+            author_url=author_url,
+            send_if_exists=send_if_exists,
+            force_update=force_update,
+            chat_id=chat_id,
+            reset_gp=reset_gp,
+        )
     )
 
 
 async def job_process(context: ContextTypes.DEFAULT_TYPE):
-    tasks = await get_all_tasks()
-    logger.info(f"Found {len(tasks)} tasks")
+    if not coordinator.should_schedule():
+        logger.debug("Not the scheduler leader, skipping tasks")
+        return
+    async with profiler.job_tick():
+        await run_tasks()
+
+
+async def run_tasks() -> None:
+    global next_feed_run
+    if settings.exh_search_mode == "feed":
+        ## One crawl serves every task, so they share the global interval
+        now = time.monotonic()
+        if now < next_feed_run:
+            return
+        next_feed_run = now + settings.telegram_job_interval
+        tasks = registry.all(coordinator.owns)
+    else:
+        tasks = registry.due(coordinator.owns)
+    if not tasks:
+        logger.debug("No tasks due")
+        return
+    if coordinator.sharding:
+        index, count = coordinator.shard
+        logger.info(f"Found {len(tasks)} tasks in shard {index + 1}/{count}")
+    else:
+        logger.info(f"Found {len(tasks)} tasks")
+    if settings.exh_search_mode == "feed":
+        await run_feed(tasks)
+    else:
+        for t in tasks:
+            logger.info(
+                f"Parsing task: {t.chat_id} {t.search} {t.catogories} {t.star} {t.author_name} {t.author_url}"
+            )
+            last_gid_value = None
+            for _ in range(t.query_depth):
+                entries, last_gid_value = await client.search_galleries(
+                    search=t.search,
+                    catogories=t.catogories,
+                    star=t.star,
+                    next_gid=last_gid_value,
+                )
+                logger.info(f"Found {len(entries)} galleries")
+                await asyncio.gather(*(process_entry(t, e) for e in entries))
+                if t.chat_id in sender.blocked:
+                    break
+    if settings.run_mode != "dispatcher":
+        logger.info(f"Pipeline stats: {pipeline.stats()}")
+
+
+async def run_feed(tasks: List[TaskRecord]) -> None:
+    """Crawl the newest galleries once and match every task locally.
+
+    The feed asks only for the categories and ratings some task wants, and
+    is read until it reaches the newest gallery of the previous crawl (at
+    least `EXH_FEED_PAGES` pages, so recently rated galleries are seen again).
+    """
+    if not tasks:
+        return
+    allowed = 0
     for t in tasks:
+        allowed |= allowed_categories(t.catogories)
+    star = min(t.star or 0 for t in tasks)
+    ## Shards see different tasks, so each keeps its own position
+    key = FEED_STATE_KEY
+    if coordinator.sharding:
+        key = f"{FEED_STATE_KEY}:{coordinator.replica_id}"
+    state = await get_state(key) or {}
+    newest = state.get("gid")
+    top = newest
+    last_gid_value = None
+    for page in range(settings.exh_feed_max_pages):
+        entries, last_gid_value = await client.search_galleries(
+            search="",
+            catogories=ALL_CATEGORIES & ~allowed,
+            star=star,
+            next_gid=last_gid_value,
+        )
+        matched = []
+        for e in entries:
+            wanted = [
+                t
+                for t in tasks
+                if t.chat_id not in sender.blocked
+                and matches(e, t.search, t.catogories, t.star)
+            ]
+            if wanted:
+                matched.append((e, wanted))
         logger.info(
-            f"Parsing task: {t.chat_id} {t.search} {t.catogories} {t.star} {t.author_name} {t.author_url}"
+            f"Found {len(entries)} galleries, "
+            f"{sum(len(wanted) for _, wanted in matched)} task matches"
+        )
+        await asyncio.gather(*(process_matches(wanted, e) for e, wanted in matched))
+        if not entries or last_gid_value is None:
+            break
+        top = max(top or 0, *(e.gid for e in entries))
+        if page + 1 >= settings.exh_feed_pages and (
+            newest is None or min(e.gid for e in entries) <= newest
+        ):
+            break
+    if top is not None:
+        await set_state(key, {"gid": top})
+
+
+async def process_matches(tasks: List[TaskRecord], e: GalleryEntry) -> None:
+    """Parse a gallery once and send it to every matching task's chat.
+
+    The page is published with the first task's author.
+    """
+    if settings.run_mode == "dispatcher" or len(tasks) == 1:
+        await asyncio.gather(*(process_entry(t, e) for t in tasks))
+        return
+    logger.info(f"Parsing gallery for {len(tasks)} tasks: {e.gid} {e.title}")
+    try:
+        gallery = await parse_url(
+            e.url,
+            author_name=tasks[0].author_name,
+            author_url=tasks[0].author_url,
+            reset_gp=True,
         )
-        last_gid_value = None
-        for _ in range(t.query_depth):
-            entries, last_gid_value = await client.search_galleries(
-                search=t.search,
-                catogories=t.catogories,
-                star=t.star,
-                next_gid=last_gid_value,
+    except Exception as err:
+        logger.error(f"Error parsing gallery: {e} {err}")
+        return
+    if gallery is None:
+        return
+    sent = gallery.chat_ids or []
+    for t in tasks:
+        if t.chat_id not in sent:
+            logger.info(f"Queueing gallery: {e.gid} {e.title} to {t.chat_id}")
+            await sender.enqueue(
+                chat_id=t.chat_id,
+                text=generate_telegraph_message(gallery),
+                gid=gallery.gid,
             )
-            logger.info(f"Found {len(entries)} galleries")
-            for e in entries:
-                await client.reset_gp()
-                logger.info(f"Parsing gallery: {e.gid} {e.title}")
-                try:
-                    gallery = await parse_url(
-                        e.url,
-                        author_name=t.author_name,
-                        author_url=t.author_url,
-                        send_if_exists=False,
-                        chat_id=t.chat_id,
-                    )
-                except Exception as err:
-                    logger.error(f"Error parsing gallery: {e} {err}")
-                    continue
-                if gallery is not None:
-                    logger.info(f"Sending gallery: {e.gid} {e.title}")
-                    try:
-                        await context.bot.send_message(
-                            chat_id=t.chat_id,
-                            text=generate_telegraph_message(gallery),
-                        )
-                    except BadRequest as err:
-                        if (
-                            "Not enough rights to send" in err.message
-                            or "Need administrator rights in the channel chat"
-                            in err.message
-                        ):
-                            await delete_task(t.chat_id)
-                            logger.warning(
-                                f"{err} not enough rights to send to {t.chat_id}, deleted task"
-                            )
-                            try:
-                                await context.bot.leave_chat(t.chat_id)
-                            except Exception:
-                                pass
-                            break
+
+
+async def process_entry(t: TaskRecord, e: GalleryEntry) -> None:
+    if settings.run_mode == "dispatcher":
+        await add_job(
+            url=e.url,
+            gid=e.gid,
+            author_name=t.author_name,
+            author_url=t.author_url,
+            send_if_exists=False,
+            reset_gp=True,
+            chat_id=t.chat_id,
+            subscription=True,
+        )
+        return
+    logger.info(f"Parsing gallery: {e.gid} {e.title}")
+    try:
+        gallery = await parse_url(
+            e.url,
+            author_name=t.author_name,
+            author_url=t.author_url,
+            send_if_exists=False,
+            chat_id=t.chat_id,
+            reset_gp=True,
+        )
+    except Exception as err:
+        logger.error(f"Error parsing gallery: {e} {err}")
+        return
+    if gallery is not None:
+        logger.info(f"Queueing gallery: {e.gid} {e.title}")
+        await sender.enqueue(
+            chat_id=t.chat_id,
+            text=generate_telegraph_message(gallery),
+            gid=gallery.gid,
+        )
+
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Answer inline queries from published galleries, without ExHentai."""
+    query = update.inline_query
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    page_size = settings.telegram_inline_page_size
+    galleries = await find_galleries(query.query, page_size, offset)
+    results = [
+        InlineQueryResultArticle(
+            id=str(gallery.gid),
+            title=gallery.title,
+            description=" ".join(
+                f"#{t}" for tags in gallery.tags.values() for t in tags
+            )[:200],
+            url=gallery.telegraph_url,
+            input_message_content=InputTextMessageContent(
+                generate_telegraph_message(gallery),
+                parse_mode=ParseMode.MARKDOWN_V2,
+            ),
+        )
+        for gallery in galleries
+    ]
+    await query.answer(
+        results,
+        cache_time=settings.telegram_inline_cache_time,
+        is_personal=False,
+        next_offset=str(offset + page_size) if len(galleries) == page_size else "",
+    )
+
+
+async def on_forbidden(chat_id: int) -> None:
+    """Drop the task of a chat the bot can no longer post to."""
+    await registry.remove(chat_id)
+    logger.warning(f"Deleted task of {chat_id}")
+    try:
+        await sender.bot.leave_chat(chat_id)
+    except Exception:
+        pass
 
 
 def generate_telegraph_message(gallery: Gallery) -> str:
@@ -210,30 +470,76 @@ def generate_telegraph_message(gallery: Gallery) -> str:
 async def parse(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message, urls = await message_to_urls(update, context)
     if message is not None and urls:
-        force_update = message.text.startswith("/refresh")
+        force_update = (message.text or "").startswith("/refresh")
+        gid_urls = {}
         for url in urls:
-            try:
-                await message.reply_chat_action(ChatAction.TYPING)
-            except Exception:
-                pass
-            gallery = await parse_url(
-                url,
-                author_name=settings.telegraph_author_name,
-                author_url=settings.telegraph_author_url,
-                force_update=force_update,
-            )
-            if gallery is not None:
-                await message.reply_text(generate_telegraph_message(gallery))
-            else:
-                await message.reply_text(f"解析失败：{escape_markdown(url, 2)}")
+            gid_urls.setdefault(parse_gid(url), url)
+        ## Reply cached galleries before any network work
+        cached = (
+            {}
+            if force_update
+            else {g.gid: g for g in await get_galleries(list(gid_urls))}
+        )
+        for gid in gid_urls:
+            if gid in cached:
+                await message.reply_text(generate_telegraph_message(cached[gid]))
+        pending = [url for gid, url in gid_urls.items() if gid not in cached]
+        if not pending:
+            return
+        if settings.run_mode == "dispatcher":
+            for url in pending:
+                await add_job(
+                    url=url,
+                    gid=parse_gid(url),
+                    author_name=settings.telegraph_author_name,
+                    author_url=settings.telegraph_author_url,
+                    force_update=force_update,
+                    chat_id=message.chat_id,
+                    reply_to_message_id=message.message_id,
+                )
+            return
+        try:
+            await message.reply_chat_action(ChatAction.TYPING)
+        except Exception:
+            pass
+        user = update.effective_user
+        user_id = user.id if user is not None else message.chat_id
+        semaphore = user_semaphores.get(user_id)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(settings.telegram_user_concurrency)
+            user_semaphores[user_id] = semaphore
+        await asyncio.gather(
+            *(parse_and_reply(message, url, force_update, semaphore) for url in pending)
+        )
     else:
-        if message is not None:
+        if message is not None and message.text is not None:
             if message.text.startswith("/parse"):
                 await message.reply_text("参数不正确，例如：/parse <url\\>")
             elif message.text.startswith("/refresh"):
                 await message.reply_text("参数不正确，例如：/refresh <url\\>")
 
 
+async def parse_and_reply(
+    message: Message, url: str, force_update: bool, semaphore: asyncio.Semaphore
+) -> None:
+    gallery = None
+    async with semaphore:
+        try:
+            with use_lane(INTERACTIVE):
+                gallery = await parse_url(
+                    url,
+                    author_name=settings.telegraph_author_name,
+                    author_url=settings.telegraph_author_url,
+                    force_update=force_update,
+                )
+        except Exception as err:
+            logger.error(f"Error parsing gallery: {url} {err}")
+    if gallery is not None:
+        await message.reply_text(generate_telegraph_message(gallery))
+    else:
+        await message.reply_text(f"解析失败：{escape_markdown(url, 2)}")
+
+
 async def message_to_urls(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> tuple[Message | None, list[Any]]:
@@ -257,20 +563,28 @@ async def message_to_urls(
             return message, []
         else:
             ## If the bot is in the channel, return
-            try:
-                self_user = await message.forward_origin.chat.get_member(context.bot.id)
-                ## Bot must be an administrator to access the member list.
-                if self_user.status == "administrator":
-                    return message, []
-            except Exception:
-                ## Member list is inaccessible.
-                pass
-    urls = re.findall(EHENTAI_URL_REGEX, message.text or message.caption or "")
+            if await is_channel_admin(message.forward_origin.chat, context.bot.id):
+                return message, []
+    urls = EHENTAI_URL_PATTERN.findall(message.text or message.caption or "")
     if message.entities:
         for entity in message.entities:
             if entity.url:
-                urls.extend(re.findall(EHENTAI_URL_REGEX, entity.url))
-    return message, urls
+                urls.extend(EHENTAI_URL_PATTERN.findall(entity.url))
+    return message, list(dict.fromkeys(urls))
+
+
+async def is_channel_admin(chat: Chat, bot_id: int) -> bool:
+    is_admin = channel_admin_cache.get(chat.id)
+    if is_admin is None:
+        try:
+            self_user = await chat.get_member(bot_id)
+            ## Bot must be an administrator to access the member list.
+            is_admin = self_user.status == "administrator"
+        except Exception:
+            ## Member list is inaccessible.
+            is_admin = False
+        channel_admin_cache.set(chat.id, is_admin)
+    return is_admin
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -283,7 +597,7 @@ async def add_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     text = update.effective_message.text.replace("/add_task ", "")
     try:
         task_data = TaskData.from_text(text)
-        await upsert_task(
+        await registry.add(
             chat_id=update.effective_chat.id,
             search=task_data.search,
             catogories=task_data.catogories,
@@ -291,7 +605,9 @@ async def add_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             author_name=task_data.author_name or update.effective_chat.username,
             author_url=task_data.author_url or update.effective_chat.link,
             query_depth=task_data.query_depth,
+            interval=task_data.interval,
         )
+        sender.blocked.discard(update.effective_chat.id)
         reply = await update.effective_message.reply_text("任务添加成功")
         await update.effective_message.delete()
         await reply.delete()
@@ -300,33 +616,214 @@ async def add_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 
 async def clear_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await delete_task(update.effective_chat.id)
+    await registry.remove(update.effective_chat.id)
     reply = await update.effective_message.reply_text("任务清除成功")
     await update.effective_message.delete()
     await reply.delete()
 
 
-async def post_init(application: Application) -> None:
-    await db_init(settings.db_url)
-    await application.bot.set_my_commands(
-        [
-            ["parse", "获取匹配内容"],
-            ["refresh", "更新匹配内容"],
-        ]
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user = update.effective_user
+    if user is None or user.id not in settings.telegram_admin_ids:
+        return
+    arg = context.args[0] if context.args else None
+    if arg == "job":
+        if not coordinator.should_schedule():
+            await update.effective_message.reply_text(
+                "此副本不运行定时任务，请向主副本发送"
+            )
+            return
+        if profiler.next_job is not None and not profiler.next_job.done():
+            ## Only the first request waits, so a timeout cancels nobody else's
+            await update.effective_message.reply_text("已在等待下一次定时任务")
+            return
+        future = profiler.arm_next_job()
+        await update.effective_message.reply_text("将分析下一次定时任务")
+        try:
+            ## Cancels the armed run on timeout, so a later job is not profiled
+            report = await asyncio.wait_for(future, PROFILE_JOB_TIMEOUT)
+        except asyncio.TimeoutError:
+            await update.effective_message.reply_text("等待定时任务超时，已取消分析")
+            return
+    else:
+        try:
+            seconds = float(arg) if arg else settings.profile_seconds
+        except ValueError:
+            await update.effective_message.reply_text(
+                "参数不正确，例如：/profile 30 或 /profile job"
+            )
+            return
+        await update.effective_message.reply_text(
+            escape_markdown(f"开始分析 {seconds:g} 秒", 2)
+        )
+        try:
+            report = await profiler.profile_for(seconds)
+        except RuntimeError as e:
+            await update.effective_message.reply_text(escape_markdown(str(e), 2))
+            return
+    await update.effective_message.reply_text(escape_markdown(report.summary(), 2))
+
+
+def on_profile_signal() -> None:
+    async def run() -> None:
+        try:
+            await profiler.profile_for(settings.profile_seconds)
+        except RuntimeError as e:
+            logger.warning(str(e))
+
+    task = asyncio.create_task(run())
+    profile_tasks.add(task)
+    task.add_done_callback(profile_tasks.discard)
+
+
+async def start_services(timer: StartupTimer) -> None:
+    tracer.configure(
+        settings.tracing_exporter,
+        settings.tracing_path or os.path.join(settings.local_dir, "traces.jsonl"),
     )
-    bot_me = await application.bot.get_me()
-    logger.info(f"Bot @{bot_me.username} started.")
+    with timer.phase("clients"):
+        build_clients()
+    with timer.phase("database"):
+        await db_init(settings.db_url)
+    ## The dispatcher leaves gallery processing to the workers
+    if settings.run_mode != "dispatcher":
+        pipeline.start()
+    if proxy_pool is not None:
+        proxy_pool.start()
+    lag_monitor.start()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, on_profile_signal)
+    except (AttributeError, NotImplementedError):
+        ## No SIGUSR1 on Windows
+        pass
+    if metrics_server is not None:
+        for session in client.sessions:
+            track_limiter(session.semaphore)
+        track_limiter(uploader.semaphore)
+        track_pipeline(pipeline)
+        await metrics_server.start()
+
+
+async def stop_services() -> None:
+    if metrics_server is not None:
+        await metrics_server.stop()
+    await lag_monitor.stop()
+    if pipeline is not None:
+        await pipeline.stop()
+    await sender.stop()
+    for c in (client, uploader, telegraph, ehtag):
+        if c is not None:
+            await c.aclose()
+    if proxy_pool is not None:
+        await proxy_pool.stop()
+    await db_close()
+    tracer.close()
+
+
+async def post_init(application: Application) -> None:
+    timer = StartupTimer()
+    await start_services(timer)
+    with timer.phase("coordination"):
+        await coordinator.start()
+    with timer.phase("tasks"):
+        await registry.load()
+    registry.start()
+    if sweeper is not None and settings.run_mode != "dispatcher":
+        sweeper.start()
+    with timer.phase("send_queue"):
+        await sender.start(
+            application.bot,
+            on_forbidden=on_forbidden,
+            ## Pick up results persisted by worker processes and messages
+            ## whose claim expired with another replica
+            poll_interval=settings.job_poll_interval,
+        )
+    with timer.phase("telegram"):
+        await application.bot.set_my_commands(
+            [
+                ["parse", "获取匹配内容"],
+                ["refresh", "更新匹配内容"],
+            ]
+        )
+        bot_me = await application.bot.get_me()
+    logger.info(f"Bot @{bot_me.username} started. {timer.report()}")
 
 
 async def post_shutdown(application: Application) -> None:
-    await client.aclose()
-    await uploader.aclose()
-    await telegraph.aclose()
-    await ehtag.aclose()
-    await db_close()
+    if sweeper is not None:
+        await sweeper.stop()
+    await registry.stop()
+    await coordinator.stop()
+    await stop_services()
+
+
+async def run_job(job: Job) -> None:
+    with use_lane(BACKGROUND if job.subscription else INTERACTIVE):
+        gallery = await parse_url(
+            job.url,
+            author_name=job.author_name,
+            author_url=job.author_url,
+            send_if_exists=job.send_if_exists,
+            force_update=job.force_update,
+            chat_id=job.chat_id if job.subscription else None,
+            reset_gp=job.reset_gp,
+        )
+    if job.chat_id is None:
+        return
+    if gallery is None:
+        if not job.subscription:
+            await on_job_failed(job)
+        return
+    ## Delivered by the dispatcher's send queue
+    await add_pending_message(
+        chat_id=job.chat_id,
+        text=generate_telegraph_message(gallery),
+        gid=gallery.gid if job.subscription else None,
+        reply_to_message_id=job.reply_to_message_id,
+    )
+
+
+async def on_job_failed(job: Job) -> None:
+    if job.chat_id is not None and not job.subscription:
+        await add_pending_message(
+            chat_id=job.chat_id,
+            text=f"解析失败：{escape_markdown(job.url, 2)}",
+            reply_to_message_id=job.reply_to_message_id,
+        )
+
+
+async def run_worker() -> None:
+    """Run queued gallery jobs without a Telegram connection."""
+    timer = StartupTimer()
+    await start_services(timer)
+    worker = JobWorker(
+        run=run_job,
+        on_failed=on_job_failed,
+        concurrency=settings.worker_concurrency,
+        lease=settings.job_lease,
+        poll_interval=settings.job_poll_interval,
+        max_attempts=settings.job_max_attempts,
+    )
+    worker.start()
+    logger.info(f"Worker started. {timer.report()}")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    try:
+        await stop.wait()
+    finally:
+        await worker.stop()
+        await stop_services()
 
 
 def main() -> None:
+    if settings.run_mode == "worker":
+        asyncio.run(run_worker())
+        return
     application = (
         Application.builder()
         .defaults(
@@ -358,18 +855,22 @@ def main() -> None:
     )
     application.add_handler(CommandHandler("parse", parse, block=False))
     application.add_handler(CommandHandler("refresh", parse, block=False))
+    application.add_handler(CommandHandler("profile", profile, block=False))
+    application.add_handler(InlineQueryHandler(inline_query, block=False))
     application.add_handler(
         MessageHandler(
             filters.Entity(MessageEntity.URL)
             | filters.Entity(MessageEntity.TEXT_LINK)
-            | filters.Regex(EHENTAI_URL_REGEX)
-            | filters.CaptionRegex(EHENTAI_URL_REGEX),
+            | filters.Regex(EHENTAI_URL_PATTERN)
+            | filters.CaptionRegex(EHENTAI_URL_PATTERN),
             parse,
             block=False,
         )
     )
     application.job_queue.run_repeating(
-        job_process, interval=settings.telegram_job_interval, first=30
+        job_process,
+        interval=min(settings.task_tick_interval, settings.telegram_job_interval),
+        first=30,
     )
     if settings.telegram_domain:
         application.run_webhook(
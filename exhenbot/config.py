@@ -1,4 +1,6 @@
+import functools
 import os
+import socket
 from dataclasses import dataclass
 
 
@@ -9,16 +11,31 @@ class Settings:
 
     # ExHentai
     exh_cookie: str
+    exh_cookies: list[str]
+    exh_session_bench_time: float
     exh_semaphore_size: int
     exh_query: str
     exh_catogories: int
     exh_star: int
     exh_query_depth: int
+    exh_search_mode: str
+    exh_feed_pages: int
+    exh_feed_max_pages: int
+    exh_timeout: float
+    exh_max_connections: int
 
     # File Uploader
     fileuploader_semaphore_size: int
     fileuploader_timeout: int
     fileuploader_proxy: str
+    fileuploader_max_connections: int
+    upload_verify: bool
+    upload_verify_sample: str
+    sweep_enabled: bool
+    sweep_rate: float
+    sweep_batch: int
+    sweep_interval: float
+    sweep_min_age: float
     imgbb_api_key: str
 
     # S3
@@ -30,6 +47,47 @@ class Settings:
     s3_public_url: str
     s3_prefix: str
 
+    # Scale-out
+    run_mode: str
+    worker_concurrency: int
+    job_lease: float
+    send_lease: float
+    job_poll_interval: float
+    job_max_attempts: int
+    replica_id: str
+    scheduler_lease: float
+    task_sharding: bool
+
+    # Priority lanes
+    priority_reserved_share: float
+
+    # Retries
+    retry_max: int
+    retry_base_delay: float
+    retry_max_delay: float
+    retry_budget_ratio: float
+    gallery_deadline: float
+
+    # HTTP
+    http_connect_timeout: float
+    http_keepalive_expiry: float
+    dns_cache_ttl: float
+    proxy_pool: list[str]
+    proxy_clients: list[str]
+    proxy_check_url: str
+    proxy_check_interval: float
+    proxy_bench_time: float
+
+    # Pipeline
+    pipeline_metadata_workers: int
+    pipeline_dispatch_workers: int
+    pipeline_upload_workers: int
+    pipeline_publish_workers: int
+    pipeline_metadata_queue: int
+    pipeline_dispatch_queue: int
+    pipeline_upload_queue: int
+    pipeline_publish_queue: int
+
     # Telegraph
     telegraph_author_name: str
     telegraph_author_url: str
@@ -38,10 +96,21 @@ class Settings:
     # Database
     db_url: str
     table_prefix: str
+    database_tuning: bool
+    sqlite_mmap_size: int
+    sqlite_cache_size: int
 
     # Telegram
     telegram_bot_token: str
     telegram_job_interval: int
+    task_tick_interval: int
+    task_reconcile_interval: int
+    telegram_global_rate: float
+    telegram_chat_rate: float
+    telegram_user_concurrency: int
+    telegram_member_cache_ttl: int
+    telegram_inline_page_size: int
+    telegram_inline_cache_time: int
 
     # API
     telegram_domain: str
@@ -52,13 +121,34 @@ class Settings:
     telegram_local_mode: bool
     telegram_semaphore_size: str
 
+    # Metrics
+    metrics_host: str
+    metrics_port: str
+
+    # Tracing
+    tracing_exporter: str
+    tracing_path: str
+
+    # Profiling
+    telegram_admin_ids: list[int]
+    profile_seconds: float
+    profile_slow_callback: float
 
+
+@functools.cache
 def load_settings() -> Settings:
-    """Load settings from environment variables with reasonable defaults."""
+    """Load settings from environment variables with reasonable defaults.
+
+    The result is cached so every module shares one instance.
+    """
     return Settings(
         local_dir=os.environ.get("LOCAL_DIR", ".exhenbot"),
         task_check=os.environ.get("TASK_CHECK", "exhenbot:exhenbot"),
         exh_cookie=os.environ.get("EXH_COOKIE"),
+        exh_cookies=[
+            c.strip() for c in os.environ.get("EXH_COOKIES", "").split("|") if c.strip()
+        ],
+        exh_session_bench_time=float(os.environ.get("EXH_SESSION_BENCH_TIME", 3600)),
         exh_semaphore_size=int(os.environ.get("EXH_SEMAPHORE_SIZE", 4)),
         exh_query=os.environ.get(
             "EXH_QUERY", 'parody:"blue archive$" language:chinese$'
@@ -66,11 +156,26 @@ def load_settings() -> Settings:
         exh_catogories=int(os.environ.get("EXH_CATOGORIES", 1017)),
         exh_star=int(os.environ.get("EXH_STAR", 4)),
         exh_query_depth=int(os.environ.get("EXH_QUERY_DEPTH", 1)),
+        exh_search_mode=os.environ.get("EXH_SEARCH_MODE", "task"),
+        exh_feed_pages=int(os.environ.get("EXH_FEED_PAGES", 2)),
+        exh_feed_max_pages=int(os.environ.get("EXH_FEED_MAX_PAGES", 20)),
+        exh_timeout=float(os.environ.get("EXH_TIMEOUT", 30)),
+        exh_max_connections=int(os.environ.get("EXH_MAX_CONNECTIONS", 0)),
         fileuploader_semaphore_size=int(
             os.environ.get("FILEUPLOADER_SEMAPHORE_SIZE", 10)
         ),
         fileuploader_timeout=int(os.environ.get("FILEUPLOADER_TIMEOUT", 30)),
         fileuploader_proxy=os.environ.get("FILEUPLOADER_PROXY"),
+        fileuploader_max_connections=int(
+            os.environ.get("FILEUPLOADER_MAX_CONNECTIONS", 0)
+        ),
+        upload_verify=os.environ.get("UPLOAD_VERIFY", "true") == "true",
+        upload_verify_sample=os.environ.get("UPLOAD_VERIFY_SAMPLE"),
+        sweep_enabled=os.environ.get("SWEEP_ENABLED", "false") == "true",
+        sweep_rate=float(os.environ.get("SWEEP_RATE", 1)),
+        sweep_batch=int(os.environ.get("SWEEP_BATCH", 20)),
+        sweep_interval=float(os.environ.get("SWEEP_INTERVAL", 86400)),
+        sweep_min_age=float(os.environ.get("SWEEP_MIN_AGE", 86400)),
         imgbb_api_key=os.environ.get("IMGBB_API_KEY"),
         s3_endpoint=os.environ.get("S3_ENDPOINT"),
         s3_access_key=os.environ.get("S3_ACCESS_KEY"),
@@ -79,6 +184,47 @@ def load_settings() -> Settings:
         s3_region=os.environ.get("S3_REGION"),
         s3_public_url=os.environ.get("S3_PUBLIC_URL"),
         s3_prefix=os.environ.get("S3_PREFIX", "exhenbot"),
+        run_mode=os.environ.get("RUN_MODE", "standalone"),
+        worker_concurrency=int(os.environ.get("WORKER_CONCURRENCY", 4)),
+        job_lease=float(os.environ.get("JOB_LEASE", 600)),
+        send_lease=float(os.environ.get("SEND_LEASE", 600)),
+        job_poll_interval=float(os.environ.get("JOB_POLL_INTERVAL", 2)),
+        job_max_attempts=int(os.environ.get("JOB_MAX_ATTEMPTS", 3)),
+        replica_id=os.environ.get(
+            "REPLICA_ID", f"{socket.gethostname()}:{os.getpid()}"
+        ),
+        scheduler_lease=float(os.environ.get("SCHEDULER_LEASE", 60)),
+        task_sharding=os.environ.get("TASK_SHARDING", "false") == "true",
+        priority_reserved_share=float(os.environ.get("PRIORITY_RESERVED_SHARE", 0.25)),
+        retry_max=int(os.environ.get("RETRY_MAX", 2)),
+        retry_base_delay=float(os.environ.get("RETRY_BASE_DELAY", 1)),
+        retry_max_delay=float(os.environ.get("RETRY_MAX_DELAY", 30)),
+        retry_budget_ratio=float(os.environ.get("RETRY_BUDGET_RATIO", 0.2)),
+        gallery_deadline=float(os.environ.get("GALLERY_DEADLINE", 600)),
+        http_connect_timeout=float(os.environ.get("HTTP_CONNECT_TIMEOUT", 10)),
+        http_keepalive_expiry=float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 60)),
+        dns_cache_ttl=float(os.environ.get("DNS_CACHE_TTL", 300)),
+        proxy_pool=[
+            p.strip() for p in os.environ.get("PROXY_POOL", "").split(",") if p.strip()
+        ],
+        proxy_clients=[
+            c.strip()
+            for c in os.environ.get("PROXY_CLIENTS", "exhentai,uploader,ehtag").split(
+                ","
+            )
+            if c.strip()
+        ],
+        proxy_check_url=os.environ.get("PROXY_CHECK_URL", "https://e-hentai.org/"),
+        proxy_check_interval=float(os.environ.get("PROXY_CHECK_INTERVAL", 60)),
+        proxy_bench_time=float(os.environ.get("PROXY_BENCH_TIME", 300)),
+        pipeline_metadata_workers=int(os.environ.get("PIPELINE_METADATA_WORKERS", 2)),
+        pipeline_dispatch_workers=int(os.environ.get("PIPELINE_DISPATCH_WORKERS", 2)),
+        pipeline_upload_workers=int(os.environ.get("PIPELINE_UPLOAD_WORKERS", 2)),
+        pipeline_publish_workers=int(os.environ.get("PIPELINE_PUBLISH_WORKERS", 1)),
+        pipeline_metadata_queue=int(os.environ.get("PIPELINE_METADATA_QUEUE", 8)),
+        pipeline_dispatch_queue=int(os.environ.get("PIPELINE_DISPATCH_QUEUE", 2)),
+        pipeline_upload_queue=int(os.environ.get("PIPELINE_UPLOAD_QUEUE", 2)),
+        pipeline_publish_queue=int(os.environ.get("PIPELINE_PUBLISH_QUEUE", 4)),
         telegraph_author_name=os.environ.get("TELEGRAPH_AUTHOR_NAME", "exhenbot"),
         telegraph_author_url=os.environ.get(
             "TELEGRAPH_AUTHOR_URL", "https://t.me/exhenbot"
@@ -86,8 +232,23 @@ def load_settings() -> Settings:
         telegraph_token=os.environ.get("TELEGRAPH_ACCESS_TOKEN"),
         db_url=os.environ.get("DATABASE_URL"),
         table_prefix=os.environ.get("DATABASE_TABLE_PREFIX", ""),
+        database_tuning=os.environ.get("DATABASE_TUNING", "false") == "true",
+        sqlite_mmap_size=int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+        sqlite_cache_size=int(os.environ.get("SQLITE_CACHE_SIZE", -64 * 1024)),
         telegram_bot_token=os.environ.get("TELEGRAM_BOT_TOKEN"),
         telegram_job_interval=int(os.environ.get("TELEGRAM_JOB_INTERVAL", 600)),
+        task_tick_interval=int(os.environ.get("TASK_TICK_INTERVAL", 60)),
+        task_reconcile_interval=int(os.environ.get("TASK_RECONCILE_INTERVAL", 300)),
+        telegram_global_rate=float(os.environ.get("TELEGRAM_GLOBAL_RATE", 30)),
+        telegram_chat_rate=float(os.environ.get("TELEGRAM_CHAT_RATE", 20)),
+        telegram_user_concurrency=int(os.environ.get("TELEGRAM_USER_CONCURRENCY", 3)),
+        telegram_member_cache_ttl=int(
+            os.environ.get("TELEGRAM_MEMBER_CACHE_TTL", 3600)
+        ),
+        telegram_inline_page_size=int(os.environ.get("TELEGRAM_INLINE_PAGE_SIZE", 20)),
+        telegram_inline_cache_time=int(
+            os.environ.get("TELEGRAM_INLINE_CACHE_TIME", 300)
+        ),
         telegram_domain=os.environ.get("TELEGRAM_DOMAIN"),
         telegram_host=os.environ.get("TELEGRAM_HOST"),
         telegram_port=os.environ.get("TELEGRAM_PORT"),
@@ -99,4 +260,15 @@ def load_settings() -> Settings:
         ),
         telegram_local_mode=os.environ.get("TELEGRAM_LOCAL_MODE", "false") == "true",
         telegram_semaphore_size=os.environ.get("TELEGRAM_SEMAPHORE_SIZE"),
+        metrics_host=os.environ.get(
+            "METRICS_HOST", os.environ.get("TELEGRAM_HOST", "127.0.0.1")
+        ),
+        metrics_port=os.environ.get("METRICS_PORT"),
+        tracing_exporter=os.environ.get("TRACING_EXPORTER"),
+        tracing_path=os.environ.get("TRACING_PATH"),
+        telegram_admin_ids=[
+            int(i) for i in os.environ.get("TELEGRAM_ADMIN_IDS", "").split(",") if i
+        ],
+        profile_seconds=float(os.environ.get("PROFILE_SECONDS", 30)),
+        profile_slow_callback=float(os.environ.get("PROFILE_SLOW_CALLBACK", 0.1)),
     )
@@ -0,0 +1,94 @@
+import asyncio
+import zlib
+from typing import List, Optional
+
+from loguru import logger
+
+from .metrics import SCHEDULER_LEADER, SCHEDULER_REPLICAS
+from .storage import acquire_lease, get_lease_holders, release_lease
+
+LEADER_LEASE = "scheduler"
+REPLICA_LEASE_PREFIX = "replica:"
+
+
+def shard_of(chat_id: int, count: int) -> int:
+    return zlib.crc32(str(chat_id).encode()) % count
+
+
+class Coordinator:
+    """Decide which replica runs the scheduled search job.
+
+    Replicas sharing a database keep a lease per replica plus one scheduler
+    lease, renewed every `ttl / 3` seconds. Without sharding only the holder
+    of the scheduler lease runs `job_process`; with sharding every live
+    replica runs it for the tasks whose chat_id hashes to its slot. A
+    replica that stops renewing drops out once its leases expire.
+    """
+
+    def __init__(self, replica_id: str, ttl: float = 60, sharding: bool = False):
+        self.replica_id = replica_id
+        self.ttl = ttl
+        self.sharding = sharding
+        self.leader = False
+        self.replicas: List[str] = [replica_id]
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def shard(self) -> tuple[int, int]:
+        if self.replica_id not in self.replicas:
+            return 0, 1
+        return self.replicas.index(self.replica_id), len(self.replicas)
+
+    async def start(self) -> None:
+        SCHEDULER_LEADER.set_function(lambda: int(self.leader))
+        SCHEDULER_REPLICAS.set_function(lambda: len(self.replicas))
+        await self.renew()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        try:
+            await release_lease(LEADER_LEASE, self.replica_id)
+            await release_lease(REPLICA_LEASE_PREFIX + self.replica_id, self.replica_id)
+        except Exception as e:
+            logger.warning(f"Failed to release leases: {e}")
+        self.leader = False
+
+    async def renew(self) -> None:
+        try:
+            await acquire_lease(
+                REPLICA_LEASE_PREFIX + self.replica_id, self.replica_id, self.ttl
+            )
+            leader = await acquire_lease(LEADER_LEASE, self.replica_id, self.ttl)
+            replicas = await get_lease_holders(REPLICA_LEASE_PREFIX)
+        except Exception as e:
+            ## Step down rather than risk two leaders
+            logger.warning(f"Failed to renew leases: {e}")
+            self.leader = False
+            return
+        if leader != self.leader:
+            logger.info(
+                f"Replica {self.replica_id} "
+                f"{'is now' if leader else 'is no longer'} the scheduler leader"
+            )
+        if replicas != self.replicas:
+            logger.info(f"Live replicas: {replicas}")
+        self.leader = leader
+        self.replicas = replicas or [self.replica_id]
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            await self.renew()
+
+    def should_schedule(self) -> bool:
+        return self.sharding or self.leader
+
+    def owns(self, chat_id: int) -> bool:
+        if not self.sharding:
+            return True
+        index, count = self.shard
+        return shard_of(chat_id, count) == index
@@ -1,16 +1,32 @@
 import asyncio
+import collections
 import json
 import re
+import time
 import urllib.parse
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Deque, Dict, List, Optional, Tuple
+from weakref import WeakValueDictionary
 
 import httpx
 from loguru import logger
-from lxml import html as lxml_html
 
-from .utils import retry_request
+from .metrics import EXH_SESSION_BENCHES, EXH_SESSION_QUOTA, GP_RESETS, STAGE_SECONDS, timed
+from .priority import PriorityLimiter
+from .proxy_pool import ProxyPool, build_proxied_client
+from .utils import RetryPolicy, TTLCache, retry_request
+
+
+def parse_gid(gallery_url: str) -> Optional[int]:
+    """Parse gid from a gallery URL (/g/<gid>/<token>/...)."""
+    path = urllib.parse.urlparse(gallery_url).path.strip("/")
+    segments = path.split("/")
+    try:
+        idx = segments.index("g")
+        return int(segments[idx + 1])
+    except Exception:
+        return None
 
 
 @dataclass
@@ -19,6 +35,9 @@ class GalleryEntry:
     url: str
     title: str
     tags: List[str]
+    ## Category bit (see CATEGORIES) and star rating shown on the result page
+    category: Optional[int] = None
+    rating: Optional[float] = None
 
 
 @dataclass
@@ -27,6 +46,8 @@ class GalleryInfo:
     url: str
     title: str
     tags: List[str]
+    ## Gallery this one is a newer version of, from the "Parent" row
+    parent_gid: Optional[int] = None
 
 
 @dataclass
@@ -113,7 +134,297 @@ class ImageDispatch:
         )
 
 
+# -----------------------------
+# Page parsers
+# -----------------------------
+PAGECOUNT_PATTERN = re.compile(r"var\s+pagecount\s*=\s*(\d+)")
+MPVKEY_PATTERN = re.compile(r"var\s+mpvkey\s*=\s*\"([0-9a-zA-Z]+)\"")
+IMAGELIST_PATTERN = re.compile(r"var\s+imagelist\s*=\s*(\[[\s\S]*?\]);")
+RATING_PATTERN = re.compile(r"background-position:\s*(-?\d+)px\s+(-?\d+)px")
+BAN_PATTERN = re.compile(r"(?:Your|This) IP address has been temporarily banned")
+## imagedispatch points at this image once the account's image quota is spent
+QUOTA_IMAGE_PATTERN = re.compile(r"/509s?\.gif$")
+
+## Bits of the `f_cats` mask; a set bit hides the category from search results
+CATEGORIES = {
+    "misc": 1,
+    "doujinshi": 2,
+    "manga": 4,
+    "artist cg": 8,
+    "game cg": 16,
+    "image set": 32,
+    "cosplay": 64,
+    "asian porn": 128,
+    "non-h": 256,
+    "western": 512,
+}
+ALL_CATEGORIES = 1023
+
+
+def _is_card(el) -> bool:
+    return el.tag == "div" and "gl1t" in (el.get("class") or "").split()
+
+
+def parse_rating(style: Optional[str]) -> Optional[float]:
+    """Star rating from the sprite offset of a result row's rating div."""
+    match = RATING_PATTERN.search(style or "")
+    if not match:
+        return None
+    x, y = int(match.group(1)), int(match.group(2))
+    ## Each star is 16px wide, the lower sprite row adds a half star
+    return 5 + x / 16 - (0.5 if y == -21 else 0)
+
+
+def parse_search_page(text: str, base_url: str) -> Tuple[List[GalleryEntry], Optional[int]]:
+    """Parse a search result page into entries and the last gid seen."""
+    from lxml import etree
+    from lxml import html as lxml_html
+
+    doc = lxml_html.fromstring(text)
+
+    # Prefer structured rows under the name cell which contains href, glink, and gt tags
+    entries: List[GalleryEntry] = []
+    last_gid_value: Optional[int] = None
+    anchors = doc.xpath('//td[contains(@class,"glname")]//a[contains(@href,"/g/")]')
+    if not anchors:
+        anchors = doc.xpath('//td[contains(@class,"gl2e")]//a[contains(@href,"/g/")]')
+    if not anchors:
+        anchors = doc.xpath('//div[contains(@class,"gl1t")]//a[contains(@href,"/g/")]')
+    for a in anchors:
+        href = a.get("href")
+        if not href:
+            continue
+        url = urllib.parse.urljoin(base_url, href)
+
+        # Extract gid from URL path without regex; update last gid seen
+        path = urllib.parse.urlparse(url).path.strip("/")
+        segments = path.split("/")
+        try:
+            idx = segments.index("g")
+            gid_candidate = int(segments[idx + 1])
+            last_gid_value = gid_candidate
+        except Exception:
+            pass
+
+        # Category and rating live elsewhere in the row (table modes) or card (thumbnails),
+        # so walk the row once and pick title and tags from the part inside the anchor
+        row = a.getparent()
+        while row is not None and row.tag != "tr" and not _is_card(row):
+            row = row.getparent()
+        glink, tags, category, rating = None, [], None, None
+        inside = row is None
+        for event, el in etree.iterwalk(a if row is None else row, events=("start", "end")):
+            if el is a:
+                inside = event == "start"
+                continue
+            if event == "end" or el.tag != "div":
+                continue
+            cls = el.get("class")
+            if not cls:
+                continue
+            if inside and cls == "gt":
+                tag = el.get("title")
+                if tag:
+                    tags.append(tag)
+            elif inside and cls == "glink":
+                if glink is None:
+                    glink = el
+            else:
+                names = cls.split()
+                if category is None and ("cn" in names or "cs" in names):
+                    category = CATEGORIES.get(el.text_content().strip().lower())
+                elif rating is None and "ir" in names:
+                    rating = parse_rating(el.get("style"))
+        title = (glink if glink is not None else a).text_content().strip()
+        entries.append(
+            GalleryEntry(
+                gid=gid_candidate,
+                url=url,
+                title=title,
+                tags=tags,
+                category=category,
+                rating=rating,
+            )
+        )
+
+    return entries, last_gid_value
+
+
+def parse_gallery_page(text: str, gallery_url: str) -> GalleryInfo:
+    """Parse title and `namespace:tag` tags from a gallery page."""
+    from lxml import html as lxml_html
+
+    doc = lxml_html.fromstring(text)
+
+    gid = parse_gid(gallery_url)
+
+    # Title: prefer english title in #gj, fallback to #gn or <title>
+    title = None
+    title_node = doc.xpath('//h1[@id="gj"]')
+    if title_node:
+        title = title_node[0].text_content().strip()
+    if not title:
+        title_node = doc.xpath('//h1[@id="gn"]')
+        if title_node:
+            title = title_node[0].text_content().strip()
+    if not title:
+        title = (doc.xpath("//title/text()") or [""])[0].strip()
+
+    # Tags: prefer explicit tag ids (ta_namespace:tag) -> "namespace:tag"
+    tags: List[str] = []
+    for a in doc.xpath("//div[@id='taglist']//a[starts-with(@id,'ta_')]"):
+        aid = a.get("id")
+        if aid and aid.startswith("ta_"):
+            tags.append(aid[len("ta_") :].replace("+", " "))
+            continue
+        href = a.get("href", "")
+        if href:
+            p = urllib.parse.unquote(urllib.parse.urlparse(href).path)
+            parts = p.strip("/").split("/")
+            if len(parts) >= 2 and parts[0] == "tag":
+                tags.append(parts[1].replace("+", " "))
+                continue
+        label = a.text_content().strip()
+        if label:
+            tags.append(label)
+
+    # Parent: link in the "Parent:" row of the details table, "None" otherwise
+    parent_gid = None
+    for href in doc.xpath(
+        '//div[@id="gdd"]//tr[starts-with(normalize-space(td[1]), "Parent")]/td[2]//a/@href'
+    ):
+        parent_gid = parse_gid(urllib.parse.urljoin(gallery_url, href))
+
+    return GalleryInfo(gid=gid, url=gallery_url, title=title, tags=tags, parent_gid=parent_gid)
+
+
+def parse_mpv_page(text: str, mpv_url: str) -> MpvInfo:
+    """Parse pagecount, mpvkey and the imagelist from an MPV page."""
+    # Extract gid and token from the URL
+    url_parts = mpv_url.split("/")
+    try:
+        mpv_index = url_parts.index("mpv")
+    except (ValueError, IndexError):
+        raise ValueError("Cannot parse gid/token from mpv URL: " + mpv_url)
+    gid = int(url_parts[mpv_index + 1])
+    token = url_parts[mpv_index + 2]
+
+    # Extract pagecount
+    pagecount = 0
+    m = PAGECOUNT_PATTERN.search(text)
+    if m:
+        pagecount = int(m.group(1))
+
+    # Extract mpvkey from inline script if present
+    mpvkey = None
+    mm = MPVKEY_PATTERN.search(text)
+    if mm:
+        mpvkey = mm.group(1)
+
+    # Parse imagelist strictly via JSON and extract t webp URL
+    images: List[MpvImageEntry] = []
+    imagelist_json_match = IMAGELIST_PATTERN.search(text)
+    if not imagelist_json_match:
+        raise ValueError("imagelist not found in MPV page")
+    raw = imagelist_json_match.group(1)
+    data = json.loads(raw)
+    for idx, item in enumerate(data):
+        images.append(MpvImageEntry.from_dict(idx, item))
+
+    return MpvInfo(
+        gid=gid,
+        token=token,
+        mpv_url=mpv_url,
+        pagecount=pagecount,
+        mpvkey=mpvkey,
+        images=images,
+    )
+
+
+class SessionUnavailable(RuntimeError):
+    """The session was benched after a ban or an exhausted image quota."""
+
+
+class QuotaTracker:
+    """Pages charged to an account over the last `window` seconds."""
+
+    def __init__(self, window: float = 3600):
+        self.window = window
+        self.events: Deque[Tuple[float, int]] = collections.deque()
+        self.total = 0
+
+    def add(self, pages: int = 1) -> None:
+        self.events.append((time.monotonic(), pages))
+        self.total += pages
+
+    def used(self) -> int:
+        cutoff = time.monotonic() - self.window
+        while self.events and self.events[0][0] < cutoff:
+            self.total -= self.events.popleft()[1]
+        return self.total
+
+
+class ExHentaiSession:
+    """One ExHentai account with its own connections, semaphore and quota use."""
+
+    def __init__(
+        self,
+        name: str,
+        cookie_header: Optional[str],
+        semaphore_size: int,
+        timeout: float,
+        max_connections: Optional[int],
+        user_agent: str,
+        proxy_pool: Optional[ProxyPool] = None,
+    ):
+        headers = {"User-Agent": user_agent}
+        if cookie_header:
+            headers["Cookie"] = cookie_header
+        self.name = name
+        # Each imagedispatch slot holds one api.php POST, plus room for page fetches
+        self.client = build_proxied_client(
+            proxy_pool,
+            name,
+            timeout=timeout,
+            max_connections=max_connections or semaphore_size + 4,
+            headers=headers,
+        )
+        self.semaphore = PriorityLimiter(name, semaphore_size)
+        self.quota = QuotaTracker()
+        self.benched_until = 0.0
+        self.bench_reason: Optional[str] = None
+        EXH_SESSION_QUOTA.set_function(self.quota.used, session=name)
+
+    @property
+    def healthy(self) -> bool:
+        return self.benched_until <= time.monotonic()
+
+    @property
+    def load(self) -> Tuple[int, int]:
+        return self.quota.used(), sum(self.semaphore.in_use.values())
+
+    def bench(self, seconds: float, reason: str) -> None:
+        self.benched_until = time.monotonic() + seconds
+        self.bench_reason = reason
+        EXH_SESSION_BENCHES.inc(session=self.name, reason=reason)
+        logger.warning(f"Benched ExHentai session {self.name} for {seconds:g}s: {reason}")
+
+    def unbench(self) -> None:
+        self.benched_until = 0.0
+        self.bench_reason = None
+
+
 class ExHentaiClient:
+    """ExHentai client spreading galleries over one or more accounts.
+
+    Every cookie gets its own session. A gallery sticks to the session that
+    fetched its pages, since the mpvkey used by imagedispatch belongs to that
+    account; new galleries go to the healthy session that was charged the
+    fewest pages in the last hour. A session is benched for `bench_time`
+    seconds when ExHentai reports an IP ban or hands out the 509 quota image,
+    and its galleries move to another session, which fetches its own mpvkey.
+    """
+
     BASE_URL = "https://exhentai.org"
     API_URL = "https://s.exhentai.org/api.php"
     RESET_URL = "https://e-hentai.org/home.php"
@@ -123,31 +434,94 @@ class ExHentaiClient:
         "Chrome/145.0.0.0 Safari/537.36"
     )
 
-    def __init__(self, cookie_header: Optional[str] = None, semaphore_size: int = 4):
-        headers = {"User-Agent": self.DEFAULT_USER_AGENT}
-        if cookie_header:
-            headers["Cookie"] = cookie_header
-        self.client = httpx.AsyncClient(
-            headers=headers, follow_redirects=True, http2=True
+    def __init__(
+        self,
+        cookie_header: Optional[str] = None,
+        semaphore_size: int = 4,
+        timeout: float = 30,
+        max_connections: Optional[int] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        extra_cookie_headers: Optional[List[str]] = None,
+        bench_time: float = 3600,
+        proxy_pool: Optional[ProxyPool] = None,
+    ):
+        cookies = [cookie_header] + list(extra_cookie_headers or [])
+        self.sessions = [
+            ExHentaiSession(
+                ## The first session keeps the metric names of a single account
+                "exhentai" if i == 0 else f"exhentai_{i + 1}",
+                cookie,
+                semaphore_size=semaphore_size,
+                timeout=timeout,
+                max_connections=max_connections,
+                user_agent=self.DEFAULT_USER_AGENT,
+                proxy_pool=proxy_pool,
+            )
+            for i, cookie in enumerate(cookies)
+        ]
+        self.retry_policy = retry_policy
+        self.bench_time = bench_time
+        self.assigned = TTLCache(ttl=6 * 3600, maxsize=4096)
+        ## mpvkeys by (session name, gid) and gallery URLs by gid, to fetch a
+        ## new mpvkey when a gallery moves to another session
+        self.mpvkeys = TTLCache(ttl=6 * 3600, maxsize=4096)
+        self.gallery_urls = TTLCache(ttl=6 * 3600, maxsize=4096)
+        self.mpv_locks: WeakValueDictionary[Tuple[str, int], asyncio.Lock] = (
+            WeakValueDictionary()
         )
-        self.semaphore = asyncio.Semaphore(semaphore_size)
 
     async def aclose(self) -> None:
-        await self.client.aclose()
-
-    async def reset_gp(self):
+        for session in self.sessions:
+            await session.client.aclose()
+
+    def _pick(self) -> ExHentaiSession:
+        healthy = [s for s in self.sessions if s.healthy]
+        if not healthy:
+            ## Keep going on the session that comes back first rather than stop
+            return min(self.sessions, key=lambda s: s.benched_until)
+        return min(healthy, key=lambda s: s.load)
+
+    def session_for(self, gid: Optional[int]) -> ExHentaiSession:
+        """The session serving gallery `gid`, assigning one if needed."""
+        if gid is None:
+            return self._pick()
+        session = self.assigned.get(gid)
+        if session is None or not session.healthy:
+            session = self._pick()
+            self.assigned.set(gid, session)
+            session.quota.add()
+        return session
+
+    def _check_ban(self, session: ExHentaiSession, resp: httpx.Response) -> None:
+        if BAN_PATTERN.search(resp.text or ""):
+            session.bench(self.bench_time, "ban")
+            raise SessionUnavailable(f"ExHentai session {session.name} is banned")
+
+    async def reset_gp(self, gid: Optional[int] = None):
+        """Reset the image quota of the session serving `gid`."""
+        session = self.session_for(gid)
         try:
             data = {"reset_imagelimit": "Reset Quota"}
+            ## Not idempotent: only retried if the request was never sent
             resp = await retry_request(
-                self.client, method="POST", url=self.RESET_URL, data=data
+                session.client,
+                method="POST",
+                url=self.RESET_URL,
+                data=data,
+                policy=self.retry_policy,
             )
             resp.raise_for_status()
+            GP_RESETS.inc(result="ok")
+            if session.bench_reason == "quota":
+                session.unbench()
         except Exception as e:
+            GP_RESETS.inc(result="error")
             logger.error(f"Failed to reset GP quota: {e}")
 
     # -----------------------------
     # Search
     # -----------------------------
+    @timed("search")
     async def search_galleries(
         self,
         search: str,
@@ -178,8 +552,13 @@ class ExHentaiClient:
         if next_gid is not None:
             params["next"] = next_gid
 
+        session = self._pick()
         resp = await retry_request(
-            self.client, method="GET", url=self.BASE_URL + "/", params=params
+            session.client,
+            method="GET",
+            url=self.BASE_URL + "/",
+            params=params,
+            policy=self.retry_policy,
         )
         resp.raise_for_status()
         if not resp.text or not resp.text.strip():
@@ -188,147 +567,59 @@ class ExHentaiClient:
                 f"url={resp.url}, headers={dict(resp.headers)}), skipping"
             )
             return [], None
-        doc = lxml_html.fromstring(resp.text)
-
-        # Prefer structured rows under the name cell which contains href, glink, and gt tags
-        entries: List[GalleryEntry] = []
-        last_gid_value: Optional[int] = None
-        anchors = doc.xpath('//td[contains(@class,"glname")]//a[contains(@href,"/g/")]')
-        if not anchors:
-            anchors = doc.xpath(
-                '//td[contains(@class,"gl2e")]//a[contains(@href,"/g/")]'
-            )
-        if not anchors:
-            anchors = doc.xpath(
-                '//div[contains(@class,"gl1t")]//a[contains(@href,"/g/")]'
-            )
-        for a in anchors:
-            href = a.get("href")
-            if not href:
-                continue
-            url = urllib.parse.urljoin(self.BASE_URL, href)
-
-            # Extract gid from URL path without regex; update last gid seen
-            path = urllib.parse.urlparse(url).path.strip("/")
-            segments = path.split("/")
-            try:
-                idx = segments.index("g")
-                gid_candidate = int(segments[idx + 1])
-                last_gid_value = gid_candidate
-            except Exception:
-                pass
-
-            glink_nodes = a.xpath('.//div[@class="glink"]')
-            title = (
-                glink_nodes[0].text_content().strip()
-                if glink_nodes
-                else a.text_content().strip()
-            )
-            tags = [t for t in a.xpath('.//div[@class="gt"]/@title') if t]
-            entries.append(
-                GalleryEntry(gid=gid_candidate, url=url, title=title, tags=tags)
-            )
-
-        return entries, last_gid_value
+        self._check_ban(session, resp)
+        return parse_search_page(resp.text, self.BASE_URL)
 
+    @timed("gallery_info")
     async def get_gallery_info(self, gallery_url: str) -> GalleryInfo:
-        resp = await retry_request(self.client, method="GET", url=gallery_url)
+        session = self.session_for(parse_gid(gallery_url))
+        resp = await retry_request(
+            session.client, method="GET", url=gallery_url, policy=self.retry_policy
+        )
         resp.raise_for_status()
         if not resp.text or not resp.text.strip():
             raise RuntimeError(f"Empty response from gallery page: {gallery_url}")
-        doc = lxml_html.fromstring(resp.text)
-
-        # Parse gid from URL (/g/<gid>/<token>/...)
-        gid = None
-        path = urllib.parse.urlparse(gallery_url).path.strip("/")
-        segments = path.split("/")
-        try:
-            idx = segments.index("g")
-            gid = int(segments[idx + 1])
-        except Exception:
-            gid = None
-
-        # Title: prefer english title in #gj, fallback to #gn or <title>
-        title = None
-        title_node = doc.xpath('//h1[@id="gj"]')
-        if title_node:
-            title = title_node[0].text_content().strip()
-        if not title:
-            title_node = doc.xpath('//h1[@id="gn"]')
-            if title_node:
-                title = title_node[0].text_content().strip()
-        if not title:
-            title = (doc.xpath("//title/text()") or [""])[0].strip()
-
-        # Tags: prefer explicit tag ids (ta_namespace:tag) -> "namespace:tag"
-        tags: List[str] = []
-        for a in doc.xpath("//div[@id='taglist']//a[starts-with(@id,'ta_')]"):
-            aid = a.get("id")
-            if aid and aid.startswith("ta_"):
-                tags.append(aid[len("ta_") :].replace("+", " "))
-                continue
-            href = a.get("href", "")
-            if href:
-                p = urllib.parse.unquote(urllib.parse.urlparse(href).path)
-                parts = p.strip("/").split("/")
-                if len(parts) >= 2 and parts[0] == "tag":
-                    tags.append(parts[1].replace("+", " "))
-                    continue
-            text = a.text_content().strip()
-            if text:
-                tags.append(text)
-
-        return GalleryInfo(gid=gid, url=gallery_url, title=title, tags=tags)
+        self._check_ban(session, resp)
+        return parse_gallery_page(resp.text, gallery_url)
 
     # -----------------------------
     # MPV parsing
     # -----------------------------
+    @timed("mpv")
     async def fetch_mpv_info(self, gallery_url: str) -> MpvInfo:
+        gid = parse_gid(gallery_url)
+        session = self.session_for(gid)
+        mpv_info = await self._fetch_mpv_info(session, gallery_url)
+        if gid is not None:
+            self.gallery_urls.set(gid, gallery_url)
+            session.quota.add(len(mpv_info.images))
+        return mpv_info
+
+    async def _fetch_mpv_info(self, session: ExHentaiSession, gallery_url: str) -> MpvInfo:
         mpv_url = gallery_url.replace("/g/", "/mpv/")
-        resp = await retry_request(self.client, method="GET", url=mpv_url)
-        resp.raise_for_status()
-        text = resp.text
-
-        # Extract gid and token from the URL
-        url_parts = mpv_url.split("/")
-        try:
-            mpv_index = url_parts.index("mpv")
-        except (ValueError, IndexError):
-            raise ValueError("Cannot parse gid/token from mpv URL: " + mpv_url)
-        gid = int(url_parts[mpv_index + 1])
-        token = url_parts[mpv_index + 2]
-
-        # Extract pagecount
-        pagecount = 0
-        m = re.search(r"var\s+pagecount\s*=\s*(\d+)", text)
-        if m:
-            pagecount = int(m.group(1))
-
-        # Extract mpvkey from inline script if present
-        mpvkey = None
-        pattern = r"var\s+mpvkey\s*=\s*\"([0-9a-zA-Z]+)\""
-        mm = re.search(pattern, text)
-        if mm:
-            mpvkey = mm.group(1)
-
-        # Parse imagelist strictly via JSON and extract t webp URL
-        images: List[MpvImageEntry] = []
-        imagelist_json_match = re.search(r"var\s+imagelist\s*=\s*(\[[\s\S]*?\]);", text)
-        if not imagelist_json_match:
-            raise ValueError("imagelist not found in MPV page")
-        raw = imagelist_json_match.group(1)
-        data = json.loads(raw)
-        for idx, item in enumerate(data):
-            images.append(MpvImageEntry.from_dict(idx, item))
-
-        return MpvInfo(
-            gid=gid,
-            token=token,
-            mpv_url=mpv_url,
-            pagecount=pagecount,
-            mpvkey=mpvkey,
-            images=images,
+        resp = await retry_request(
+            session.client, method="GET", url=mpv_url, policy=self.retry_policy
         )
+        resp.raise_for_status()
+        self._check_ban(session, resp)
+        mpv_info = parse_mpv_page(resp.text, mpv_url)
+        if mpv_info.mpvkey:
+            self.mpvkeys.set((session.name, mpv_info.gid), mpv_info.mpvkey)
+        return mpv_info
+
+    async def _mpvkey(self, session: ExHentaiSession, gid: int, mpvkey: str) -> str:
+        """The mpvkey of `session` for `gid`, fetched if the gallery moved."""
+        key = (session.name, gid)
+        lock = self.mpv_locks.get(key)
+        if lock is None:
+            lock = self.mpv_locks[key] = asyncio.Lock()
+        async with lock:
+            own = self.mpvkeys.get(key)
+            gallery_url = self.gallery_urls.get(gid)
+            if own is None and gallery_url is not None and len(self.sessions) > 1:
+                logger.info(f"Fetching MPV info for session {session.name}: {gid}")
+                own = (await self._fetch_mpv_info(session, gallery_url)).mpvkey
+        return own or mpvkey
 
     # -----------------------------
     # API calls
@@ -336,32 +627,37 @@ class ExHentaiClient:
     async def imagedispatch(
         self, gid: int, page: int, imgkey: str, mpvkey: str, s: Optional[str] = None
     ) -> ImageDispatch:
-        async with self.semaphore:
-            payload = {
-                "method": "imagedispatch",
-                "gid": gid,
-                "page": page,
-                "imgkey": imgkey,
-                "mpvkey": mpvkey,
-            }
-            if s is not None:
-                payload["s"] = s
-            r = await retry_request(
-                self.client, method="POST", url=self.API_URL, json=payload
-            )
-            r.raise_for_status()
-            data = r.json()
-            ## check if result's i URL is accessable or retry with s
-            if data and data.get("i") is not None:
-                resp = await self.client.head(data["i"])
-                if resp.status_code != 200 and data.get("s") is not None:
-                    logger.warning(
-                        f"Image dispatch failed, retrying with s: {data['i']}"
-                    )
-                    return await self.imagedispatch(
-                        gid, page, imgkey, mpvkey, data["s"]
-                    )
-            return ImageDispatch.from_dict(data)
+        session = self.session_for(gid)
+        mpvkey = await self._mpvkey(session, gid, mpvkey)
+        async with session.semaphore:
+            with STAGE_SECONDS.time(stage="imagedispatch"):
+                payload = {
+                    "method": "imagedispatch",
+                    "gid": gid,
+                    "page": page,
+                    "imgkey": imgkey,
+                    "mpvkey": mpvkey,
+                }
+                if s is not None:
+                    payload["s"] = s
+                ## imagedispatch only reads, repeating it is harmless
+                r = await retry_request(
+                    session.client,
+                    method="POST",
+                    url=self.API_URL,
+                    json=payload,
+                    policy=self.retry_policy,
+                    idempotent=True,
+                )
+                r.raise_for_status()
+                ## The image server is not probed here: a dead one fails the
+                ## upload, which asks again with `s` for another server
+                dispatch = ImageDispatch.from_dict(r.json())
+        if QUOTA_IMAGE_PATTERN.search(dispatch.i):
+            ## The next attempt for this gallery goes to another session
+            session.bench(self.bench_time, "quota")
+            raise SessionUnavailable(f"ExHentai session {session.name} is out of quota")
+        return dispatch
 
 
 class EhTagConverter:
@@ -372,8 +668,17 @@ class EhTagConverter:
     )
     SHA_URL = "https://github.com/EhTagTranslation/Database/releases/latest/download/sha"
 
-    def __init__(self, local_dir: str):
-        self.client = httpx.AsyncClient(follow_redirects=True, http2=True)
+    def __init__(
+        self,
+        local_dir: str,
+        timeout: float = 60,
+        retry_policy: Optional[RetryPolicy] = None,
+        proxy_pool: Optional[ProxyPool] = None,
+    ):
+        self.client = build_proxied_client(
+            proxy_pool, "ehtag", timeout=timeout, max_connections=2
+        )
+        self.retry_policy = retry_policy
         self.data: Dict[str, Dict[str, Dict[str, str]]] = {}
         self.sha: Optional[str] = None
         self._loaded = False
@@ -383,13 +688,17 @@ class EhTagConverter:
 
     async def _fetch_remote_sha(self) -> str:
         """Fetch the remote SHA hash."""
-        resp = await retry_request(self.client, method="GET", url=self.SHA_URL)
+        resp = await retry_request(
+            self.client, method="GET", url=self.SHA_URL, policy=self.retry_policy
+        )
         resp.raise_for_status()
         return resp.text.strip()
 
     async def _fetch_remote_db(self) -> Dict:
         """Fetch the remote database."""
-        resp = await retry_request(self.client, method="GET", url=self.DB_URL)
+        resp = await retry_request(
+            self.client, method="GET", url=self.DB_URL, policy=self.retry_policy
+        )
         resp.raise_for_status()
         return resp.json()
 
@@ -0,0 +1,181 @@
+import asyncio
+import ipaddress
+import socket
+import ssl
+from typing import Dict, List, Optional
+
+import httpcore
+import httpx
+
+from .metrics import (
+    DNS_LOOKUPS,
+    HTTP_CLIENT_REQUESTS,
+    HTTP_CONNECTION_REUSE,
+    HTTP_CONNECTIONS,
+)
+from .utils import TTLCache
+
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+DEFAULT_DNS_TTL = 300.0
+
+
+class HttpConfig:
+    """Defaults shared by every client built with `build_client`."""
+
+    def __init__(self):
+        self.connect_timeout = DEFAULT_CONNECT_TIMEOUT
+        self.keepalive_expiry = DEFAULT_KEEPALIVE_EXPIRY
+        self.dns_cache = TTLCache(ttl=DEFAULT_DNS_TTL)
+        self.ssl_contexts: Dict[bool, ssl.SSLContext] = {}
+
+    def configure(
+        self,
+        connect_timeout: Optional[float] = None,
+        keepalive_expiry: Optional[float] = None,
+        dns_ttl: Optional[float] = None,
+    ) -> None:
+        if connect_timeout is not None:
+            self.connect_timeout = connect_timeout
+        if keepalive_expiry is not None:
+            self.keepalive_expiry = keepalive_expiry
+        if dns_ttl is not None:
+            self.dns_cache = TTLCache(ttl=dns_ttl)
+
+    def ssl_context(self, http2: bool) -> ssl.SSLContext:
+        # Building a context loads the CA bundle, which is slow; share one per
+        # ALPN setting since httpcore sets the protocols on every connect
+        context = self.ssl_contexts.get(http2)
+        if context is None:
+            context = self.ssl_contexts[http2] = httpx.create_ssl_context()
+        return context
+
+
+config = HttpConfig()
+configure = config.configure
+
+
+class CachingNetworkBackend(httpcore.AsyncNetworkBackend):
+    """Network backend resolving hosts through a shared TTL cache.
+
+    TLS still uses the original hostname for SNI and certificate checks since
+    httpcore passes it to `start_tls` separately. Every `connect_tcp` is a new
+    connection and, for https, a TLS handshake.
+    """
+
+    def __init__(self, backend: httpcore.AsyncNetworkBackend, name: str):
+        self.backend = backend
+        self.name = name
+
+    async def _resolve(self, host: str, port: int, timeout: Optional[float]):
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+        addresses = config.dns_cache.get((host, port))
+        if addresses is not None:
+            DNS_LOOKUPS.inc(result="hit")
+            return addresses
+        loop = asyncio.get_running_loop()
+        try:
+            async with asyncio.timeout(timeout):
+                infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except TimeoutError as e:
+            DNS_LOOKUPS.inc(result="error")
+            raise httpcore.ConnectTimeout(f"DNS lookup timed out for {host}") from e
+        except OSError as e:
+            DNS_LOOKUPS.inc(result="error")
+            raise httpcore.ConnectError(str(e)) from e
+        DNS_LOOKUPS.inc(result="miss")
+        addresses: List[str] = list(dict.fromkeys(info[4][0] for info in infos))
+        config.dns_cache.set((host, port), addresses)
+        return addresses
+
+    async def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: Optional[float] = None,
+        local_address: Optional[str] = None,
+        socket_options=None,
+    ) -> httpcore.AsyncNetworkStream:
+        HTTP_CONNECTIONS.inc(client=self.name)
+        addresses = await self._resolve(host, port, timeout)
+        error: Optional[Exception] = None
+        for address in addresses:
+            try:
+                return await self.backend.connect_tcp(
+                    address,
+                    port,
+                    timeout=timeout,
+                    local_address=local_address,
+                    socket_options=socket_options,
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        # The cached addresses may be stale
+        config.dns_cache.pop((host, port))
+        raise error
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self.backend.connect_unix_socket(
+            path, timeout=timeout, socket_options=socket_options
+        )
+
+    async def sleep(self, seconds: float) -> None:
+        await self.backend.sleep(seconds)
+
+
+def connection_reuse(name: str) -> float:
+    """Share of requests of client `name` served on an existing connection."""
+    requests = sum(
+        count
+        for (client, _), count in HTTP_CLIENT_REQUESTS.values.items()
+        if client == name
+    )
+    connections = HTTP_CONNECTIONS.values.get((name,), 0)
+    return max(0.0, 1 - connections / requests) if requests else 0.0
+
+
+def build_client(
+    name: str,
+    timeout: float = 30,
+    max_connections: int = 20,
+    max_keepalive_connections: Optional[int] = None,
+    http2: bool = True,
+    proxy: Optional[str] = None,
+    headers: Optional[dict] = None,
+    follow_redirects: bool = True,
+) -> httpx.AsyncClient:
+    """Build an AsyncClient with explicit pool limits and timeouts.
+
+    `name` labels the connection and request metrics of the client. Idle
+    connections are kept for `keepalive_expiry` seconds (httpx defaults to
+    5s, which drops them between pipeline stages).
+    """
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections or max_connections,
+        keepalive_expiry=config.keepalive_expiry,
+    )
+    transport = httpx.AsyncHTTPTransport(
+        verify=config.ssl_context(http2),
+        http2=http2,
+        limits=limits,
+        proxy=proxy or None,
+    )
+    pool = transport._pool
+    pool._network_backend = CachingNetworkBackend(pool._network_backend, name)
+
+    async def on_response(response: httpx.Response) -> None:
+        HTTP_CLIENT_REQUESTS.inc(client=name, http_version=response.http_version)
+
+    HTTP_CONNECTION_REUSE.set_function(lambda: connection_reuse(name), client=name)
+    return httpx.AsyncClient(
+        transport=transport,
+        headers=headers,
+        timeout=httpx.Timeout(timeout, connect=config.connect_timeout),
+        follow_redirects=follow_redirects,
+        event_hooks={"response": [on_response]},
+    )
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import socket
+from datetime import timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from loguru import logger
+from tortoise import timezone
+
+from .metrics import JOB_QUEUE_DEPTH, JOBS
+from .storage import (
+    Job,
+    claim_job,
+    count_jobs,
+    delete_job,
+    extend_job,
+    release_job,
+)
+
+
+class JobWorker:
+    """Claims gallery jobs from the database queue and runs them.
+
+    Delivery is at least once: a job is deleted only after `run` returns, and
+    a job whose worker dies is claimed again when its lease expires. Failed
+    jobs are retried with exponential backoff up to `max_attempts`, after
+    which `on_failed` is called and the job is dropped.
+    """
+
+    def __init__(
+        self,
+        run: Callable[[Job], Awaitable[None]],
+        on_failed: Optional[Callable[[Job], Awaitable[None]]] = None,
+        concurrency: int = 4,
+        lease: float = 600,
+        poll_interval: float = 2,
+        max_attempts: int = 3,
+        backoff: float = 30,
+    ):
+        self.run = run
+        self.on_failed = on_failed
+        self.concurrency = concurrency
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.tasks: List[asyncio.Task] = []
+        self.depth = 0
+
+    def start(self) -> None:
+        JOB_QUEUE_DEPTH.set_function(lambda: self.depth)
+        self.tasks = [
+            asyncio.create_task(self._loop()) for _ in range(self.concurrency)
+        ]
+        self.tasks.append(asyncio.create_task(self._watch_depth()))
+        logger.info(f"Job worker {self.worker_id} started ({self.concurrency} slots)")
+
+    async def stop(self) -> None:
+        """Cancel running jobs; their leases expire and others pick them up."""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks.clear()
+
+    async def _watch_depth(self) -> None:
+        while True:
+            try:
+                self.depth = await count_jobs()
+            except Exception as e:
+                logger.warning(f"Failed to count jobs: {e}")
+            await asyncio.sleep(max(self.poll_interval, 10))
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                job = await claim_job(self.worker_id, self.lease)
+            except Exception as e:
+                logger.error(f"Failed to claim job: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to finish job {job.id}: {e}")
+
+    async def _heartbeat(self, job: Job) -> None:
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            if not await extend_job(job.id, self.worker_id, self.lease):
+                logger.warning(f"Lost the lease of job {job.id}")
+
+    async def _process(self, job: Job) -> None:
+        logger.info(f"Running job {job.id} (attempt {job.attempts}): {job.url}")
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            await self.run(job)
+        except asyncio.CancelledError:
+            ## Shutting down, hand the job back right away
+            await release_job(job.id, timezone.now())
+            raise
+        except Exception as e:
+            JOBS.inc(result="error")
+            await self._fail(job, e)
+        else:
+            JOBS.inc(result="ok")
+            await delete_job(job.id)
+        finally:
+            heartbeat.cancel()
+
+    async def _fail(self, job: Job, error: Exception) -> None:
+        if job.attempts >= self.max_attempts:
+            logger.error(f"Job {job.id} failed {job.attempts} times, dropping: {error}")
+            if self.on_failed is not None:
+                try:
+                    await self.on_failed(job)
+                except Exception as e:
+                    logger.error(f"Failed to report job {job.id}: {e}")
+            await delete_job(job.id)
+            return
+        delay = self.backoff * 2 ** (job.attempts - 1)
+        logger.warning(f"Job {job.id} failed, retrying in {delay}s: {error}")
+        await release_job(job.id, timezone.now() + timedelta(seconds=delay))
@@ -0,0 +1,356 @@
+import asyncio
+import functools
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, **extra) -> str:
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def _read(
+        self,
+        values: Dict[LabelValues, float],
+        callbacks: Dict[LabelValues, Callable[[], float]],
+    ) -> Iterator[Tuple[str, str, float]]:
+        values = dict(values)
+        for key, fn in callbacks.items():
+            try:
+                values[key] = fn()
+            except Exception as e:
+                logger.warning(f"Failed to collect {self.name}{key}: {e}")
+        for key, value in values.items():
+            yield "", _format_labels(self.labelnames, key), value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Counter incremented explicitly or read from running totals at scrape time."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.values: Dict[LabelValues, float] = {}
+        self.callbacks: Dict[LabelValues, Callable[[], float]] = {}
+        super().__init__(name, help, labelnames)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def set_function(self, fn: Callable[[], float], **labels) -> None:
+        self.callbacks[self._key(labels)] = fn
+
+    def samples(self):
+        return self._read(self.values, self.callbacks)
+
+
+class Gauge(Metric):
+    """Gauge set explicitly or read from callbacks at scrape time."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.values: Dict[LabelValues, float] = {}
+        self.callbacks: Dict[LabelValues, Callable[[], float]] = {}
+        super().__init__(name, help, labelnames)
+
+    def set(self, value: float, **labels) -> None:
+        self.values[self._key(labels)] = value
+
+    def set_function(self, fn: Callable[[], float], **labels) -> None:
+        self.callbacks[self._key(labels)] = fn
+
+    def samples(self):
+        return self._read(self.values, self.callbacks)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.buckets = buckets
+        self.counts: Dict[LabelValues, List[int]] = {}
+        self.sums: Dict[LabelValues, float] = {}
+        super().__init__(name, help, labelnames)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.sums[key] = 0.0
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-1] += 1
+        self.sums[key] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, counts in self.counts.items():
+            for bound, count in zip(self.buckets, counts):
+                yield "_bucket", _format_labels(self.labelnames, key, le=bound), count
+            yield "_bucket", _format_labels(self.labelnames, key, le="+Inf"), counts[-1]
+            yield "_sum", _format_labels(self.labelnames, key), self.sums[key]
+            yield "_count", _format_labels(self.labelnames, key), counts[-1]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> None:
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram(
+    "exhenbot_stage_duration_seconds",
+    "Latency of each step of gallery processing.",
+    ("stage",),
+)
+UPLOAD_SECONDS = Histogram(
+    "exhenbot_upload_duration_seconds",
+    "Latency of each upload backend attempt.",
+    ("backend", "result"),
+)
+UPLOAD_VERIFICATIONS = Counter(
+    "exhenbot_upload_verifications_total",
+    "Uploaded images checked after publishing.",
+    ("backend", "result"),
+)
+PAGES_REUSED = Counter(
+    "exhenbot_pages_reused_total",
+    "Pages taken from an older version of a gallery instead of uploaded.",
+)
+LINK_SWEEP_IMAGES = Counter(
+    "exhenbot_link_sweep_images_total",
+    "Images of stored galleries checked by the link sweeper.",
+    ("backend", "result"),
+)
+LINK_SWEEP_GALLERIES = Counter(
+    "exhenbot_link_sweep_galleries_total",
+    "Stored galleries visited by the link sweeper.",
+    ("result",),
+)
+HTTP_REQUESTS = Counter(
+    "exhenbot_http_requests_total",
+    "HTTP requests sent through retry_request.",
+    ("host", "status"),
+)
+HTTP_RETRIES = Counter(
+    "exhenbot_http_retries_total", "HTTP request retries.", ("host",)
+)
+HTTP_RETRIES_SKIPPED = Counter(
+    "exhenbot_http_retries_skipped_total",
+    "Failed HTTP requests not retried, by reason.",
+    ("host", "reason"),
+)
+HTTP_BYTES = Counter(
+    "exhenbot_http_bytes_total",
+    "HTTP bytes transferred.",
+    ("host", "direction"),
+)
+HTTP_CLIENT_REQUESTS = Counter(
+    "exhenbot_http_client_requests_total",
+    "Responses received per HTTP client and protocol version.",
+    ("client", "http_version"),
+)
+HTTP_CONNECTIONS = Counter(
+    "exhenbot_http_connections_total",
+    "New connections opened per HTTP client, each a TCP and TLS handshake.",
+    ("client",),
+)
+HTTP_CONNECTION_REUSE = Gauge(
+    "exhenbot_http_connection_reuse_ratio",
+    "Share of requests served on an already open connection.",
+    ("client",),
+)
+PROXY_REQUEST_SECONDS = Histogram(
+    "exhenbot_proxy_request_seconds",
+    "Latency of requests and health checks per outbound proxy.",
+    ("proxy", "result"),
+)
+PROXY_HEALTHY = Gauge(
+    "exhenbot_proxy_healthy", "Whether an outbound proxy is in rotation.", ("proxy",)
+)
+DNS_LOOKUPS = Counter("exhenbot_dns_lookups_total", "Host lookups.", ("result",))
+GP_RESETS = Counter("exhenbot_gp_resets_total", "GP quota resets.", ("result",))
+EXH_SESSION_BENCHES = Counter(
+    "exhenbot_exh_session_benches_total",
+    "ExHentai sessions taken out of rotation.",
+    ("session", "reason"),
+)
+EXH_SESSION_QUOTA = Gauge(
+    "exhenbot_exh_session_quota_pages",
+    "Pages charged to an ExHentai session in the last hour.",
+    ("session",),
+)
+SEMAPHORE_IN_USE = Gauge(
+    "exhenbot_semaphore_in_use", "Acquired semaphore slots.", ("name", "lane")
+)
+SEMAPHORE_WAITERS = Gauge(
+    "exhenbot_semaphore_waiters", "Tasks waiting on a semaphore.", ("name", "lane")
+)
+LIMITER_WAIT_SECONDS = Histogram(
+    "exhenbot_semaphore_wait_seconds",
+    "Time spent waiting for a semaphore slot.",
+    ("name", "lane"),
+)
+PIPELINE_QUEUE_DEPTH = Gauge(
+    "exhenbot_pipeline_queue_depth", "Jobs queued per pipeline stage.", ("stage",)
+)
+PIPELINE_BUSY = Gauge(
+    "exhenbot_pipeline_busy_workers", "Busy workers per pipeline stage.", ("stage",)
+)
+PIPELINE_JOBS = Counter(
+    "exhenbot_pipeline_jobs_total",
+    "Jobs finished per pipeline stage.",
+    ("stage", "result"),
+)
+JOBS = Counter("exhenbot_jobs_total", "Gallery jobs run by this worker.", ("result",))
+JOB_QUEUE_DEPTH = Gauge(
+    "exhenbot_job_queue_depth", "Gallery jobs in the database queue."
+)
+SCHEDULER_LEADER = Gauge(
+    "exhenbot_scheduler_leader", "Whether this replica holds the scheduler lease."
+)
+SCHEDULER_REPLICAS = Gauge("exhenbot_scheduler_replicas", "Replicas with a live lease.")
+STARTUP_SECONDS = Gauge(
+    "exhenbot_startup_seconds", "Time spent in each startup phase.", ("phase",)
+)
+EVENT_LOOP_LAG = Histogram(
+    "exhenbot_event_loop_lag_seconds",
+    "Delay between a scheduled wake-up and the event loop running it.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+
+def timed(stage: str):
+    """Decorator recording a coroutine's latency under `stage`."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with STAGE_SECONDS.time(stage=stage):
+                return await fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def track_limiter(limiter) -> None:
+    for value, lane in limiter.lanes.items():
+        SEMAPHORE_IN_USE.set_function(
+            lambda v=value: limiter.in_use[v], name=limiter.name, lane=lane
+        )
+        SEMAPHORE_WAITERS.set_function(
+            lambda v=value: len(limiter.waiters[v]), name=limiter.name, lane=lane
+        )
+
+
+def track_pipeline(pipeline) -> None:
+    for stage in pipeline.stages:
+        PIPELINE_QUEUE_DEPTH.set_function(stage.queue.qsize, stage=stage.name)
+        PIPELINE_BUSY.set_function(lambda s=stage: s.busy, stage=stage.name)
+        PIPELINE_JOBS.set_function(
+            lambda s=stage: s.processed, stage=stage.name, result="ok"
+        )
+        PIPELINE_JOBS.set_function(
+            lambda s=stage: s.failed, stage=stage.name, result="error"
+        )
+
+
+class MetricsServer:
+    """Minimal HTTP server exposing the registry in Prometheus text format."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Metrics listening on {self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", REGISTRY.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.warning(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
@@ -0,0 +1,457 @@
+import asyncio
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from .exhentai_client import (
+    EhTagConverter,
+    ExHentaiClient,
+    GalleryInfo,
+    MpvInfo,
+    parse_gid,
+)
+from .metrics import PAGES_REUSED, STAGE_SECONDS
+from .priority import PriorityLimiter, current_lane, use_lane
+from .proxy_pool import use_route
+from .storage import (
+    Gallery,
+    get_gallery,
+    get_gallery_images,
+    get_version_pages,
+    set_gallery_images,
+    set_gallery_version,
+    upsert_gallery,
+)
+from .telegraph_client import TelegraphClient
+from .tracing import span, use_span
+from .uploader_client import FileUploader
+from .utils import check_deadline, use_deadline
+from .verifier import UploadVerifier
+
+MAX_IMAGES = 100
+MAX_ATTEMPTS = 3
+
+
+@dataclass
+class GalleryJob:
+    url: str
+    author_name: str
+    author_url: Optional[str]
+    send_if_exists: bool = True
+    force_update: bool = False
+    chat_id: int | None = None
+    reset_gp: bool = False
+    lane: int = field(default_factory=current_lane)
+    ## Monotonic time after which the result is no longer wanted
+    deadline: Optional[float] = None
+    future: Optional[asyncio.Future] = None
+    span: Any = None
+
+    # Filled in by the stages
+    gallery_info: Optional[GalleryInfo] = None
+    mpv_info: Optional[MpvInfo] = None
+    dispatch_urls: List[Optional[str]] = field(default_factory=list)
+    dispatch_s: List[Optional[str]] = field(default_factory=list)
+    image_urls: List[Optional[str]] = field(default_factory=list)
+    ## Pages already uploaded for an older version, by index
+    reused: Dict[int, str] = field(default_factory=dict)
+    tags: Dict[str, List[str]] = field(default_factory=dict)
+    telegraph_url: Optional[str] = None
+
+
+class Stage:
+    """Pool of workers consuming one bounded queue.
+
+    Both the queue and the producers waiting for room in it are ordered by
+    lane, so interactive jobs overtake background jobs queued earlier.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[GalleryJob], Awaitable[bool]],
+        workers: int,
+        queue_size: int,
+    ):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self.slots = PriorityLimiter(f"pipeline_{name}", queue_size)
+        self.sequence = itertools.count()
+        self.busy = 0
+        self.processed = 0
+        self.failed = 0
+
+    async def put(self, job: GalleryJob) -> None:
+        await self.slots.acquire(job.lane)
+        self.queue.put_nowait((job.lane, next(self.sequence), job))
+
+    async def get(self) -> GalleryJob:
+        _, _, job = await self.queue.get()
+        self.slots.release(job.lane)
+        return job
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.slots.size,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+
+class Pipeline:
+    """Gallery pipeline split into metadata, dispatch, upload and publish stages.
+
+    Stages are connected by bounded queues so different galleries occupy
+    different stages at the same time: while one gallery uploads to the file
+    hosts, the next one is already talking to ExHentai. A gallery still in
+    the pipeline `deadline` seconds after submission is failed with
+    `DeadlineExceeded`, and its requests stop retrying before that.
+    """
+
+    def __init__(
+        self,
+        client: ExHentaiClient,
+        uploader: FileUploader,
+        telegraph: TelegraphClient,
+        ehtag: EhTagConverter,
+        workers: Dict[str, int],
+        queue_sizes: Dict[str, int],
+        deadline: Optional[float] = None,
+        verify_sample: Optional[Dict[str, float]] = None,
+    ):
+        self.client = client
+        self.uploader = uploader
+        self.telegraph = telegraph
+        self.ehtag = ehtag
+        self.deadline = deadline
+        handlers = {
+            "metadata": self._metadata,
+            "dispatch": self._dispatch,
+            "upload": self._upload,
+            "publish": self._publish,
+        }
+        self.stages = [
+            Stage(name, handler, workers[name], queue_sizes[name])
+            for name, handler in handlers.items()
+        ]
+        self.tasks: List[asyncio.Task] = []
+        ## Futures of new galleries past the metadata stage, by gid
+        self.inflight: Dict[int, asyncio.Future] = {}
+        self.verifier = (
+            UploadVerifier(
+                uploader,
+                rehost=self.rehost,
+                sample_rates=verify_sample,
+            )
+            if verify_sample is not None
+            else None
+        )
+
+    def start(self) -> None:
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                self.tasks.append(asyncio.create_task(self._worker(index)))
+        if self.verifier is not None:
+            self.verifier.start()
+
+    async def stop(self) -> None:
+        for t in self.tasks:
+            t.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks.clear()
+        if self.verifier is not None:
+            await self.verifier.stop()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    async def submit(self, job: GalleryJob) -> Gallery | None:
+        """Run a gallery through the pipeline and wait for the result."""
+        job.future = asyncio.get_running_loop().create_future()
+        if job.deadline is None and self.deadline:
+            job.deadline = time.monotonic() + self.deadline
+        with span("parse_url", url=job.url) as job.span:
+            await self.stages[0].put(job)
+            return await job.future
+
+    async def _worker(self, index: int) -> None:
+        stage = self.stages[index]
+        while True:
+            job = await stage.get()
+            stage.busy += 1
+            try:
+                with (
+                    STAGE_SECONDS.time(stage=f"pipeline_{stage.name}"),
+                    use_span(job.span),
+                    use_lane(job.lane),
+                    use_deadline(job.deadline),
+                    ## Dispatch and image downloads of a gallery share a proxy
+                    use_route(parse_gid(job.url)),
+                    span(f"pipeline.{stage.name}"),
+                ):
+                    check_deadline()
+                    proceed = await stage.handler(job)
+                stage.processed += 1
+            except Exception as e:
+                stage.failed += 1
+                proceed = False
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                stage.busy -= 1
+                stage.queue.task_done()
+            if proceed:
+                await self.stages[index + 1].put(job)
+
+    def _follow(self, job: GalleryJob, future: asyncio.Future) -> None:
+        if job.future.done():
+            return
+        if future.cancelled():
+            job.future.cancel()
+        elif future.exception() is not None:
+            job.future.set_exception(future.exception())
+        else:
+            job.future.set_result(future.result())
+
+    def _forget(self, gid: int, future: asyncio.Future) -> None:
+        if self.inflight.get(gid) is future:
+            del self.inflight[gid]
+
+    def _finish(self, job: GalleryJob, gallery: Gallery | None) -> bool:
+        if not job.future.done():
+            job.future.set_result(gallery)
+        return False
+
+    # -----------------------------
+    # Stages
+    # -----------------------------
+    async def _metadata(self, job: GalleryJob) -> bool:
+        gallery_info = await self.client.get_gallery_info(job.url)
+        logger.info(f"Parsing gallery: {gallery_info.gid} {gallery_info.title}")
+        if job.span is not None:
+            job.span.set_attribute("gid", gallery_info.gid)
+        exist = await get_gallery(gallery_info.gid)
+        if exist is not None and job.force_update:
+            job.telegraph_url = exist.telegraph_url
+        elif exist is not None:
+            logger.info(
+                f"Gallery already exists: {gallery_info.gid} {gallery_info.title}"
+            )
+            exist.chat_ids = exist.chat_ids or []
+            already_sent = job.chat_id and job.chat_id in exist.chat_ids
+            if not job.send_if_exists and already_sent:
+                return self._finish(job, None)
+            return self._finish(job, exist)
+        inflight = self.inflight.get(gallery_info.gid)
+        if inflight is not None and not job.force_update:
+            ## Already being published for another chat, share its result
+            logger.info(f"Gallery already in the pipeline: {gallery_info.gid}")
+            inflight.add_done_callback(lambda f: self._follow(job, f))
+            return False
+        self.inflight[gallery_info.gid] = job.future
+        job.future.add_done_callback(
+            lambda f, gid=gallery_info.gid: self._forget(gid, f)
+        )
+        logger.info(f"Fetching MPV info: {gallery_info.gid} {gallery_info.title}")
+        mpv_info = await self.client.fetch_mpv_info(job.url)
+        if not mpv_info.mpvkey:
+            raise ValueError("mpvkey not found. Cannot call imagedispatch.")
+        mpv_info.images = mpv_info.images[:MAX_IMAGES]
+        job.gallery_info = gallery_info
+        job.mpv_info = mpv_info
+        if gallery_info.parent_gid is not None and not job.force_update:
+            try:
+                job.reused = await self._reusable_pages(
+                    gallery_info.parent_gid, mpv_info
+                )
+            except Exception as e:
+                logger.warning(f"Failed to look up the parent version: {e}")
+        if job.reused:
+            PAGES_REUSED.inc(len(job.reused))
+            logger.info(
+                f"Reusing {len(job.reused)} of {len(mpv_info.images)} pages "
+                f"from {gallery_info.parent_gid}: {gallery_info.gid}"
+            )
+        return True
+
+    async def _reusable_pages(
+        self, parent_gid: int, mpv_info: MpvInfo
+    ) -> Dict[int, str]:
+        """Pages whose file was already uploaded for the parent version.
+
+        Pages are matched by imgkey, which is derived from the file's hash,
+        so a page is reused only if its file is unchanged; a corrected scan
+        under the same filename is uploaded again. Parents published before
+        imgkeys were recorded cost one MPV request to learn them.
+        """
+        pages = await get_version_pages(parent_gid)
+        if pages is None:
+            parent = await get_gallery(parent_gid)
+            urls = await get_gallery_images(parent_gid)
+            if parent is None or urls is None:
+                return {}
+            parent_mpv = await self.client.fetch_mpv_info(parent.url)
+            imgkeys = [e.imgkey for e in parent_mpv.images[:MAX_IMAGES]]
+            if len(imgkeys) != len(urls):
+                return {}
+            await set_gallery_version(parent_gid, None, imgkeys)
+            pages = dict(zip(imgkeys, urls))
+        reused = {}
+        for i, entry in enumerate(mpv_info.images):
+            url = pages.get(entry.imgkey)
+            ## Pages whose upload failed link an image server that has expired
+            if url and self.uploader.backend_of(url) != "other":
+                reused[i] = url
+        return reused
+
+    async def _dispatch_one(self, job: GalleryJob, i: int) -> None:
+        entry = job.mpv_info.images[i]
+        for _ in range(MAX_ATTEMPTS):
+            try:
+                with span("imagedispatch", gid=job.mpv_info.gid, page=entry.index):
+                    dispatch = await self.client.imagedispatch(
+                        job.mpv_info.gid,
+                        entry.index,
+                        entry.imgkey,
+                        job.mpv_info.mpvkey,
+                        job.dispatch_s[i],
+                    )
+                job.dispatch_urls[i] = dispatch.i
+                job.dispatch_s[i] = dispatch.s
+                return
+            except Exception as e:
+                logger.warning(f"Image dispatch failed, retrying: {e}")
+
+    async def _dispatch(self, job: GalleryJob) -> bool:
+        if job.reset_gp:
+            await self.client.reset_gp(job.mpv_info.gid)
+        count = len(job.mpv_info.images)
+        job.dispatch_urls = [None] * count
+        job.dispatch_s = [None] * count
+        await asyncio.gather(
+            *(self._dispatch_one(job, i) for i in range(count) if i not in job.reused)
+        )
+        return True
+
+    async def _upload_one(self, job: GalleryJob, i: int) -> Optional[str]:
+        for attempt in range(MAX_ATTEMPTS):
+            if attempt > 0 or job.dispatch_urls[i] is None:
+                ## Ask for another image server before retrying
+                await self._dispatch_one(job, i)
+            if job.dispatch_urls[i] is None:
+                continue
+            try:
+                page = job.mpv_info.images[i].index
+                with span("upload_url", gid=job.mpv_info.gid, page=page):
+                    return await self.uploader.upload_url(job.dispatch_urls[i])
+            except Exception as e:
+                logger.warning(f"Image upload failed, retrying: {e}")
+        return job.dispatch_urls[i]
+
+    async def _upload(self, job: GalleryJob) -> bool:
+        count = len(job.dispatch_urls)
+        pending = [i for i in range(count) if i not in job.reused]
+        urls = await asyncio.gather(*(self._upload_one(job, i) for i in pending))
+        job.image_urls = [job.reused.get(i) for i in range(count)]
+        for i, url in zip(pending, urls):
+            job.image_urls[i] = url
+        return True
+
+    async def _publish(self, job: GalleryJob) -> bool:
+        gallery_info = job.gallery_info
+        logger.info(f"Translating tags: {gallery_info.gid} {gallery_info.title}")
+        await self.ehtag.load_database()
+        tags_dict = self.ehtag.batch_translate_tags(gallery_info.tags)
+        for namespace, tags in tags_dict.items():
+            logger.info(f"{namespace}: {tags}")
+        if job.telegraph_url:
+            logger.info(
+                f"Editing telegraph page: {gallery_info.gid} {gallery_info.title}"
+            )
+            telegraph_url = await self.telegraph.edit_telegraph_page(
+                telegraph_url=job.telegraph_url,
+                title=gallery_info.title,
+                image_urls=job.image_urls,
+                author_name=job.author_name,
+                author_url=job.author_url,
+            )
+        else:
+            logger.info(
+                f"Creating telegraph page: {gallery_info.gid} {gallery_info.title}"
+            )
+            telegraph_url = await self.telegraph.create_telegraph_page(
+                title=gallery_info.title,
+                image_urls=job.image_urls,
+                author_name=job.author_name,
+                author_url=job.author_url,
+            )
+        logger.info(f"Upserting gallery: {gallery_info.gid} {gallery_info.title}")
+        gallery = await upsert_gallery(
+            gid=gallery_info.gid,
+            url=gallery_info.url,
+            tags=tags_dict,
+            title=gallery_info.title,
+            telegraph_url=telegraph_url,
+        )
+        await set_gallery_images(gallery_info.gid, job.image_urls)
+        await set_gallery_version(
+            gallery_info.gid,
+            gallery_info.parent_gid,
+            [e.imgkey for e in job.mpv_info.images],
+        )
+        job.tags = tags_dict
+        job.telegraph_url = telegraph_url
+        if self.verifier is not None:
+            self.verifier.submit(job)
+        return self._finish(job, gallery)
+
+    async def _republish(self, job: GalleryJob) -> None:
+        """Edit the page of a published gallery after images were replaced."""
+        gallery_info = job.gallery_info
+        logger.info(f"Editing telegraph page: {gallery_info.gid} {gallery_info.title}")
+        telegraph_url = await self.telegraph.edit_telegraph_page(
+            telegraph_url=job.telegraph_url,
+            title=gallery_info.title,
+            image_urls=job.image_urls,
+            author_name=job.author_name,
+            author_url=job.author_url,
+        )
+        await set_gallery_images(gallery_info.gid, job.image_urls)
+        if telegraph_url != job.telegraph_url:
+            job.telegraph_url = telegraph_url
+            await upsert_gallery(
+                gid=gallery_info.gid,
+                url=gallery_info.url,
+                tags=job.tags,
+                title=gallery_info.title,
+                telegraph_url=telegraph_url,
+            )
+
+    async def rehost(self, job: GalleryJob, indexes: List[int]) -> List[int]:
+        """Upload the images at `indexes` again and fix the published page.
+
+        `job` describes an already published gallery. Returns the indexes
+        whose URL changed; the page is edited only if there are any.
+        """
+        with use_route(parse_gid(job.url)):
+            urls = await asyncio.gather(*(self._upload_one(job, i) for i in indexes))
+        replaced = []
+        for i, url in zip(indexes, urls):
+            ## `_upload_one` falls back to the image server URL when every
+            ## upload failed, which would expire like the URL it replaces
+            if url is None or url == job.dispatch_urls[i]:
+                continue
+            if url != job.image_urls[i]:
+                job.image_urls[i] = url
+                replaced.append(i)
+        if replaced:
+            await self._republish(job)
+        return replaced
@@ -0,0 +1,117 @@
+import asyncio
+import collections
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional
+
+from .metrics import LIMITER_WAIT_SECONDS
+
+INTERACTIVE = 0
+BACKGROUND = 1
+LANES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+DEFAULT_RESERVED_SHARE = 0.25
+
+## Lane of the work running in the current task; work not started by a user
+## (scheduled searches, sweeps) is background
+lane: ContextVar[int] = ContextVar("lane", default=BACKGROUND)
+reserved_share = DEFAULT_RESERVED_SHARE
+
+
+def configure(share: float) -> None:
+    global reserved_share
+    if not 0 <= share <= 1 / len(LANES):
+        raise ValueError(f"Reserved share must be between 0 and {1 / len(LANES)}")
+    reserved_share = share
+
+
+def current_lane() -> int:
+    return lane.get()
+
+
+@contextmanager
+def use_lane(value: int):
+    token = lane.set(value)
+    try:
+        yield
+    finally:
+        lane.reset(token)
+
+
+class PriorityLimiter:
+    """Semaphore with one waiting line per lane.
+
+    Freed slots go to the most urgent lane with waiters, so interactive work
+    jumps ahead of queued background work. Every lane is also guaranteed
+    `floor(size * reserved_share)` slots: while it has waiters below that
+    share, other lanes may not take free slots, so a stream of user requests
+    cannot starve background work. Idle lanes lend their share out.
+    """
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+        self.lanes = LANES
+        self.reserved = {lane: int(size * reserved_share) for lane in LANES}
+        self.in_use = {lane: 0 for lane in LANES}
+        self.waiters: Dict[int, Deque[asyncio.Future]] = {
+            lane: collections.deque() for lane in LANES
+        }
+
+    def _can_take(self, value: int) -> bool:
+        free = self.size - sum(self.in_use.values())
+        held_back = sum(
+            max(0, self.reserved[lane] - self.in_use[lane])
+            for lane in LANES
+            if lane != value and self.waiters[lane]
+        )
+        return free > held_back
+
+    def _wake(self) -> None:
+        for value in sorted(LANES):
+            waiters = self.waiters[value]
+            while waiters and self._can_take(value):
+                future = waiters.popleft()
+                if not future.done():
+                    self.in_use[value] += 1
+                    future.set_result(None)
+
+    async def acquire(self, value: Optional[int] = None) -> None:
+        """Take a slot for lane `value`, by default the current task's lane."""
+        if value is None:
+            value = lane.get()
+        if not self.waiters[value] and self._can_take(value):
+            self.in_use[value] += 1
+            return
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[value].append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                ## Granted right before the cancellation
+                self._release(value)
+            else:
+                try:
+                    self.waiters[value].remove(future)
+                except ValueError:
+                    pass
+            raise
+        finally:
+            LIMITER_WAIT_SECONDS.observe(
+                time.perf_counter() - start, name=self.name, lane=LANES[value]
+            )
+
+    def _release(self, value: int) -> None:
+        self.in_use[value] -= 1
+        self._wake()
+
+    def release(self, value: Optional[int] = None) -> None:
+        self._release(lane.get() if value is None else value)
+
+    async def __aenter__(self) -> None:
+        await self.acquire()
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
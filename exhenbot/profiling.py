@@ -0,0 +1,193 @@
+import asyncio
+import cProfile
+import logging
+import os
+import statistics
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from loguru import logger
+
+from .metrics import EVENT_LOOP_LAG
+
+
+class LoopLagMonitor:
+    """Measure how late the event loop wakes up a sleeping task."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.samples: Optional[List[float]] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            EVENT_LOOP_LAG.observe(lag)
+            if self.samples is not None:
+                self.samples.append(lag)
+
+
+class SlowCallbackHandler(logging.Handler):
+    """Collect asyncio debug warnings about callbacks blocking the loop."""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages: List[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.getMessage()
+        if message.startswith("Executing"):
+            self.messages.append(message)
+
+
+@dataclass
+class ProfileReport:
+    label: str
+    path: str
+    seconds: float
+    lag: List[float] = field(default_factory=list)
+    slow_callbacks: List[str] = field(default_factory=list)
+
+    def summary(self) -> str:
+        lines = [f"Profile {self.label} ({self.seconds:.1f}s): {self.path}"]
+        if self.lag:
+            p95 = (
+                statistics.quantiles(self.lag, n=20, method="inclusive")[-1]
+                if len(self.lag) > 1
+                else self.lag[0]
+            )
+            lines.append(
+                f"Event loop lag: max {max(self.lag) * 1000:.0f}ms, "
+                f"p95 {p95 * 1000:.0f}ms over {len(self.lag)} samples"
+            )
+        lines.append(f"Slow callbacks: {len(self.slow_callbacks)}")
+        lines.extend(self.slow_callbacks[:5])
+        return "\n".join(lines)
+
+
+class Profiler:
+    """On-demand profiling of the running bot.
+
+    Uses pyinstrument's sampling profiler when it is installed and writes a
+    speedscope profile, otherwise cProfile stats (`.prof`) that flamegraph
+    tools such as flameprof or snakeviz read. While a session is active the
+    loop runs in asyncio debug mode so callbacks slower than
+    `slow_callback_duration` are reported.
+    """
+
+    def __init__(
+        self,
+        local_dir: str,
+        lag_monitor: LoopLagMonitor,
+        slow_callback_duration: float = 0.1,
+    ):
+        self.directory = os.path.join(local_dir, "profiles")
+        self.lag_monitor = lag_monitor
+        self.slow_callback_duration = slow_callback_duration
+        self.active = False
+        self.next_job: Optional[asyncio.Future] = None
+
+    async def profile_for(self, seconds: float) -> ProfileReport:
+        async with self.session(f"{seconds:g}s") as reports:
+            await asyncio.sleep(seconds)
+        return reports[0]
+
+    def arm_next_job(self) -> asyncio.Future:
+        """Profile the next `job_process` run; the future gets its report."""
+        if self.next_job is None or self.next_job.done():
+            self.next_job = asyncio.get_running_loop().create_future()
+        return self.next_job
+
+    @asynccontextmanager
+    async def job_tick(self):
+        future = self.next_job
+        if future is None or future.done() or self.active:
+            yield
+            return
+        self.next_job = None
+        try:
+            async with self.session("job") as reports:
+                yield
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+            raise
+        ## The caller may have stopped waiting
+        if not future.done():
+            future.set_result(reports[0])
+
+    @asynccontextmanager
+    async def session(self, label: str):
+        """Profile the enclosed block; the yielded list receives the report."""
+        if self.active:
+            raise RuntimeError("A profiling session is already running")
+        self.active = True
+        loop = asyncio.get_running_loop()
+        debug, slow_duration = loop.get_debug(), loop.slow_callback_duration
+        asyncio_logger = logging.getLogger("asyncio")
+        handler = SlowCallbackHandler()
+        asyncio_logger.addHandler(handler)
+        loop.slow_callback_duration = self.slow_callback_duration
+        loop.set_debug(True)
+        self.lag_monitor.samples = []
+        os.makedirs(self.directory, exist_ok=True)
+        name = os.path.join(
+            self.directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{label}"
+        )
+        reports: List[ProfileReport] = []
+        start = time.perf_counter()
+        try:
+            from pyinstrument import Profiler as SamplingProfiler
+            from pyinstrument.renderers import SpeedscopeRenderer
+        except ImportError:
+            SamplingProfiler = None
+        try:
+            if SamplingProfiler is not None:
+                profiler = SamplingProfiler(interval=0.001, async_mode="disabled")
+                profiler.start()
+                try:
+                    yield reports
+                finally:
+                    profiler.stop()
+                    path = f"{name}.speedscope.json"
+                    with open(path, "w", encoding="utf-8") as f:
+                        f.write(profiler.output(SpeedscopeRenderer()))
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    yield reports
+                finally:
+                    profiler.disable()
+                    path = f"{name}.prof"
+                    profiler.dump_stats(path)
+        finally:
+            loop.set_debug(debug)
+            loop.slow_callback_duration = slow_duration
+            asyncio_logger.removeHandler(handler)
+            lag, self.lag_monitor.samples = self.lag_monitor.samples, None
+            self.active = False
+        report = ProfileReport(
+            label=label,
+            path=path,
+            seconds=time.perf_counter() - start,
+            lag=lag,
+            slow_callbacks=handler.messages,
+        )
+        reports.append(report)
+        logger.info(report.summary())
@@ -0,0 +1,241 @@
+import asyncio
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import httpx
+from loguru import logger
+
+from .http_client import build_client
+from .metrics import PROXY_HEALTHY, PROXY_REQUEST_SECONDS
+from .utils import TTLCache
+
+## Pool entry sending requests without a proxy
+DIRECT = "direct"
+## Failed requests or checks in a row that take a proxy out of rotation
+MAX_FAILURES = 3
+
+## Requests made under the same key leave through the same proxy
+route: ContextVar[Optional[int]] = ContextVar("proxy_route", default=None)
+
+
+@contextmanager
+def use_route(key: Optional[int]):
+    token = route.set(key)
+    try:
+        yield
+    finally:
+        route.reset(token)
+
+
+class Proxy:
+    def __init__(self, url: Optional[str], bench_time: float):
+        self.url = url
+        self.bench_time = bench_time
+        if url is None:
+            self.label = DIRECT
+        else:
+            ## Credentials stay out of logs and metric labels
+            parsed = urlparse(url)
+            port = f":{parsed.port}" if parsed.port else ""
+            self.label = f"{parsed.scheme}://{parsed.hostname}{port}"
+        self.healthy = True
+        self.failures = 0
+        self.benched_until = 0.0
+        self.in_flight = 0
+        self.picks = 0
+        self.requests = 0
+        ## Moving average of successful request latency in seconds
+        self.latency: Optional[float] = None
+        PROXY_HEALTHY.set_function(lambda: float(self.healthy), proxy=self.label)
+
+    def observe(self, seconds: float, ok: bool) -> None:
+        PROXY_REQUEST_SECONDS.observe(
+            seconds, proxy=self.label, result="ok" if ok else "error"
+        )
+        self.requests += 1
+        if ok:
+            self.failures = 0
+            if self.latency is None:
+                self.latency = seconds
+            else:
+                self.latency += 0.2 * (seconds - self.latency)
+            return
+        self.failures += 1
+        if self.healthy and self.failures >= MAX_FAILURES:
+            self.healthy = False
+            self.benched_until = time.monotonic() + self.bench_time
+            logger.warning(f"Proxy {self.label} failed {self.failures} times, benched")
+
+    def reinstate(self) -> None:
+        """Put a benched proxy back on trial; its next failure benches it again."""
+        self.healthy = True
+        self.failures = MAX_FAILURES - 1
+        logger.info(f"Proxy {self.label} back on trial after its bench time")
+
+
+class ProxyPool:
+    """Outbound proxies shared by the HTTP clients.
+
+    Requests made under `use_route(key)` stick to the proxy first picked for
+    that key, so every request about one gallery leaves from the same IP.
+    Other requests, and keys seen for the first time, go to the healthy proxy
+    with the fewest requests in flight. A proxy failing `MAX_FAILURES` times
+    in a row is skipped until a health check, run every `check_interval`
+    seconds against `check_url`, succeeds again, or until it has been benched
+    for `bench_time` seconds; it then gets one request to prove itself. The
+    latter also covers a pool whose health checks are turned off.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        check_url: str,
+        check_interval: float = 60,
+        bench_time: float = 300,
+        timeout: float = 10,
+    ):
+        self.proxies = [
+            Proxy(None if url == DIRECT else url, bench_time) for url in urls
+        ]
+        self.check_url = check_url
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.assigned = TTLCache(ttl=3600, maxsize=4096)
+        self.sequence = itertools.count(1)
+        self.checkers: Dict[str, httpx.AsyncClient] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.task is None and self.check_interval > 0:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        for client in self.checkers.values():
+            await client.aclose()
+        self.checkers.clear()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await asyncio.gather(*(self.check(p) for p in self.proxies))
+            logger.debug(f"Proxy stats: {self.stats()}")
+
+    async def check(self, proxy: Proxy) -> bool:
+        client = self.checkers.get(proxy.label)
+        if client is None:
+            client = self.checkers[proxy.label] = build_client(
+                "proxy_check",
+                timeout=self.timeout,
+                max_connections=1,
+                proxy=proxy.url,
+            )
+        start = time.perf_counter()
+        try:
+            resp = await client.head(self.check_url)
+            ok = resp.status_code < 500
+        except httpx.HTTPError:
+            ok = False
+        proxy.observe(time.perf_counter() - start, ok)
+        if ok and not proxy.healthy:
+            proxy.healthy = True
+            logger.info(f"Proxy {proxy.label} passed its health check")
+        return ok
+
+    def pick(self) -> Proxy:
+        key = route.get()
+        if key is not None:
+            proxy = self.assigned.get(key)
+            if proxy is not None and proxy.healthy:
+                return proxy
+        now = time.monotonic()
+        for p in self.proxies:
+            if not p.healthy and p.benched_until <= now:
+                p.reinstate()
+        ## With every proxy down, keep trying rather than fail all requests
+        candidates = [p for p in self.proxies if p.healthy] or self.proxies
+        proxy = min(candidates, key=lambda p: (p.in_flight, p.picks))
+        proxy.picks = next(self.sequence)
+        if key is not None:
+            self.assigned.set(key, proxy)
+        return proxy
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        return {
+            p.label: {
+                "healthy": p.healthy,
+                "in_flight": p.in_flight,
+                "requests": p.requests,
+                "latency_ms": None if p.latency is None else round(p.latency * 1000),
+            }
+            for p in self.proxies
+        }
+
+
+class ProxiedClient:
+    """Stand-in for an AsyncClient that sends each request through `pool`.
+
+    Every proxy gets its own AsyncClient built by `build_client`, and with it
+    its own connection pool. Only the parts of the AsyncClient interface the
+    bot's clients use are provided.
+    """
+
+    def __init__(self, pool: ProxyPool, name: str, **kwargs):
+        self.pool = pool
+        self.name = name
+        self.kwargs = kwargs
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+        self.default = self._client(pool.proxies[0])
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        return self.default.timeout
+
+    @property
+    def headers(self) -> httpx.Headers:
+        return self.default.headers
+
+    def _client(self, proxy: Proxy) -> httpx.AsyncClient:
+        client = self.clients.get(proxy.label)
+        if client is None:
+            client = self.clients[proxy.label] = build_client(
+                self.name, proxy=proxy.url, **self.kwargs
+            )
+        return client
+
+    async def request(self, method: str, url, **kwargs) -> httpx.Response:
+        proxy = self.pool.pick()
+        proxy.in_flight += 1
+        start = time.perf_counter()
+        try:
+            response = await self._client(proxy).request(method, url, **kwargs)
+        except httpx.TransportError:
+            proxy.observe(time.perf_counter() - start, ok=False)
+            raise
+        finally:
+            proxy.in_flight -= 1
+        proxy.observe(time.perf_counter() - start, ok=True)
+        return response
+
+    async def head(self, url, **kwargs) -> httpx.Response:
+        return await self.request("HEAD", url, **kwargs)
+
+    async def aclose(self) -> None:
+        for client in self.clients.values():
+            await client.aclose()
+
+
+def build_proxied_client(pool: Optional[ProxyPool], name: str, **kwargs):
+    """`build_client`, through `pool` when there is one."""
+    if pool is None:
+        return build_client(name, **kwargs)
+    ## The pool decides the proxy of every request
+    kwargs.pop("proxy", None)
+    return ProxiedClient(pool, name, **kwargs)
@@ -0,0 +1,125 @@
+import functools
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from .exhentai_client import ALL_CATEGORIES, GalleryEntry
+
+## Short namespaces accepted by the ExHentai search box
+NAMESPACE_ALIASES = {
+    "l": "language",
+    "lang": "language",
+    "p": "parody",
+    "series": "parody",
+    "c": "character",
+    "char": "character",
+    "a": "artist",
+    "g": "group",
+    "creator": "group",
+    "circle": "group",
+    "f": "female",
+    "m": "male",
+    "x": "mixed",
+    "o": "other",
+    "cos": "cosplayer",
+    "r": "reclass",
+}
+TERM_PATTERN = re.compile(
+    r'(?P<op>[-~]?)(?:(?P<namespace>[a-z]+):)?(?:"(?P<quoted>[^"]*)"|(?P<word>[^\s"]+))(?P<exact>\$?)',
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class Term:
+    namespace: Optional[str]
+    value: str
+    exact: bool
+
+    def _match_tag(self, tag: str) -> bool:
+        if self.exact:
+            return tag == self.value
+        return tag.startswith(self.value)
+
+    def match(self, title: str, tags: List[Tuple[str, str]]) -> bool:
+        if self.namespace is not None:
+            return any(ns == self.namespace and self._match_tag(t) for ns, t in tags)
+        if any(self._match_tag(t) for _, t in tags):
+            return True
+        return not self.exact and self.value in title
+
+
+@dataclass
+class Query:
+    """A compiled ExHentai search string.
+
+    Plain terms must all match, `-term` must not match and, if any `~term`
+    is given, at least one of them must match. A namespaced term such as
+    `parody:"blue archive$"` matches tags of that namespace; without a
+    namespace it matches any tag or the title. A trailing `$` asks for the
+    whole tag, otherwise the tag only has to start with the term.
+    """
+
+    required: List[Term] = field(default_factory=list)
+    excluded: List[Term] = field(default_factory=list)
+    any_of: List[Term] = field(default_factory=list)
+
+    def match(self, title: str, tags: List[str]) -> bool:
+        title = title.lower()
+        pairs = [split_tag(t) for t in tags]
+        return (
+            all(t.match(title, pairs) for t in self.required)
+            and not any(t.match(title, pairs) for t in self.excluded)
+            and (not self.any_of or any(t.match(title, pairs) for t in self.any_of))
+        )
+
+
+def split_tag(tag: str) -> Tuple[str, str]:
+    namespace, _, value = tag.lower().partition(":")
+    return (namespace, value) if value else ("", namespace)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_query(search: Optional[str]) -> Query:
+    query = Query()
+    for match in TERM_PATTERN.finditer(search or ""):
+        value = match.group("quoted")
+        if value is None:
+            value = match.group("word")
+        value = value.strip().lower()
+        exact = bool(match.group("exact")) or value.endswith("$")
+        value = value.rstrip("$").rstrip("*").strip()
+        if not value:
+            continue
+        namespace = match.group("namespace")
+        if namespace is not None:
+            namespace = namespace.lower()
+            namespace = NAMESPACE_ALIASES.get(namespace, namespace)
+        term = Term(namespace=namespace, value=value, exact=exact)
+        {"": query.required, "-": query.excluded, "~": query.any_of}[
+            match.group("op")
+        ].append(term)
+    return query
+
+
+def allowed_categories(catogories: Optional[int]) -> int:
+    """Categories shown by an `f_cats` mask, as a mask of set bits."""
+    return ALL_CATEGORIES & ~(catogories or 0)
+
+
+def matches(
+    entry: GalleryEntry,
+    search: Optional[str],
+    catogories: Optional[int],
+    star: Optional[int],
+) -> bool:
+    """Whether a search with these parameters would list `entry`.
+
+    Categories and ratings missing from the result page are let through.
+    """
+    allowed = allowed_categories(catogories)
+    if entry.category is not None and not entry.category & allowed:
+        return False
+    if star and entry.rating is not None and entry.rating < star:
+        return False
+    return compile_query(search).match(entry.title, entry.tags)
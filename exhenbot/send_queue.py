@@ -0,0 +1,247 @@
+import asyncio
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from loguru import logger
+from telegram import Bot
+from telegram.error import (
+    BadRequest,
+    ChatMigrated,
+    Forbidden,
+    NetworkError,
+    RetryAfter,
+    TelegramError,
+    TimedOut,
+)
+
+from .metrics import STAGE_SECONDS
+from .storage import (
+    PendingMessage,
+    add_pending_message,
+    claim_pending_messages,
+    delete_pending_message,
+    delete_pending_messages,
+    renew_pending_message,
+)
+from .utils import TokenBucket
+
+NO_RIGHTS_ERRORS = (
+    "Not enough rights to send",
+    "Need administrator rights in the channel chat",
+)
+
+
+class SendQueue:
+    """Outbound Telegram delivery queue.
+
+    Messages are persisted before they are queued and removed once delivered.
+    Every chat has its own worker and token bucket, all workers share a global
+    bucket, and `RetryAfter` flood waits are honored per chat. With a poll
+    interval, messages persisted by other processes (job workers) and claims
+    abandoned by dead replicas are picked up as well.
+
+    A message is claimed by one replica before it is queued and the claim is
+    refreshed right before sending, so replicas sharing the database do not
+    deliver it twice. Claims older than `lease` seconds belong to a replica
+    that died and are taken over. On start, claims still held under this
+    replica's `holder` are left from its previous run and are resumed at once.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30,
+        chat_rate: float = 20,
+        max_retries: int = 5,
+        holder: str = "",
+        lease: float = 600,
+    ):
+        # Telegram allows ~30 msg/s overall, ~20 msg/min per group and ~1 msg/s
+        # per private chat.
+        self.global_bucket = TokenBucket(rate=global_rate, burst=global_rate)
+        self.chat_rate = chat_rate / 60
+        self.max_retries = max_retries
+        self.holder = holder
+        self.lease = lease
+        self.bot: Optional[Bot] = None
+        self.on_forbidden: Optional[Callable[[int], Awaitable[None]]] = None
+        self.buckets: Dict[int, TokenBucket] = {}
+        self.queues: Dict[int, asyncio.Queue] = {}
+        self.workers: Dict[int, asyncio.Task] = {}
+        self.blocked: Set[int] = set()
+        ## Ids of persisted messages currently held by a chat queue
+        self.queued: Set[int] = set()
+        self.poller: Optional[asyncio.Task] = None
+
+    async def start(
+        self,
+        bot: Bot,
+        on_forbidden: Optional[Callable[[int], Awaitable[None]]] = None,
+        poll_interval: Optional[float] = None,
+    ) -> None:
+        """Attach the bot and resume deliveries left over from the last run."""
+        self.bot = bot
+        self.on_forbidden = on_forbidden
+        pending = await self._load(resume=True)
+        if pending:
+            logger.info(f"Resuming {pending} pending messages")
+        if poll_interval:
+            self.poller = asyncio.create_task(self._poll(poll_interval))
+
+    async def _load(self, resume: bool = False) -> int:
+        count = 0
+        for p in await claim_pending_messages(
+            self.holder, self.lease, exclude=self.queued, resume=resume
+        ):
+            if p.id not in self.queued and p.chat_id not in self.blocked:
+                self._put(p)
+                count += 1
+        return count
+
+    async def _poll(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._load()
+            except Exception as e:
+                logger.warning(f"Failed to load pending messages: {e}")
+
+    async def stop(self) -> None:
+        """Cancel workers; undelivered messages stay persisted."""
+        if self.poller is not None:
+            self.poller.cancel()
+            await asyncio.gather(self.poller, return_exceptions=True)
+            self.poller = None
+        workers = list(self.workers.values())
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self.workers.clear()
+        self.queues.clear()
+        self.queued.clear()
+
+    async def enqueue(
+        self,
+        chat_id: int,
+        text: str,
+        gid: int | None = None,
+        reply_to_message_id: int | None = None,
+    ) -> None:
+        if chat_id in self.blocked:
+            return
+        pending = await add_pending_message(
+            chat_id=chat_id,
+            text=text,
+            gid=gid,
+            reply_to_message_id=reply_to_message_id,
+            claimed_by=self.holder,
+        )
+        if pending is None:
+            logger.info(f"Message for {gid} to {chat_id} is already pending")
+            return
+        self._put(pending)
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.buckets.get(chat_id)
+        if bucket is None:
+            # Negative ids are groups and channels
+            rate = self.chat_rate if chat_id < 0 else 1.0
+            bucket = self.buckets[chat_id] = TokenBucket(rate=rate)
+        return bucket
+
+    def _put(self, pending: PendingMessage) -> None:
+        self.queued.add(pending.id)
+        queue = self.queues.setdefault(pending.chat_id, asyncio.Queue())
+        queue.put_nowait(pending)
+        if pending.chat_id not in self.workers:
+            self.workers[pending.chat_id] = asyncio.create_task(
+                self._worker(pending.chat_id)
+            )
+
+    async def _worker(self, chat_id: int) -> None:
+        queue = self.queues[chat_id]
+        try:
+            while not queue.empty():
+                pending = queue.get_nowait()
+                try:
+                    await self._deliver(pending)
+                except Exception as e:
+                    ## The row stays claimed, another load retries it once the
+                    ## claim expires
+                    self.queued.discard(pending.id)
+                    logger.error(f"Failed to deliver message to {chat_id}: {e}")
+        finally:
+            self.workers.pop(chat_id, None)
+            self.queues.pop(chat_id, None)
+
+    async def _deliver(self, pending: PendingMessage) -> None:
+        chat_id = pending.chat_id
+        if not await renew_pending_message(pending.id, self.holder):
+            ## Waited in the queue past the lease and another replica took it
+            logger.info(f"Message {pending.id} to {chat_id} was taken over, skipping")
+            self.queued.discard(pending.id)
+            return
+        migrated = False
+        for attempt in range(self.max_retries + 1):
+            if chat_id in self.blocked:
+                break
+            await self._bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                with STAGE_SECONDS.time(stage="send"):
+                    await self.bot.send_message(
+                        chat_id=chat_id,
+                        text=pending.text,
+                        reply_to_message_id=pending.reply_to_message_id,
+                    )
+                break
+            except RetryAfter as err:
+                wait = err.retry_after
+                if isinstance(wait, timedelta):
+                    wait = wait.total_seconds()
+                logger.warning(f"Flood control for {chat_id}, retrying in {wait}s")
+                await asyncio.sleep(wait)
+            except BadRequest as err:
+                if any(e in err.message for e in NO_RIGHTS_ERRORS):
+                    logger.warning(f"{err} not enough rights to send to {chat_id}")
+                    self.queued.discard(pending.id)
+                    await self._block(pending.chat_id)
+                    return
+                logger.error(f"Dropping message to {chat_id}: {err}")
+                break
+            except Forbidden as err:
+                ## Kicked from the group or blocked by the user
+                logger.warning(f"{err} forbidden to send to {chat_id}")
+                self.queued.discard(pending.id)
+                await self._block(pending.chat_id)
+                return
+            except ChatMigrated as err:
+                if migrated:
+                    logger.error(f"Dropping message to {chat_id}: {err}")
+                    break
+                ## The group became a supergroup, send once more to its new id
+                logger.warning(f"{chat_id} migrated to {err.new_chat_id}, resending")
+                migrated = True
+                chat_id = err.new_chat_id
+            except (TimedOut, NetworkError) as err:
+                if attempt == self.max_retries:
+                    logger.error(f"Dropping message to {chat_id}: {err}")
+                    break
+                wait = 2**attempt
+                logger.warning(f"Send to {chat_id} failed, retrying in {wait}s: {err}")
+                await asyncio.sleep(wait)
+            except TelegramError as err:
+                logger.error(f"Dropping message to {chat_id}: {err}")
+                break
+        else:
+            logger.error(f"Dropping message to {chat_id} after {attempt + 1} attempts")
+        await delete_pending_message(pending.id)
+        self.queued.discard(pending.id)
+
+    async def _block(self, chat_id: int) -> None:
+        self.blocked.add(chat_id)
+        await delete_pending_messages(chat_id)
+        queue = self.queues.get(chat_id)
+        while queue is not None and not queue.empty():
+            self.queued.discard(queue.get_nowait().id)
+        if self.on_forbidden is not None:
+            await self.on_forbidden(chat_id)
@@ -1,13 +1,21 @@
 import base64
 import json
 from dataclasses import dataclass
-from typing import List, Optional
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
 
-from tortoise import Tortoise, fields, models
+from loguru import logger
+from tortoise import Tortoise, fields, models, timezone
+from tortoise.backends.base.config_generator import generate_config
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import F, Q
+from tortoise.transactions import in_transaction
 
 from .config import load_settings
+from .metrics import timed
 
 settings = load_settings()
+SCHEMA_STATE_KEY = "schema_version"
 
 
 class Gallery(models.Model):
@@ -32,6 +40,8 @@ class Task(models.Model):
     author_name = fields.TextField(default=settings.telegraph_author_name)
     author_url = fields.TextField(default=settings.telegraph_author_url)
     query_depth = fields.IntField(default=settings.exh_query_depth)
+    ## Seconds between searches, TELEGRAM_JOB_INTERVAL when null
+    check_interval = fields.IntField(null=True)
     created_at = fields.DatetimeField(auto_now_add=True)
     updated_at = fields.DatetimeField(auto_now=True)
 
@@ -39,6 +49,96 @@ class Task(models.Model):
         table = f"{settings.table_prefix}task"
 
 
+class GalleryImages(models.Model):
+    """Image URLs of a gallery's Telegraph page, in page order."""
+
+    gid = fields.IntField(pk=True)
+    urls = fields.JSONField()
+    updated_at = fields.DatetimeField(auto_now=True)
+
+    class Meta:
+        table = f"{settings.table_prefix}gallery_images"
+
+
+class GalleryVersion(models.Model):
+    """Page imgkeys of a published gallery and its links to other versions."""
+
+    gid = fields.IntField(pk=True)
+    parent_gid = fields.IntField(null=True, index=True)
+    newer_gid = fields.IntField(null=True)
+    imgkeys = fields.JSONField()
+
+    class Meta:
+        table = f"{settings.table_prefix}gallery_version"
+
+
+class State(models.Model):
+    """Small JSON values that background jobs keep across restarts."""
+
+    key = fields.CharField(max_length=64, pk=True)
+    value = fields.JSONField()
+
+    class Meta:
+        table = f"{settings.table_prefix}state"
+
+
+class PendingMessage(models.Model):
+    id = fields.IntField(pk=True)
+    chat_id = fields.BigIntField()
+    gid = fields.IntField(null=True)
+    text = fields.TextField()
+    reply_to_message_id = fields.BigIntField(null=True)
+    ## Replica delivering the message; a claim older than the send lease is
+    ## taken over by another replica
+    claimed_by = fields.CharField(max_length=64, null=True)
+    claimed_at = fields.DatetimeField(null=True)
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = f"{settings.table_prefix}pending_message"
+        unique_together = (("chat_id", "gid"),)
+
+
+class Job(models.Model):
+    """Gallery job handed from the dispatcher to worker processes.
+
+    `available_at` is both the retry backoff and the lease: claiming a job
+    moves it into the future, so a job whose worker died becomes claimable
+    again once the lease runs out.
+    """
+
+    id = fields.IntField(pk=True)
+    url = fields.TextField()
+    gid = fields.IntField(null=True)
+    author_name = fields.TextField(null=True)
+    author_url = fields.TextField(null=True)
+    send_if_exists = fields.BooleanField(default=True)
+    force_update = fields.BooleanField(default=False)
+    reset_gp = fields.BooleanField(default=False)
+    ## Chat receiving the result; subscription jobs also mark the gallery sent
+    chat_id = fields.BigIntField(null=True)
+    subscription = fields.BooleanField(default=False)
+    reply_to_message_id = fields.BigIntField(null=True)
+    attempts = fields.IntField(default=0)
+    available_at = fields.DatetimeField()
+    claimed_by = fields.CharField(max_length=64, null=True)
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = f"{settings.table_prefix}job"
+
+
+class Lease(models.Model):
+    """Named lease held by one replica until `expires_at`."""
+
+    name = fields.CharField(max_length=128, pk=True)
+    holder = fields.CharField(max_length=64)
+    expires_at = fields.DatetimeField()
+
+    class Meta:
+        table = f"{settings.table_prefix}lease"
+
+
 @dataclass
 class TaskData:
     search: str
@@ -47,6 +147,7 @@ class TaskData:
     author_name: str
     author_url: str
     query_depth: int
+    interval: Optional[int] = None
 
     @staticmethod
     def from_text(text: str) -> "TaskData":
@@ -65,36 +166,313 @@ class TaskData:
                 author_name=data.get("author_name"),
                 author_url=data.get("author_url"),
                 query_depth=data.get("query_depth"),
+                interval=data.get("interval"),
             )
         except Exception:
             raise ValueError("Invalid task data")
 
 
-async def db_init(db_url: Optional[str]) -> None:
-    await Tortoise.init(
-        db_url=db_url or "sqlite://./cache.db",
-        modules={"models": [__name__]},
-        _enable_global_fallback=True,
-    )
+def sqlite_pragmas() -> dict:
+    """Pragmas of the tuned SQLite profile.
+
+    WAL lets readers run alongside the writer, and synchronous=NORMAL only
+    syncs at checkpoints: a power loss may drop the last commits but cannot
+    corrupt the file. Reads go through mmap and a larger page cache.
+    """
+    return {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "temp_store": "MEMORY",
+        "mmap_size": settings.sqlite_mmap_size,
+        "cache_size": settings.sqlite_cache_size,
+    }
+
+
+async def _add_column(conn, dialect: str, table: str, column: str, ddl: str) -> None:
+    if dialect == "postgres":
+        await conn.execute_script(
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {ddl}"
+        )
+        return
+    ## SQLite has no IF NOT EXISTS here; new tables already have the column
+    _, rows = await conn.execute_query(f"PRAGMA table_info({table})")
+    if all(row["name"] != column for row in rows):
+        await conn.execute_script(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+async def _add_indexes(conn, dialect: str) -> None:
+    gallery = Gallery._meta.db_table
+    task = Task._meta.db_table
+    statements = [
+        f"CREATE INDEX IF NOT EXISTS {gallery}_updated_at_idx ON {gallery} (updated_at)",
+        f"CREATE INDEX IF NOT EXISTS {gallery}_created_at_idx ON {gallery} (created_at)",
+        f"CREATE INDEX IF NOT EXISTS {task}_created_at_idx ON {task} (created_at)",
+    ]
+    if dialect == "postgres":
+        statements += [
+            f"CREATE INDEX IF NOT EXISTS {gallery}_tags_idx "
+            f"ON {gallery} USING GIN (tags jsonb_path_ops)",
+            f"CREATE INDEX IF NOT EXISTS {gallery}_chat_ids_idx "
+            f"ON {gallery} USING GIN (chat_ids jsonb_path_ops)",
+        ]
+    for statement in statements:
+        await conn.execute_script(statement)
+
+
+async def _add_task_interval(conn, dialect: str) -> None:
+    await _add_column(conn, dialect, Task._meta.db_table, "check_interval", "INT")
+
+
+async def _add_message_claims(conn, dialect: str) -> None:
+    table = PendingMessage._meta.db_table
+    timestamp = "TIMESTAMPTZ" if dialect == "postgres" else "TIMESTAMP"
+    await _add_column(conn, dialect, table, "claimed_by", "VARCHAR(64)")
+    await _add_column(conn, dialect, table, "claimed_at", timestamp)
+
+
+## Schema changes `generate_schemas` cannot make to existing tables. Each
+## step runs once, in order, and the number of applied steps is kept in the
+## state table. Steps are idempotent so replicas starting together may both
+## run one.
+MIGRATIONS = [_add_indexes, _add_task_interval, _add_message_claims]
+
+
+async def migrate() -> int:
+    """Apply pending migrations; returns the schema version."""
+    dialect = Tortoise.get_connection("default").capabilities.dialect
+    version = (await get_state(SCHEMA_STATE_KEY) or {}).get("version", 0)
+    for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        async with in_transaction() as conn:
+            await step(conn, dialect)
+            await set_state(SCHEMA_STATE_KEY, {"version": number})
+        logger.info(f"Applied database migration {number}")
+    return len(MIGRATIONS)
+
+
+async def db_init(db_url: Optional[str], tuned: Optional[bool] = None) -> None:
+    """Connect, create missing tables and apply migrations.
+
+    With `tuned` (DATABASE_TUNING by default) SQLite connections use the
+    pragmas of `sqlite_pragmas`; pragmas given in the URL take precedence.
+    """
+    config = generate_config(db_url or "sqlite://./cache.db", {"models": [__name__]})
+    connection = config["connections"]["default"]
+    if tuned is None:
+        tuned = settings.database_tuning
+    if tuned and connection["engine"] == "tortoise.backends.sqlite":
+        for pragma, value in sqlite_pragmas().items():
+            connection["credentials"].setdefault(pragma, value)
+    await Tortoise.init(config=config, _enable_global_fallback=True)
     await Tortoise.generate_schemas()
+    await migrate()
+    await init_search_index()
+
+
+def _search_table() -> str:
+    return f"{settings.table_prefix}gallery_fts"
+
+
+def _tag_text(row: str) -> str:
+    """SQL building `namespace:tag namespace:tag ...` from a gallery row."""
+    return (
+        "(SELECT group_concat(n.key || ':' || t.value, ' ') "
+        f"FROM json_each({row}.tags) AS n, json_each(n.value) AS t)"
+    )
+
+
+def _like_pattern(word: str) -> str:
+    for char in "\\%_":
+        word = word.replace(char, "\\" + char)
+    return f"%{word}%"
+
+
+async def init_search_index() -> None:
+    """Create the full-text index over gallery titles and tags.
+
+    SQLite keeps a trigram FTS5 table in sync through triggers, so any
+    substring of three or more characters (CJK included) hits the index.
+    Postgres keeps the same flattened `namespace:tag` text in a column filled
+    by a trigger, and `pg_trgm` GIN indexes on it and the title serve the
+    same substring matches. Both are created idempotently and existing
+    galleries are indexed on first run.
+    """
+    conn = Tortoise.get_connection("default")
+    gallery = Gallery._meta.db_table
+    if conn.capabilities.dialect == "postgres":
+        await conn.execute_script(f"""
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+            DROP INDEX IF EXISTS {gallery}_search_idx;
+            ALTER TABLE {gallery} DROP COLUMN IF EXISTS search_vector;
+            ALTER TABLE {gallery} ADD COLUMN IF NOT EXISTS search_tags TEXT;
+            CREATE OR REPLACE FUNCTION {gallery}_search_tags() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_tags := '';
+                IF jsonb_typeof(NEW.tags::jsonb) = 'object' THEN
+                    NEW.search_tags := coalesce((
+                        SELECT string_agg(n.key || ':' || t.value, ' ')
+                        FROM jsonb_each(NEW.tags::jsonb) AS n,
+                            jsonb_array_elements_text(
+                                CASE jsonb_typeof(n.value)
+                                    WHEN 'array' THEN n.value
+                                    ELSE jsonb_build_array(n.value)
+                                END
+                            ) AS t
+                    ), '');
+                END IF;
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql;
+            DROP TRIGGER IF EXISTS {gallery}_search_tags ON {gallery};
+            CREATE TRIGGER {gallery}_search_tags
+                BEFORE INSERT OR UPDATE OF tags ON {gallery}
+                FOR EACH ROW EXECUTE FUNCTION {gallery}_search_tags();
+            UPDATE {gallery} SET tags = tags WHERE search_tags IS NULL;
+            CREATE INDEX IF NOT EXISTS {gallery}_title_trgm_idx
+                ON {gallery} USING GIN (title gin_trgm_ops);
+            CREATE INDEX IF NOT EXISTS {gallery}_tags_trgm_idx
+                ON {gallery} USING GIN (search_tags gin_trgm_ops);
+            """)
+        return
+    if conn.capabilities.dialect != "sqlite":
+        return
+    fts = _search_table()
+    _, rows = await conn.execute_query(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", [fts]
+    )
+    insert = (
+        f"INSERT INTO {fts}(rowid, title, tags) "
+        f"VALUES (new.gid, new.title, {_tag_text('new')});"
+    )
+    await conn.execute_script(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts}
+            USING fts5(title, tags, tokenize='trigram');
+        CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {gallery} BEGIN
+            {insert}
+        END;
+        CREATE TRIGGER IF NOT EXISTS {fts}_update
+            AFTER UPDATE OF title, tags ON {gallery} BEGIN
+            DELETE FROM {fts} WHERE rowid = old.gid;
+            {insert}
+        END;
+        CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {gallery} BEGIN
+            DELETE FROM {fts} WHERE rowid = old.gid;
+        END;
+        """)
+    if not rows:
+        await conn.execute_script(
+            f"INSERT INTO {fts}(rowid, title, tags) "
+            f"SELECT g.gid, g.title, {_tag_text('g')} FROM {gallery} AS g;"
+        )
 
 
 async def db_close() -> None:
     await Tortoise.close_connections()
 
 
+@timed("db")
 async def get_gallery(gid: int) -> Optional[Gallery]:
     return await Gallery.filter(gid=gid).first()
 
 
+@timed("db")
+async def get_galleries(gids: List[int]) -> List[Gallery]:
+    return await Gallery.filter(gid__in=gids)
+
+
+@timed("db_search")
+async def find_galleries(query: str, limit: int, offset: int = 0) -> List[Gallery]:
+    """Galleries whose title or `namespace:tag` pairs contain every word.
+
+    Results are ranked by relevance (newest first for an empty query).
+    """
+    conn = Tortoise.get_connection("default")
+    gallery = Gallery._meta.db_table
+    words = query.split()
+    if not words:
+        sql, values = f"SELECT gid FROM {gallery} ORDER BY gid DESC", []
+    elif conn.capabilities.dialect == "postgres":
+        ## Case-insensitive substrings like the SQLite trigram index; patterns
+        ## of three or more characters use the pg_trgm indexes
+        where, values = [], []
+        for word in words:
+            n = len(values) + 1
+            where.append(f"(title ILIKE ${n} OR search_tags ILIKE ${n})")
+            values.append(_like_pattern(word))
+        values.append(" ".join(words))
+        rank = f"word_similarity(${len(values)}, title || ' ' || search_tags)"
+        sql = (
+            f"SELECT gid FROM {gallery} WHERE {' AND '.join(where)} "
+            f"ORDER BY {rank} DESC, gid DESC"
+        )
+    else:
+        fts = _search_table()
+        where, values = [], []
+        ## Trigrams need three characters, shorter words fall back to LIKE
+        phrases = ['"' + w.replace('"', '""') + '"' for w in words if len(w) >= 3]
+        if phrases:
+            where.append(f"{fts} MATCH ?")
+            values.append(" AND ".join(phrases))
+        for word in (w for w in words if len(w) < 3):
+            where.append("(title LIKE ? ESCAPE '\\' OR tags LIKE ? ESCAPE '\\')")
+            values += [_like_pattern(word)] * 2
+        order = "rank, rowid DESC" if phrases else "rowid DESC"
+        sql = f"SELECT rowid AS gid FROM {fts} WHERE {' AND '.join(where)} ORDER BY {order}"
+    if conn.capabilities.dialect == "postgres":
+        sql += f" LIMIT ${len(values) + 1} OFFSET ${len(values) + 2}"
+    else:
+        sql += " LIMIT ? OFFSET ?"
+    _, rows = await conn.execute_query(sql, values + [limit, offset])
+    gids = [row["gid"] for row in rows]
+    galleries = {g.gid: g for g in await Gallery.filter(gid__in=gids)}
+    return [galleries[gid] for gid in gids if gid in galleries]
+
+
+@timed("db")
 async def get_task(chat_id: int) -> Optional[Task]:
     return await Task.filter(chat_id=chat_id).first()
 
 
+@timed("db")
 async def get_all_tasks() -> List[Task]:
     return await Task.all().order_by("-created_at")
 
 
+@dataclass(frozen=True, slots=True)
+class TaskRecord:
+    """The fields of a task the scheduler needs, without the ORM object."""
+
+    chat_id: int
+    search: Optional[str]
+    catogories: int
+    star: int
+    author_name: str
+    author_url: Optional[str]
+    query_depth: int
+    interval: Optional[int]
+    created_at: datetime
+
+
+@timed("db")
+async def get_task_records() -> List[TaskRecord]:
+    rows = (
+        await Task.all()
+        .order_by("-created_at")
+        .values_list(
+            "chat_id",
+            "search",
+            "catogories",
+            "star",
+            "author_name",
+            "author_url",
+            "query_depth",
+            "check_interval",
+            "created_at",
+        )
+    )
+    return [TaskRecord(*row) for row in rows]
+
+
+@timed("db")
 async def upsert_gallery(
     gid: int,
     url: str,
@@ -124,6 +502,69 @@ async def upsert_gallery(
     )
 
 
+@timed("db")
+async def get_gallery_images(gid: int) -> Optional[List[Optional[str]]]:
+    row = await GalleryImages.filter(gid=gid).first()
+    return row.urls if row is not None else None
+
+
+@timed("db")
+async def set_gallery_images(gid: int, urls: List[Optional[str]]) -> None:
+    await GalleryImages.update_or_create(gid=gid, defaults={"urls": urls})
+
+
+@timed("db")
+async def get_version_pages(gid: int) -> Optional[Dict[str, Optional[str]]]:
+    """Uploaded URL of each page of a gallery, keyed by imgkey."""
+    version = await GalleryVersion.filter(gid=gid).first()
+    images = await GalleryImages.filter(gid=gid).first()
+    if version is None or images is None:
+        return None
+    if len(version.imgkeys) != len(images.urls):
+        return None
+    return dict(zip(version.imgkeys, images.urls))
+
+
+@timed("db")
+async def set_gallery_version(
+    gid: int, parent_gid: Optional[int], imgkeys: List[str]
+) -> None:
+    """Record a gallery's pages and mark it as the newer version of its parent."""
+    async with in_transaction():
+        await GalleryVersion.update_or_create(
+            gid=gid, defaults={"parent_gid": parent_gid, "imgkeys": imgkeys}
+        )
+        if parent_gid is not None:
+            await GalleryVersion.filter(gid=parent_gid).update(newer_gid=gid)
+
+
+@timed("db")
+async def get_galleries_to_sweep(
+    after: Optional[tuple[datetime, int]], before: datetime, limit: int
+) -> List[Gallery]:
+    """Galleries last updated before `before`, in (updated_at, gid) order."""
+    query = Gallery.filter(updated_at__lt=before)
+    if after is not None:
+        updated_at, gid = after
+        ## A plain range on updated_at keeps the index usable, ties by gid
+        query = query.filter(updated_at__gte=updated_at).filter(
+            Q(updated_at__gt=updated_at) | Q(gid__gt=gid)
+        )
+    return await query.order_by("updated_at", "gid").limit(limit)
+
+
+@timed("db")
+async def get_state(key: str) -> Optional[dict]:
+    row = await State.filter(key=key).first()
+    return row.value if row is not None else None
+
+
+@timed("db")
+async def set_state(key: str, value: dict) -> None:
+    await State.update_or_create(key=key, defaults={"value": value})
+
+
+@timed("db")
 async def upsert_task(
     chat_id: int,
     search: str,
@@ -132,6 +573,7 @@ async def upsert_task(
     author_name: str,
     author_url: str,
     query_depth: int,
+    interval: Optional[int] = None,
 ) -> Task:
     existing = await get_task(chat_id)
     if existing:
@@ -141,6 +583,7 @@ async def upsert_task(
         existing.author_name = author_name
         existing.author_url = author_url
         existing.query_depth = query_depth
+        existing.check_interval = interval
         await existing.save()
         return existing
     return await Task.create(
@@ -151,8 +594,202 @@ async def upsert_task(
         author_name=author_name,
         author_url=author_url,
         query_depth=query_depth,
+        check_interval=interval,
     )
 
 
+@timed("db")
 async def delete_task(chat_id: int):
     await Task.filter(chat_id=chat_id).delete()
+
+
+@timed("db")
+async def add_pending_message(
+    chat_id: int,
+    text: str,
+    gid: int | None = None,
+    reply_to_message_id: int | None = None,
+    claimed_by: str | None = None,
+) -> Optional[PendingMessage]:
+    """Persist an outbound message and mark the gallery as sent to the chat.
+
+    Both writes happen in one transaction so a restart does not lose the
+    delivery. Delivery is at least once: a message sent right before a crash
+    is sent again. `claimed_by` claims the message for that replica, others
+    are left to whichever replica claims them. Returns None if the gallery is
+    already pending.
+    """
+    async with in_transaction():
+        if gid is not None:
+            if await PendingMessage.filter(chat_id=chat_id, gid=gid).exists():
+                return None
+            gallery = await get_gallery(gid)
+            if gallery is not None:
+                gallery.chat_ids = gallery.chat_ids or []
+                if chat_id not in gallery.chat_ids:
+                    gallery.chat_ids.append(chat_id)
+                    await gallery.save()
+        return await PendingMessage.create(
+            chat_id=chat_id,
+            gid=gid,
+            text=text,
+            reply_to_message_id=reply_to_message_id,
+            claimed_by=claimed_by,
+            claimed_at=timezone.now() if claimed_by else None,
+        )
+
+
+@timed("db")
+async def claim_pending_messages(
+    holder: str, lease: float, exclude: Iterable[int] = (), resume: bool = False
+) -> List[PendingMessage]:
+    """Claim unclaimed messages and those whose claim is older than `lease`.
+
+    With `resume`, messages still claimed by `holder` are taken back as well;
+    they were left over by a previous run under the same replica id. Like
+    `claim_job`, Postgres skips rows locked by other replicas and the
+    conditional update keeps the claim safe on SQLite.
+    """
+    now = timezone.now()
+    claimed = []
+    claimable = Q(claimed_at__isnull=True) | Q(
+        claimed_at__lt=now - timedelta(seconds=lease)
+    )
+    if resume:
+        claimable |= Q(claimed_by=holder)
+    async with in_transaction():
+        candidates = (
+            await PendingMessage.filter(claimable)
+            .exclude(id__in=list(exclude))
+            .order_by("id")
+            .select_for_update(skip_locked=True)
+        )
+        for message in candidates:
+            current = PendingMessage.filter(id=message.id)
+            if message.claimed_at is None:
+                current = current.filter(claimed_at__isnull=True)
+            else:
+                current = current.filter(claimed_at=message.claimed_at)
+            if await current.update(claimed_by=holder, claimed_at=now):
+                message.claimed_by = holder
+                message.claimed_at = now
+                claimed.append(message)
+    return claimed
+
+
+@timed("db")
+async def renew_pending_message(id: int, holder: str) -> bool:
+    """Refresh a claim before sending; False if another replica took it over."""
+    return bool(
+        await PendingMessage.filter(id=id, claimed_by=holder).update(
+            claimed_at=timezone.now()
+        )
+    )
+
+
+@timed("db")
+async def delete_pending_message(id: int):
+    await PendingMessage.filter(id=id).delete()
+
+
+@timed("db")
+async def delete_pending_messages(chat_id: int):
+    await PendingMessage.filter(chat_id=chat_id).delete()
+
+
+@timed("db")
+async def add_job(**kwargs) -> Optional[Job]:
+    """Queue a gallery job. Returns None if the subscription job is queued."""
+    if kwargs.get("subscription"):
+        exists = await Job.filter(
+            gid=kwargs.get("gid"), chat_id=kwargs.get("chat_id"), subscription=True
+        ).exists()
+        if exists:
+            return None
+    return await Job.create(available_at=timezone.now(), **kwargs)
+
+
+@timed("db")
+async def claim_job(worker_id: str, lease: float) -> Optional[Job]:
+    """Claim the next available job for `lease` seconds.
+
+    Postgres skips rows locked by other workers. The conditional update makes
+    the claim safe on backends without row locks as well.
+    """
+    while True:
+        now = timezone.now()
+        async with in_transaction():
+            job = (
+                await Job.filter(available_at__lte=now)
+                ## Interactive requests before subscription jobs
+                .order_by("subscription", "id")
+                .select_for_update(skip_locked=True)
+                .first()
+            )
+            if job is None:
+                return None
+            claimed = await Job.filter(id=job.id, available_at=job.available_at).update(
+                available_at=now + timedelta(seconds=lease),
+                claimed_by=worker_id,
+                attempts=F("attempts") + 1,
+            )
+        if claimed:
+            job.attempts += 1
+            job.claimed_by = worker_id
+            return job
+
+
+@timed("db")
+async def extend_job(id: int, worker_id: str, lease: float) -> bool:
+    return bool(
+        await Job.filter(id=id, claimed_by=worker_id).update(
+            available_at=timezone.now() + timedelta(seconds=lease)
+        )
+    )
+
+
+@timed("db")
+async def release_job(id: int, available_at: datetime) -> None:
+    await Job.filter(id=id).update(available_at=available_at, claimed_by=None)
+
+
+@timed("db")
+async def delete_job(id: int) -> None:
+    await Job.filter(id=id).delete()
+
+
+@timed("db")
+async def count_jobs() -> int:
+    return await Job.all().count()
+
+
+@timed("db")
+async def acquire_lease(name: str, holder: str, ttl: float) -> bool:
+    """Take or renew lease `name` for `ttl` seconds.
+
+    Succeeds if the lease is free, expired or already held by `holder`.
+    """
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=ttl)
+    updated = await Lease.filter(
+        Q(holder=holder) | Q(expires_at__lt=now), name=name
+    ).update(holder=holder, expires_at=expires_at)
+    if updated:
+        return True
+    try:
+        await Lease.create(name=name, holder=holder, expires_at=expires_at)
+    except IntegrityError:
+        return False
+    return True
+
+
+@timed("db")
+async def release_lease(name: str, holder: str) -> None:
+    await Lease.filter(name=name, holder=holder).delete()
+
+
+@timed("db")
+async def get_lease_holders(prefix: str) -> List[str]:
+    """Holders of the unexpired leases whose name starts with `prefix`."""
+    leases = await Lease.filter(name__startswith=prefix, expires_at__gt=timezone.now())
+    return sorted(lease.holder for lease in leases)
@@ -0,0 +1,176 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from loguru import logger
+from tortoise import timezone
+
+from .exhentai_client import GalleryInfo
+from .metrics import LINK_SWEEP_GALLERIES, LINK_SWEEP_IMAGES
+from .pipeline import MAX_IMAGES, GalleryJob, Pipeline
+from .storage import (
+    Gallery,
+    get_galleries_to_sweep,
+    get_gallery_images,
+    get_state,
+    set_gallery_images,
+    set_state,
+)
+from .utils import TokenBucket
+
+STATE_KEY = "link_sweep"
+
+
+class LinkSweeper:
+    """Re-host images of stored galleries whose file host dropped them.
+
+    Galleries are visited in `(updated_at, gid)` order, `batch` at a time,
+    and every image is checked with a HEAD request at no more than `rate`
+    requests per second. Only dead images are dispatched and uploaded again,
+    then the existing Telegraph page is edited in place. The position is
+    saved after every gallery, so a restart resumes where the sweep stopped.
+    A finished round waits `interval` seconds before starting over; galleries
+    published less than `min_age` seconds ago are left to the upload verifier.
+    Edited pages keep the author they were published under; `author_name`
+    and `author_url` are only used for pages that have none.
+    """
+
+    def __init__(
+        self,
+        pipeline: Pipeline,
+        author_name: str,
+        author_url: Optional[str],
+        rate: float = 1.0,
+        batch: int = 20,
+        interval: float = 86400,
+        min_age: float = 86400,
+        should_run: Callable[[], bool] = lambda: True,
+    ):
+        self.pipeline = pipeline
+        self.author_name = author_name
+        self.author_url = author_url
+        self.bucket = TokenBucket(rate, burst=max(1.0, rate))
+        self.batch = batch
+        self.interval = interval
+        self.min_age = min_age
+        self.should_run = should_run
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                delay = await self.step()
+            except Exception as e:
+                logger.error(f"Link sweep failed: {e}")
+                delay = 60
+            await asyncio.sleep(delay)
+
+    async def step(self) -> float:
+        """Sweep one batch; returns how long to wait before the next one."""
+        if not self.should_run():
+            return 60
+        state = await get_state(STATE_KEY) or {}
+        now = timezone.now()
+        if "finished_at" in state:
+            left = (
+                datetime.fromisoformat(state["finished_at"])
+                + timedelta(seconds=self.interval)
+                - now
+            ).total_seconds()
+            if left > 0:
+                return min(left, 3600)
+            state = {}
+        after = None
+        if "updated_at" in state:
+            after = (datetime.fromisoformat(state["updated_at"]), state["gid"])
+        galleries = await get_galleries_to_sweep(
+            after, now - timedelta(seconds=self.min_age), self.batch
+        )
+        if not galleries:
+            logger.info("Link sweep finished a round")
+            await set_state(STATE_KEY, {"finished_at": now.isoformat()})
+            return 0
+        for gallery in galleries:
+            try:
+                await self.sweep(gallery)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LINK_SWEEP_GALLERIES.inc(result="error")
+                logger.error(f"Failed to sweep {gallery.url}: {e}")
+            await set_state(
+                STATE_KEY,
+                {"updated_at": gallery.updated_at.isoformat(), "gid": gallery.gid},
+            )
+        return 0
+
+    async def _image_urls(self, gallery: Gallery) -> List[Optional[str]]:
+        urls = await get_gallery_images(gallery.gid)
+        if urls is None:
+            ## Published before image URLs were stored, read them off the page
+            urls = await self.pipeline.telegraph.get_page_images(gallery.telegraph_url)
+            await set_gallery_images(gallery.gid, urls)
+        return urls
+
+    async def _check(self, i: int, url: str) -> Optional[int]:
+        await self.bucket.acquire()
+        ok = await self.pipeline.uploader.check_content(url)
+        backend = self.pipeline.uploader.backend_of(url)
+        LINK_SWEEP_IMAGES.inc(backend=backend, result="ok" if ok else "dead")
+        return None if ok else i
+
+    async def sweep(self, gallery: Gallery) -> List[int]:
+        """Check one gallery; returns the indexes that were re-hosted."""
+        urls = await self._image_urls(gallery)
+        results = await asyncio.gather(
+            *(self._check(i, url) for i, url in enumerate(urls) if url)
+        )
+        dead = [i for i in results if i is not None]
+        if not dead:
+            LINK_SWEEP_GALLERIES.inc(result="ok")
+            return []
+        mpv_info = await self.pipeline.client.fetch_mpv_info(gallery.url)
+        mpv_info.images = mpv_info.images[:MAX_IMAGES]
+        if len(mpv_info.images) != len(urls):
+            ## The gallery changed since it was published, leave it to /refresh
+            LINK_SWEEP_GALLERIES.inc(result="skipped")
+            logger.warning(
+                f"Link sweep skipped {gallery.url}: "
+                f"{len(urls)} images stored, {len(mpv_info.images)} now"
+            )
+            return []
+        logger.info(f"Re-hosting {len(dead)} of {len(urls)} images: {gallery.url}")
+        ## Galleries are published under the author of their task, not ours
+        author_name, author_url = await self.pipeline.telegraph.get_page_author(
+            gallery.telegraph_url
+        )
+        if not author_name:
+            author_name, author_url = self.author_name, self.author_url
+        job = GalleryJob(
+            url=gallery.url,
+            author_name=author_name,
+            author_url=author_url,
+            gallery_info=GalleryInfo(
+                gid=gallery.gid, url=gallery.url, title=gallery.title, tags=[]
+            ),
+            mpv_info=mpv_info,
+            dispatch_urls=[None] * len(urls),
+            dispatch_s=[None] * len(urls),
+            image_urls=list(urls),
+            tags=gallery.tags,
+            telegraph_url=gallery.telegraph_url,
+        )
+        replaced = await self.pipeline.rehost(job, dead)
+        LINK_SWEEP_IMAGES.inc(len(replaced), backend="all", result="replaced")
+        LINK_SWEEP_GALLERIES.inc(result="rehosted" if replaced else "failed")
+        return replaced
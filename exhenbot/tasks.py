@@ -0,0 +1,103 @@
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+
+from .storage import TaskRecord, delete_task, get_task_records, upsert_task
+
+
+class TaskRegistry:
+    """Subscription tasks kept in memory for the scheduler.
+
+    Loaded once at startup and changed in place by `add` and `remove`, so a
+    scheduler tick needs no database query. Other replicas may change the
+    table too, which is picked up by reloading it every `reconcile_interval`
+    seconds. Each task runs every `interval` seconds of its own, or every
+    `default_interval` seconds; a task that was just added is due at once.
+    """
+
+    def __init__(self, default_interval: float, reconcile_interval: float = 300):
+        self.default_interval = default_interval
+        self.reconcile_interval = reconcile_interval
+        self.records: Dict[int, TaskRecord] = {}
+        self.next_run: Dict[int, float] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def start(self) -> None:
+        if self.task is None and self.reconcile_interval > 0:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error(f"Failed to reload tasks: {e}")
+
+    async def load(self) -> None:
+        """Replace the records with the task table, keeping their schedule."""
+        records = await get_task_records()
+        self.records = {r.chat_id: r for r in records}
+        self.next_run = {
+            chat_id: at
+            for chat_id, at in self.next_run.items()
+            if chat_id in self.records
+        }
+        logger.debug(f"Loaded {len(records)} tasks")
+
+    async def add(self, chat_id: int, **fields) -> TaskRecord:
+        task = await upsert_task(chat_id=chat_id, **fields)
+        record = TaskRecord(
+            chat_id=task.chat_id,
+            search=task.search,
+            catogories=task.catogories,
+            star=task.star,
+            author_name=task.author_name,
+            author_url=task.author_url,
+            query_depth=task.query_depth,
+            interval=task.check_interval,
+            created_at=task.created_at,
+        )
+        self.records[chat_id] = record
+        self.next_run.pop(chat_id, None)
+        return record
+
+    async def remove(self, chat_id: int) -> None:
+        await delete_task(chat_id)
+        self.records.pop(chat_id, None)
+        self.next_run.pop(chat_id, None)
+
+    def all(
+        self, owns: Callable[[int], bool] = lambda chat_id: True
+    ) -> List[TaskRecord]:
+        """Tasks accepted by `owns`, newest first."""
+        return sorted(
+            (r for r in self.records.values() if owns(r.chat_id)),
+            key=lambda r: r.created_at,
+            reverse=True,
+        )
+
+    def due(
+        self, owns: Callable[[int], bool] = lambda chat_id: True
+    ) -> List[TaskRecord]:
+        """Tasks accepted by `owns` whose interval has passed, and reschedule them."""
+        now = time.monotonic()
+        tasks = []
+        for record in self.all(owns):
+            if self.next_run.get(record.chat_id, now) <= now:
+                self.next_run[record.chat_id] = now + (
+                    record.interval or self.default_interval
+                )
+                tasks.append(record)
+        return tasks
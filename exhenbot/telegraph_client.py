@@ -1,32 +1,337 @@
-from typing import List, Optional
-from telegraph.aio import Telegraph
-
-
-class TelegraphClient:
-    def __init__(self, access_token: str):
-        self.telegraph = Telegraph(access_token=access_token)
-
-    async def aclose(self) -> None:
-        await self.telegraph._telegraph.session.aclose()
-
-    async def create_telegraph_page(
-        self,
-        title: str,
-        image_urls: List[str],
-        author_name: str,
-        author_url: Optional[str],
-    ) -> str:
-        if not self.telegraph.get_access_token():
-            await self.telegraph.create_account(
-                short_name=author_name, author_name=author_name, author_url=author_url
-            )
-        body = "\n".join(f'<p><img src="{u}"/></p>' for u in image_urls)
-        graph_url = await self.telegraph.create_page(
-            title=title,
-            html_content=body,
-            author_name=author_name,
-            author_url=author_url,
-        )
-        if not graph_url:
-            raise RuntimeError(f"Failed to create page: {graph_url}")
-        return graph_url.get("url")
+import asyncio
+import json
+import time
+import urllib.parse
+from typing import List, Optional, Tuple
+
+from loguru import logger
+from telegraph.aio import Telegraph
+from telegraph.exceptions import RetryAfterError, TelegraphException
+
+from .http_client import build_client
+from .metrics import STAGE_SECONDS
+from .tracing import span
+from .utils import DeadlineExceeded, check_deadline, time_left
+
+# Telegraph rejects page content above 64 KiB; keep some headroom for the
+# request encoding.
+MAX_CONTENT_SIZE = 60 * 1024
+NEXT_PAGE_TEXT = "下一页"
+
+
+class TelegraphClient:
+    """Telegraph publisher over a pool of accounts.
+
+    `access_token` may hold several comma separated tokens; calls rotate over
+    them and an account hitting FLOOD_WAIT is skipped until its wait is over.
+    """
+
+    def __init__(
+        self, access_token: Optional[str], max_retries: int = 3, timeout: float = 30
+    ):
+        tokens = [t.strip() for t in (access_token or "").split(",") if t.strip()]
+        self.accounts = [Telegraph(access_token=t) for t in tokens] or [Telegraph()]
+        # All accounts talk to the same host; share one pooled client
+        self.session = build_client("telegraph", timeout=timeout, max_connections=4)
+        for account in self.accounts:
+            account._telegraph.session = self.session
+        self.cooldowns = [0.0] * len(self.accounts)
+        self.index = 0
+        self.max_retries = max_retries
+
+    async def aclose(self) -> None:
+        await self.session.aclose()
+
+    # -----------------------------
+    # Content
+    # -----------------------------
+    @staticmethod
+    def build_nodes(image_urls: List[Optional[str]]) -> List[dict]:
+        return [{"tag": "img", "attrs": {"src": u}} for u in image_urls if u]
+
+    @staticmethod
+    def next_page_node(url: str) -> dict:
+        return {
+            "tag": "p",
+            "children": [
+                {"tag": "a", "attrs": {"href": url}, "children": [NEXT_PAGE_TEXT]}
+            ],
+        }
+
+    @staticmethod
+    def _size(nodes: List[dict]) -> int:
+        return len(json.dumps(nodes, separators=(",", ":")).encode("utf-8"))
+
+    def split_nodes(self, nodes: List[dict]) -> List[List[dict]]:
+        """Split nodes into chunks that fit a page including its next link."""
+        reserved = self._size([self.next_page_node("https://telegra.ph/" + "x" * 256)])
+        chunks: List[List[dict]] = [[]]
+        size = 2
+        for node in nodes:
+            node_size = self._size([node])
+            if chunks[-1] and size + node_size + reserved > MAX_CONTENT_SIZE:
+                chunks.append([])
+                size = 2
+            chunks[-1].append(node)
+            size += node_size
+        return chunks
+
+    @staticmethod
+    def parse_nodes(nodes: List[dict]) -> Tuple[List[str], Optional[str]]:
+        """Image sources of a page and the URL of its next page, if any."""
+        images, next_url = [], None
+        for node in nodes:
+            if not isinstance(node, dict):
+                continue
+            if node.get("tag") == "img":
+                images.append(node.get("attrs", {}).get("src"))
+            for child in node.get("children", []):
+                if (
+                    isinstance(child, dict)
+                    and child.get("tag") == "a"
+                    and child.get("children") == [NEXT_PAGE_TEXT]
+                ):
+                    next_url = child.get("attrs", {}).get("href")
+        return images, next_url
+
+    async def _read_pages(self, telegraph_url: str) -> List[Tuple[str, List[str]]]:
+        """URL and image URLs of a page and each of its continuation pages."""
+        pages: List[Tuple[str, List[str]]] = []
+        url: Optional[str] = telegraph_url
+        seen = set()
+        while url and url not in seen:
+            seen.add(url)
+            path = urllib.parse.urlparse(url).path.strip("/")
+            with STAGE_SECONDS.time(stage="telegraph"):
+                page = await self.accounts[0].get_page(
+                    path, return_content=True, return_html=False
+                )
+            page_images, next_url = self.parse_nodes(page.get("content") or [])
+            pages.append((url, page_images))
+            url = next_url
+        return pages
+
+    async def get_page_images(self, telegraph_url: str) -> List[str]:
+        """Image URLs of a page, following its continuation pages."""
+        return [
+            image
+            for _, images in await self._read_pages(telegraph_url)
+            for image in images
+        ]
+
+    async def get_page_author(
+        self, telegraph_url: str
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """Author name and URL a page was published under."""
+        path = urllib.parse.urlparse(telegraph_url).path.strip("/")
+        with STAGE_SECONDS.time(stage="telegraph"):
+            page = await self.accounts[0].get_page(path, return_content=False)
+        return page.get("author_name"), page.get("author_url")
+
+    # -----------------------------
+    # Accounts
+    # -----------------------------
+    def _next_account(self) -> int:
+        """Pick the next account that is not cooling down from FLOOD_WAIT."""
+        now = time.monotonic()
+        for _ in range(len(self.accounts)):
+            index = self.index
+            self.index = (self.index + 1) % len(self.accounts)
+            if self.cooldowns[index] <= now:
+                return index
+        return min(range(len(self.accounts)), key=lambda i: self.cooldowns[i])
+
+    async def _ensure_account(
+        self, index: int, author_name: str, author_url: Optional[str]
+    ) -> Telegraph:
+        account = self.accounts[index]
+        if not account.get_access_token():
+            await account.create_account(
+                short_name=author_name, author_name=author_name, author_url=author_url
+            )
+        return account
+
+    async def _call(
+        self,
+        method: str,
+        author_name: str,
+        author_url: Optional[str],
+        index: Optional[int] = None,
+        **kwargs,
+    ) -> dict:
+        """Call a page method, retrying FLOOD_WAIT with the server-provided wait.
+
+        Without a fixed account index the call moves on to the next account.
+        """
+        for attempt in range(self.max_retries + 1):
+            check_deadline()
+            i = self._next_account() if index is None else index
+            wait = self.cooldowns[i] - time.monotonic()
+            if wait > 0:
+                left = time_left()
+                if left is not None and wait >= left:
+                    raise DeadlineExceeded(f"Telegraph account {i} cooling down")
+                await asyncio.sleep(wait)
+            account = await self._ensure_account(i, author_name, author_url)
+            try:
+                with (
+                    STAGE_SECONDS.time(stage="telegraph"),
+                    span("telegraph", method=method, account=i),
+                ):
+                    return await getattr(account, method)(
+                        author_name=author_name, author_url=author_url, **kwargs
+                    )
+            except RetryAfterError as e:
+                self.cooldowns[i] = time.monotonic() + e.retry_after
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(
+                    f"Telegraph flood wait {e.retry_after}s on account {i} "
+                    f"(attempt {attempt + 1}/{self.max_retries + 1})"
+                )
+
+    # -----------------------------
+    # Pages
+    # -----------------------------
+    async def _create_pages(
+        self,
+        title: str,
+        chunks: List[List[dict]],
+        author_name: str,
+        author_url: Optional[str],
+        start: int = 0,
+        total: Optional[int] = None,
+        index: Optional[int] = None,
+    ) -> Optional[str]:
+        """Create pages for chunks back to front so each links to the next.
+
+        `start` and `total` number the pages when chunks continue an existing
+        page. All pages are created by one account, `index` or the next one
+        in the pool, so a later edit can rewrite the whole chain in place.
+        Returns the URL of the first created page.
+        """
+        total = total or start + len(chunks)
+        if index is None:
+            index = self._next_account()
+        next_url = None
+        for i in reversed(range(len(chunks))):
+            content = chunks[i] + ([self.next_page_node(next_url)] if next_url else [])
+            number = start + i
+            page_title = title if number == 0 else f"{title} ({number + 1}/{total})"
+            page = await self._call(
+                "create_page",
+                author_name,
+                author_url,
+                index=index,
+                title=page_title,
+                content=content,
+            )
+            if not page or not page.get("url"):
+                raise RuntimeError(f"Failed to create page: {page}")
+            next_url = page["url"]
+        return next_url
+
+    async def create_telegraph_page(
+        self,
+        title: str,
+        image_urls: List[Optional[str]],
+        author_name: str,
+        author_url: Optional[str],
+    ) -> str:
+        chunks = self.split_nodes(self.build_nodes(image_urls))
+        if len(chunks) > 1:
+            logger.info(f"Splitting {title} into {len(chunks)} telegraph pages")
+        return await self._create_pages(title, chunks, author_name, author_url)
+
+    async def _edit_page(
+        self,
+        index: int,
+        url: str,
+        title: str,
+        content: List[dict],
+        author_name: str,
+        author_url: Optional[str],
+    ) -> Optional[str]:
+        """Edit a page with one account; None if that account does not own it."""
+        try:
+            page = await self._call(
+                "edit_page",
+                author_name,
+                author_url,
+                index=index,
+                path=urllib.parse.urlparse(url).path.strip("/"),
+                title=title,
+                content=content,
+            )
+        except TelegraphException as e:
+            if "PAGE_ACCESS_DENIED" not in str(e):
+                raise
+            return None
+        return page.get("url") or url
+
+    async def edit_telegraph_page(
+        self,
+        telegraph_url: str,
+        title: str,
+        image_urls: List[Optional[str]],
+        author_name: str,
+        author_url: Optional[str],
+    ) -> str:
+        """Update an existing page in place.
+
+        The first page is edited before anything else, which also finds the
+        account owning it. Existing continuation pages are then edited in
+        place and new ones are only created for content they cannot hold.
+        Falls back to new pages if no account in the pool owns the existing
+        one, without creating any page before that is known.
+        """
+        chunks = self.split_nodes(self.build_nodes(image_urls))
+        old = []
+        if len(chunks) > 1:
+            old = [url for url, _ in await self._read_pages(telegraph_url)][1:]
+        ## Keep linking the current continuation while the rest is rewritten
+        linked = old[0] if old else None
+        content = chunks[0] + ([self.next_page_node(linked)] if linked else [])
+        for index in range(len(self.accounts)):
+            url = await self._edit_page(
+                index, telegraph_url, title, content, author_name, author_url
+            )
+            if url is not None:
+                break
+        else:
+            logger.warning(
+                f"No telegraph account owns {telegraph_url}, creating new pages"
+            )
+            return await self._create_pages(title, chunks, author_name, author_url)
+        if len(chunks) == 1:
+            return url
+        next_url = None
+        for i in reversed(range(1, len(chunks))):
+            content = chunks[i] + ([self.next_page_node(next_url)] if next_url else [])
+            page_url = None
+            if i - 1 < len(old):
+                page_url = await self._edit_page(
+                    index,
+                    old[i - 1],
+                    f"{title} ({i + 1}/{len(chunks)})",
+                    content,
+                    author_name,
+                    author_url,
+                )
+            if page_url is None:
+                page_url = await self._create_pages(
+                    title,
+                    [content],
+                    author_name,
+                    author_url,
+                    start=i,
+                    total=len(chunks),
+                    index=index,
+                )
+            next_url = page_url
+        if next_url != linked:
+            content = chunks[0] + [self.next_page_node(next_url)]
+            url = await self._edit_page(
+                index, url, title, content, author_name, author_url
+            )
+        return url
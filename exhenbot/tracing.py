@@ -0,0 +1,184 @@
+import json
+import os
+import secrets
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+# Attributes copied from a parent span to its children
+INHERITED_ATTRIBUTES = ("gid", "page")
+
+
+class Span:
+    """Span with the subset of the OpenTelemetry span API used here."""
+
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "attributes",
+        "events",
+        "start",
+        "end",
+        "status",
+    )
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: dict):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.events: List[Dict[str, Any]] = []
+        self.start = time.time_ns()
+        self.end: Optional[int] = None
+        self.status = "OK"
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def add_event(self, name: str, attributes: Optional[dict] = None) -> None:
+        self.events.append(
+            {
+                "name": name,
+                "time_unix_nano": time.time_ns(),
+                "attributes": attributes or {},
+            }
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start,
+            "end_time_unix_nano": self.end,
+            "duration_ms": (self.end - self.start) / 1e6,
+            "attributes": self.attributes,
+            "events": self.events,
+            "status": self.status,
+        }
+
+
+class JsonlExporter:
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+
+    def export(self, span: Span) -> None:
+        self.file.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str))
+        self.file.write("\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class Tracer:
+    """Opt-in tracing of gallery processing.
+
+    Spans follow the OpenTelemetry model. They are either written to a JSONL
+    file (`jsonl`, for offline use) or forwarded to the OpenTelemetry API when
+    it is installed (`otel`). When tracing is off, `span` and `add_event` cost
+    a single attribute check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.exporter = None
+        self.otel = None
+        self.current: ContextVar[Optional[Span]] = ContextVar(
+            "exhenbot_span", default=None
+        )
+
+    def configure(self, exporter: Optional[str], path: Optional[str] = None) -> None:
+        """Enable tracing with the `jsonl` or `otel` exporter."""
+        if not exporter:
+            return
+        if exporter == "otel":
+            try:
+                from opentelemetry import trace
+            except ImportError:
+                logger.warning("opentelemetry is not installed, using jsonl traces")
+            else:
+                self.otel = trace
+                self.enabled = True
+                return
+        path = path or os.path.join(".exhenbot", "traces.jsonl")
+        self.exporter = JsonlExporter(path)
+        self.enabled = True
+        logger.info(f"Writing traces to {path}")
+
+    def close(self) -> None:
+        if self.exporter is not None:
+            self.exporter.close()
+        self.exporter = None
+        self.enabled = False
+
+    def current_span(self):
+        if self.otel is not None:
+            return self.otel.get_current_span()
+        return self.current.get()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        if not self.enabled:
+            yield None
+            return
+        parent = self.current_span()
+        if self.otel is None and parent is not None:
+            for key in INHERITED_ATTRIBUTES:
+                if key in parent.attributes:
+                    attributes.setdefault(key, parent.attributes[key])
+        if self.otel is not None:
+            tracer = self.otel.get_tracer("exhenbot")
+            with tracer.start_as_current_span(name, attributes=attributes) as s:
+                yield s
+            return
+        s = Span(name, parent, attributes)
+        token = self.current.set(s)
+        try:
+            yield s
+        except BaseException as e:
+            s.status = "ERROR"
+            s.add_event("exception", {"type": type(e).__name__, "message": str(e)})
+            raise
+        finally:
+            self.current.reset(token)
+            s.end = time.time_ns()
+            self.exporter.export(s)
+
+    @contextmanager
+    def use_span(self, s):
+        """Make `s` the parent of spans opened in this context."""
+        if self.otel is not None and s is not None:
+            with self.otel.use_span(s, end_on_exit=False):
+                yield s
+            return
+        if not self.enabled or s is None:
+            yield s
+            return
+        token = self.current.set(s)
+        try:
+            yield s
+        finally:
+            self.current.reset(token)
+
+    def add_event(self, name: str, **attributes) -> None:
+        if not self.enabled:
+            return
+        s = self.current_span()
+        if s is not None:
+            s.add_event(name, attributes)
+
+
+tracer = Tracer()
+span = tracer.span
+use_span = tracer.use_span
+add_event = tracer.add_event
@@ -1,16 +1,18 @@
-import asyncio
 import base64
 import hashlib
 import mimetypes
 import os
-from typing import Optional, Tuple
+import time
+from typing import Awaitable, Optional, Tuple
 from urllib.parse import urlparse
 
-import aiobotocore.session
-import httpx
 from loguru import logger
 
-from .utils import retry_request
+from .metrics import STAGE_SECONDS, UPLOAD_SECONDS
+from .priority import PriorityLimiter
+from .proxy_pool import ProxyPool, build_proxied_client
+from .tracing import span
+from .utils import RetryPolicy, retry_request
 
 
 class FileUploader:
@@ -25,22 +27,32 @@ class FileUploader:
         s3_config: dict = None,
         imgbb_api_key: str = None,
         proxy: str = None,
+        max_connections: int = None,
+        retry_policy: RetryPolicy = None,
+        proxy_pool: Optional[ProxyPool] = None,
     ):
-        self.client = httpx.AsyncClient(
-            headers=self._HEADERS,
+        # Each upload slot may hold an upload plus a content check or download;
+        # `proxy` is only used without a proxy pool
+        self.client = build_proxied_client(
+            proxy_pool,
+            "uploader",
             timeout=timeout,
-            follow_redirects=True,
-            http2=True,
-            proxy=proxy or None,
+            max_connections=max_connections or 2 * semaphore_size,
+            proxy=proxy,
+            headers=self._HEADERS,
         )
-        self.semaphore = asyncio.Semaphore(semaphore_size)
+        self.semaphore = PriorityLimiter("uploader", semaphore_size)
+        ## A repeated upload at worst stores the image twice, so uploads are
+        ## retried like idempotent requests
+        self.retry_policy = retry_policy
         self.s3_config = s3_config
         self.imgbb_api_key = imgbb_api_key
 
     async def aclose(self) -> None:
         await self.client.aclose()
 
-    async def _check_content(self, url: str) -> bool:
+    async def check_content(self, url: str) -> bool:
+        """HEAD an uploaded URL; True if it serves a non-empty body."""
         try:
             resp = await self.client.head(url)
             resp.raise_for_status()
@@ -50,10 +62,25 @@ class FileUploader:
             logger.warning(f"HEAD request failed for {url}: {e}")
             return False
 
+    def backend_of(self, url: str) -> str:
+        """Name of the backend hosting an uploaded URL."""
+        host = urlparse(url).hostname or ""
+        if host.endswith("catbox.moe"):
+            return "catbox"
+        if host.endswith("ibb.co"):
+            return "imgbb"
+        if self.s3_config and self.s3_config.get("endpoint"):
+            base = self.s3_config.get("public_url") or self.s3_config["endpoint"]
+            if url.startswith(base.rstrip("/")):
+                return "s3"
+        return "other"
+
     async def _download(self, url: str) -> Tuple[bytes, str, str]:
         """Download image and return (content, content_type, filename)."""
-        resp = await self.client.get(url)
-        resp.raise_for_status()
+        with STAGE_SECONDS.time(stage="download"):
+            resp = await retry_request(
+                self.client, method="GET", url=url, policy=self.retry_policy
+            )
         content = resp.content
         content_type = resp.headers.get("content-type", "application/octet-stream")
         ext = mimetypes.guess_extension(content_type) or ".jpg"
@@ -70,6 +97,8 @@ class FileUploader:
             method="POST",
             url=self.CATBOX_URL,
             data={"reqtype": "urlupload", "userhash": "", "url": url},
+            policy=self.retry_policy,
+            idempotent=True,
         )
         r.raise_for_status()
         text = r.text.strip()
@@ -85,6 +114,8 @@ class FileUploader:
             method="POST",
             url=self.IMGBB_URL,
             data={"key": self.imgbb_api_key, "image": url},
+            policy=self.retry_policy,
+            idempotent=True,
         )
         r.raise_for_status()
         data = r.json()
@@ -103,6 +134,8 @@ class FileUploader:
             url=self.CATBOX_URL,
             data={"reqtype": "fileupload", "userhash": ""},
             files={"fileToUpload": (filename, content, content_type)},
+            policy=self.retry_policy,
+            idempotent=True,
         )
         r.raise_for_status()
         text = r.text.strip()
@@ -119,6 +152,8 @@ class FileUploader:
             method="POST",
             url=self.IMGBB_URL,
             data={"key": self.imgbb_api_key, "image": b64},
+            policy=self.retry_policy,
+            idempotent=True,
         )
         r.raise_for_status()
         data = r.json()
@@ -134,6 +169,9 @@ class FileUploader:
             prefix = prefix.lstrip("/").rstrip("/") + "/"
         s3_key = prefix + filename
 
+        ## Deferred: aiobotocore is slow to import and only needed with S3
+        import aiobotocore.session
+
         session = aiobotocore.session.get_session()
         async with session.create_client(
             "s3",
@@ -158,6 +196,20 @@ class FileUploader:
     # Main entry point
     # ------------------------------------------------------------------
 
+    async def _timed(self, backend: str, upload: Awaitable[str]) -> str:
+        """Await an upload attempt and record its latency per backend."""
+        start = time.perf_counter()
+        result = "error"
+        try:
+            with span("upload_backend", backend=backend):
+                url = await upload
+            result = "ok"
+            return url
+        finally:
+            UPLOAD_SECONDS.observe(
+                time.perf_counter() - start, backend=backend, result=result
+            )
+
     async def upload_url(self, url: str) -> str:
         """Upload image from URL using a tiered fallback strategy:
         1. catbox URL upload  (remote fetch, no bot bandwidth)
@@ -166,23 +218,19 @@ class FileUploader:
         3. catbox file upload
         4. imgbb  file upload
         5. S3     file upload
+
+        The returned URL is not checked here, see `UploadVerifier`.
         """
         async with self.semaphore:
             # Phase 1: URL-based uploads
             try:
-                result = await self._catbox_url_upload(url)
-                if await self._check_content(result):
-                    return result
-                logger.warning(f"Catbox URL upload returned empty content for {url}")
+                return await self._timed("catbox_url", self._catbox_url_upload(url))
             except Exception as e:
                 logger.warning(f"Catbox URL upload failed ({e}) for {url}")
 
             if self.imgbb_api_key:
                 try:
-                    result = await self._imgbb_url_upload(url)
-                    if await self._check_content(result):
-                        return result
-                    logger.warning(f"imgbb URL upload returned empty content for {url}")
+                    return await self._timed("imgbb_url", self._imgbb_url_upload(url))
                 except Exception as e:
                     logger.warning(f"imgbb URL upload failed ({e}) for {url}")
 
@@ -193,25 +241,28 @@ class FileUploader:
                 raise RuntimeError(f"Failed to download image for file upload: {e}")
 
             try:
-                result = await self._catbox_file_upload(content, content_type, filename)
-                if await self._check_content(result):
-                    return result
-                logger.warning(f"Catbox file upload returned empty content for {url}")
+                return await self._timed(
+                    "catbox_file",
+                    self._catbox_file_upload(content, content_type, filename),
+                )
             except Exception as e:
                 logger.warning(f"Catbox file upload failed ({e}) for {url}")
 
             if self.imgbb_api_key:
                 try:
-                    result = await self._imgbb_file_upload(content, content_type, filename)
-                    if await self._check_content(result):
-                        return result
-                    logger.warning(f"imgbb file upload returned empty content for {url}")
+                    return await self._timed(
+                        "imgbb_file",
+                        self._imgbb_file_upload(content, content_type, filename),
+                    )
                 except Exception as e:
                     logger.warning(f"imgbb file upload failed ({e}) for {url}")
 
             if self.s3_config and self.s3_config.get("endpoint"):
                 try:
-                    return await self._s3_file_upload(content, content_type, filename)
+                    return await self._timed(
+                        "s3_file",
+                        self._s3_file_upload(content, content_type, filename),
+                    )
                 except Exception as e:
                     logger.warning(f"S3 file upload failed ({e}) for {url}")
 
@@ -1,31 +1,283 @@
 import asyncio
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
 
 import httpx
 from loguru import logger
 
+from .metrics import (
+    HTTP_BYTES,
+    HTTP_REQUESTS,
+    HTTP_RETRIES,
+    HTTP_RETRIES_SKIPPED,
+    STARTUP_SECONDS,
+)
+from .tracing import add_event
+
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+## Statuses worth another attempt; other 4xx will fail the same way again
+RETRYABLE_STATUS = frozenset({408, 425, 429, 500, 502, 503, 504})
+## Errors raised before the request reached the server, safe to retry for any method
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+## Monotonic time after which the current gallery's caller has given up
+deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+@contextmanager
+def use_deadline(at: Optional[float]):
+    """Set the deadline of the enclosed work, keeping an earlier outer one."""
+    current = deadline.get()
+    if current is not None and (at is None or current < at):
+        at = current
+    token = deadline.set(at)
+    try:
+        yield
+    finally:
+        deadline.reset(token)
+
+
+def time_left() -> Optional[float]:
+    at = deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def check_deadline() -> None:
+    left = time_left()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Deadline exceeded by {-left:.1f}s")
+
+
+class RetryBudget:
+    """Per-host cap on the ratio of retries to requests.
+
+    Every request earns `ratio` of a retry token and every retry spends one,
+    so a host that keeps failing gets at most `ratio` extra load instead of
+    `max_retries` times the load. `burst` tokens allow a few retries on
+    quiet hosts.
+    """
+
+    def __init__(self, ratio: float = 0.2, burst: float = 10):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens: Dict[str, float] = {}
+
+    def record_request(self, host: str) -> None:
+        self.tokens[host] = min(self.burst, self.tokens.get(host, self.burst) + self.ratio)
+
+    def try_spend(self, host: str) -> bool:
+        tokens = self.tokens.get(host, self.burst)
+        if tokens < 1:
+            return False
+        self.tokens[host] = tokens - 1
+        return True
+
+
+class RetryPolicy:
+    """How `retry_request` retries: full jitter backoff, budget and deadline.
+
+    The wait before retry `n` is uniform in `[0, min(max_delay, base_delay * 2**n)]`
+    so clients failing together do not retry together; a `Retry-After` header
+    raises it. Non-idempotent requests are only retried when they never reached
+    the server, unless the caller marks them idempotent.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 2,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        budget: Optional[RetryBudget] = None,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        wait = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if retry_after is not None:
+            wait = max(wait, retry_after)
+        return wait
+
+    def should_retry(self, method: str, error: Exception, idempotent: Optional[bool]) -> Optional[str]:
+        """Return why `error` must not be retried, or None to retry."""
+        if isinstance(error, httpx.HTTPStatusError):
+            if error.response.status_code not in RETRYABLE_STATUS:
+                return "status"
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        if not idempotent and not isinstance(error, UNSENT_ERRORS):
+            return "non_idempotent"
+        return None
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    if not isinstance(error, httpx.HTTPStatusError):
+        return None
+    try:
+        return float(error.response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
 
 async def retry_request(
     client: httpx.AsyncClient,
     *args,
-    max_retries: int = 2,
-    backoff_factor: float = 1.0,
+    policy: Optional[RetryPolicy] = None,
+    idempotent: Optional[bool] = None,
     **kwargs,
 ) -> httpx.Response:
-    """Retry POST request with exponential backoff."""
-    for attempt in range(max_retries + 1):
+    """Send a request, retrying transient failures according to `policy`.
+
+    Gives up early with `DeadlineExceeded` once the current deadline (see
+    `use_deadline`) has passed, and never sleeps past it.
+    """
+    policy = policy or DEFAULT_RETRY_POLICY
+    method = str(kwargs.get("method") or args[0])
+    host = httpx.URL(str(kwargs.get("url") or args[1])).host
+    for attempt in range(policy.max_retries + 1):
+        check_deadline()
+        left = time_left()
+        if left is not None and "timeout" not in kwargs and left < client.timeout.read:
+            request_kwargs = {**kwargs, "timeout": httpx.Timeout(left, connect=min(left, client.timeout.connect))}
+        else:
+            request_kwargs = kwargs
+        policy.budget.record_request(host)
         try:
-            response = await client.request(*args, **kwargs)
+            add_event("http.attempt", host=host, attempt=attempt + 1)
+            response = await client.request(*args, **request_kwargs)
+            record_response(host, response)
             response.raise_for_status()
             return response
         except (httpx.RequestError, httpx.HTTPStatusError) as e:
-            if e.response.status_code in [403, 404, 412]:
-                logger.error(f"Request failed with status code {e.response.status_code}: {e.response.text}")
-                raise
-            if attempt == max_retries:
-                logger.error(f"Request failed after {max_retries + 1} attempts: {e}")
+            if isinstance(e, httpx.RequestError):
+                HTTP_REQUESTS.inc(host=host, status="error")
+                detail = f"{type(e).__name__}: {e}"
+            else:
+                detail = f"status code {e.response.status_code}: {e.response.text[:200]}"
+            reason = policy.should_retry(method, e, idempotent)
+            if reason is None and attempt == policy.max_retries:
+                reason = "attempts"
+            wait = policy.backoff(attempt, _retry_after(e))
+            left = time_left()
+            if reason is None and left is not None and wait >= left:
+                reason = "deadline"
+            if reason is None and not policy.budget.try_spend(host):
+                reason = "budget"
+            if reason is not None:
+                HTTP_RETRIES_SKIPPED.inc(host=host, reason=reason)
+                logger.error(f"{method} {host} failed after {attempt + 1} attempts ({reason}), {detail}")
                 raise
-            wait_time = backoff_factor * (2**attempt)
             logger.warning(
-                f"Request failed (attempt {attempt + 1}/{max_retries + 1}), retrying in {wait_time:.1f}s: {e}"
+                f"{method} {host} failed (attempt {attempt + 1}/{policy.max_retries + 1}), "
+                f"retrying in {wait:.1f}s, {detail}"
             )
-            await asyncio.sleep(wait_time)
+            HTTP_RETRIES.inc(host=host)
+            add_event("http.backoff", host=host, wait=wait, error=detail)
+            await asyncio.sleep(wait)
+
+
+def record_response(host: str, response: httpx.Response) -> None:
+    HTTP_REQUESTS.inc(host=host, status=response.status_code)
+    HTTP_BYTES.inc(len(response.content), host=host, direction="in")
+    try:
+        HTTP_BYTES.inc(len(response.request.content), host=host, direction="out")
+    except httpx.RequestNotRead:
+        pass
+
+
+class TokenBucket:
+    """Token bucket refilling `rate` tokens per second up to `burst` tokens."""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        """Wait until `tokens` are available and consume them."""
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class TTLCache:
+    """Bounded mapping whose entries expire `ttl` seconds after being set."""
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.data: Dict[Any, Tuple[float, Any]] = {}
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        item = self.data.get(key)
+        if item is None:
+            return default
+        expires, value = item
+        if expires < time.monotonic():
+            del self.data[key]
+            return default
+        return value
+
+    def set(self, key: Any, value: Any) -> None:
+        self.data.pop(key, None)
+        if len(self.data) >= self.maxsize:
+            # Dicts keep insertion order, so the first key is the oldest
+            del self.data[next(iter(self.data))]
+        self.data[key] = (time.monotonic() + self.ttl, value)
+
+    def pop(self, key: Any) -> None:
+        self.data.pop(key, None)
+
+
+class StartupTimer:
+    """Wall time of startup phases, reported once the bot is up."""
+
+    def __init__(self):
+        ## CPU time before the timer starts is almost entirely module imports
+        self.imports = time.process_time()
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - start
+            STARTUP_SECONDS.set(self.phases[name], phase=name)
+
+    def report(self) -> str:
+        parts = [f"imports {self.imports:.2f}s cpu"]
+        parts += [f"{name} {seconds:.2f}s" for name, seconds in self.phases.items()]
+        try:
+            import resource
+
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            parts.append(f"peak RSS {rss:.0f} MiB")
+        except ImportError:
+            pass
+        return "Startup: " + ", ".join(parts)
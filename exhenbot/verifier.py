@@ -0,0 +1,117 @@
+import asyncio
+import random
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from .metrics import UPLOAD_VERIFICATIONS
+from .uploader_client import FileUploader
+
+## Every URL of these backends is checked unless configured otherwise
+DEFAULT_SAMPLE_RATES = {"catbox": 1.0, "imgbb": 1.0, "s3": 0.0, "other": 1.0}
+
+
+def parse_sample_rates(value: Optional[str]) -> Dict[str, float]:
+    """Parse `backend:rate` pairs such as `catbox:1,imgbb:0.2,s3:0`."""
+    rates = dict(DEFAULT_SAMPLE_RATES)
+    for item in (value or "").split(","):
+        if item.strip():
+            backend, _, rate = item.partition(":")
+            rates[backend.strip()] = float(rate)
+    return rates
+
+
+class UploadVerifier:
+    """Check uploaded image URLs after a gallery is published.
+
+    Galleries are queued once their Telegraph page exists, so checks stay off
+    the critical path. Each backend's URLs are sampled at its rate; a failed
+    sample means the rest of that backend's URLs in the gallery are checked
+    too. Pages whose upload failed outright (still pointing at the image
+    server) are always retried. Broken images are handed to `rehost`, which
+    uploads them again and fixes the page with one edit.
+    """
+
+    def __init__(
+        self,
+        uploader: FileUploader,
+        rehost: Callable[[object, List[int]], Awaitable[List[int]]],
+        sample_rates: Optional[Dict[str, float]] = None,
+        concurrency: int = 8,
+        queue_size: int = 100,
+    ):
+        self.uploader = uploader
+        self.rehost = rehost
+        self.sample_rates = sample_rates or dict(DEFAULT_SAMPLE_RATES)
+        self.concurrency = concurrency
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def submit(self, job) -> None:
+        """Queue a published gallery; dropped if the verifier is backlogged."""
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            logger.warning(f"Verifier queue full, skipping {job.url}")
+
+    async def _run(self) -> None:
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.verify(job)
+            except Exception as e:
+                logger.error(f"Failed to verify {job.url}: {e}")
+
+    async def _check(self, urls: Dict[int, str]) -> List[int]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def check(i: int, url: str) -> Optional[int]:
+            async with semaphore:
+                ok = await self.uploader.check_content(url)
+            backend = self.uploader.backend_of(url)
+            UPLOAD_VERIFICATIONS.inc(backend=backend, result="ok" if ok else "broken")
+            return None if ok else i
+
+        results = await asyncio.gather(*(check(i, u) for i, u in urls.items()))
+        return [i for i in results if i is not None]
+
+    async def verify(self, job) -> List[int]:
+        """Verify one gallery; returns the indexes that were uploaded again."""
+        by_backend: Dict[str, Dict[int, str]] = defaultdict(dict)
+        broken = []
+        for i, url in enumerate(job.image_urls):
+            if url is None:
+                continue
+            if url == job.dispatch_urls[i]:
+                ## All backends failed, the page links the image server
+                broken.append(i)
+            else:
+                by_backend[self.uploader.backend_of(url)][i] = url
+        for backend, urls in by_backend.items():
+            rate = self.sample_rates.get(backend, 1.0)
+            sample = {i: u for i, u in urls.items() if random.random() < rate}
+            failed = await self._check(sample)
+            if failed and len(sample) < len(urls):
+                rest = {i: u for i, u in urls.items() if i not in sample}
+                failed += await self._check(rest)
+            broken += failed
+        if not broken:
+            return []
+        logger.warning(
+            f"Re-uploading {len(broken)} of {len(job.image_urls)} images: {job.url}"
+        )
+        replaced = await self.rehost(job, broken)
+        if replaced:
+            UPLOAD_VERIFICATIONS.inc(len(replaced), backend="all", result="replaced")
+        return replaced